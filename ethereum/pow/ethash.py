@@ -7,12 +7,16 @@ from ethereum.pow.ethash_utils import *
 cache_seeds = [b"\x00" * 32]  # type: List[bytes]
 
 
-def mkcache(cache_size: int, block_number) -> List[List[int]]:
+def get_seed(block_number: int) -> bytes:
     while len(cache_seeds) <= block_number // EPOCH_LENGTH:
         new_seed = serialize_hash(ethash_sha3_256(cache_seeds[-1]))
         cache_seeds.append(new_seed)
 
-    seed = cache_seeds[block_number // EPOCH_LENGTH]
+    return cache_seeds[block_number // EPOCH_LENGTH]
+
+
+def mkcache(cache_size: int, block_number) -> List[List[int]]:
+    seed = get_seed(block_number)
     return _get_cache(seed, cache_size // HASH_BYTES)
 
 
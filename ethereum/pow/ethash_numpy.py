@@ -0,0 +1,93 @@
+"""Ethash light verification on caches kept as bytes
+
+Same results as ethash.py, which works on lists of python ints.  The cache is
+made with keccak on bytes, and hashimoto reads the cache as a NumPy array of
+little-endian words, so it can use a cache mapped from a file in place.  The
+FNV rounds of the dataset items fetched by each access are vectorized.
+"""
+from typing import Dict
+
+import numpy
+
+from ethereum.pow.ethash import get_seed
+from ethereum.pow.ethash_utils import (
+    ACCESSES,
+    CACHE_ROUNDS,
+    DATASET_PARENTS,
+    FNV_PRIME,
+    HASH_BYTES,
+    MIX_BYTES,
+    WORD_BYTES,
+    _sha3_256,
+    _sha3_512,
+    fnv,
+)
+
+WORDS_PER_HASH = HASH_BYTES // WORD_BYTES
+# numpy uint32 arithmetic wraps around, as % 2 ** 32 in fnv
+_FNV_PRIME = numpy.uint32(FNV_PRIME)
+
+
+def _fnv(v1: numpy.ndarray, v2: numpy.ndarray) -> numpy.ndarray:
+    return v1 * _FNV_PRIME ^ v2
+
+
+def _sha3_512_rows(rows: numpy.ndarray) -> numpy.ndarray:
+    return numpy.frombuffer(
+        b"".join(_sha3_512(row.tobytes()) for row in rows), dtype="<u4"
+    ).reshape(-1, WORDS_PER_HASH)
+
+
+def mkcache_bytes(cache_size: int, block_number: int) -> bytes:
+    n = cache_size // HASH_BYTES
+    # Sequentially produce the initial dataset
+    o = [_sha3_512(get_seed(block_number))]
+    for i in range(1, n):
+        o.append(_sha3_512(o[-1]))
+
+    # Use a low-round version of randmemohash, xor-ing the rows as 512-bit ints
+    for _ in range(CACHE_ROUNDS):
+        for i in range(n):
+            v = int.from_bytes(o[i][:WORD_BYTES], byteorder="little") % n
+            x = int.from_bytes(o[i - 1], byteorder="little") ^ int.from_bytes(
+                o[v], byteorder="little"
+            )
+            o[i] = _sha3_512(x.to_bytes(HASH_BYTES, byteorder="little"))
+
+    return b"".join(o)
+
+
+def calc_dataset_items(cache: numpy.ndarray, indices: numpy.ndarray) -> numpy.ndarray:
+    n = len(cache)
+    # initialize the mixes
+    mix = cache[indices % n]
+    mix[:, 0] ^= indices
+    mix = _sha3_512_rows(mix)
+    # fnv them with a lot of random cache nodes based on the indices
+    for j in range(DATASET_PARENTS):
+        cache_index = _fnv(indices ^ j, mix[:, j % WORDS_PER_HASH])
+        mix = _fnv(mix, cache[cache_index % n])
+    return _sha3_512_rows(mix)
+
+
+def hashimoto_light(
+    full_size: int, cache: bytes, header: bytes, nonce: bytes
+) -> Dict[bytes, bytes]:
+    """cache is any bytes-like object holding the serialized cache"""
+    cache = numpy.frombuffer(cache, dtype="<u4").reshape(-1, WORDS_PER_HASH)
+    n = full_size // HASH_BYTES
+    w = MIX_BYTES // WORD_BYTES
+    mixhashes = MIX_BYTES // HASH_BYTES
+    # combine header+nonce into a 64 byte seed
+    s = _sha3_512(header + nonce[::-1])
+    s0 = int.from_bytes(s[:WORD_BYTES], byteorder="little")
+    mix = numpy.tile(numpy.frombuffer(s, dtype="<u4"), mixhashes)
+    # mix in random dataset nodes
+    for i in range(ACCESSES):
+        p = fnv(i ^ s0, int(mix[i % w])) % (n // mixhashes) * mixhashes
+        indices = numpy.arange(p, p + mixhashes, dtype=numpy.uint32)
+        mix = _fnv(mix, calc_dataset_items(cache, indices).reshape(-1))
+    # compress mix
+    cmix = _fnv(_fnv(_fnv(mix[0::4], mix[1::4]), mix[2::4]), mix[3::4])
+    cmix = cmix.astype("<u4").tobytes()
+    return {b"mix digest": cmix, b"result": _sha3_256(s + cmix)}
@@ -1,6 +1,10 @@
+import mmap
+import os
+import threading
 import warnings
+from collections import OrderedDict
 from functools import lru_cache
-from typing import Tuple, Optional, List, Union
+from typing import Callable, Tuple, Optional, List, Union
 
 from eth_utils import big_endian_to_int
 
@@ -12,8 +16,13 @@ try:
 
     ETHASH_LIB = "pyethash"  # the C++ based implementation
 except ImportError:
-    ETHASH_LIB = "ethash"
-    warnings.warn("using pure python implementation", ImportWarning)
+    try:
+        from ethereum.pow import ethash_numpy
+
+        ETHASH_LIB = "numpy"
+    except ImportError:
+        ETHASH_LIB = "ethash"
+        warnings.warn("using pure python implementation", ImportWarning)
 
 
 # always have python implementation declared
@@ -31,17 +40,98 @@ def hashimoto_slow(
     return ethash.hashimoto_light(full_size, cache, mining_hash, bin_nonce)
 
 
+class CacheManager:
+    """Serialized caches of the epochs, made by make_cache(cache_size, block_number).
+
+    The caches of the last few epochs used are kept in memory.  With a cache_dir,
+    each cache is also stored in a file named after its epoch seed, which is
+    loaded the first time the epoch is used instead of making the cache again,
+    e.g. after a restart.  With use_mmap the file is mapped read-only rather
+    than read.
+    """
+
+    def __init__(
+        self,
+        make_cache: Callable[[int, int], bytes],
+        cache_dir: Optional[str] = None,
+        max_caches=4,
+        use_mmap=False,
+    ):
+        self.make_cache = make_cache
+        self.cache_dir = cache_dir
+        self.max_caches = max_caches
+        self.use_mmap = use_mmap
+        self.caches = OrderedDict()  # seed -> cache
+        self.lock = threading.Lock()
+
+    def get_cache(self, cache_size: int, block_number: int):
+        seed = ethash.get_seed(block_number)
+        with self.lock:
+            if seed in self.caches:
+                self.caches.move_to_end(seed)
+                return self.caches[seed]
+            cache = self.__load(seed, cache_size) if self.cache_dir else None
+            if cache is None:
+                cache = self.make_cache(cache_size, block_number)
+                if self.cache_dir:
+                    self.__store(seed, cache)
+            self.caches[seed] = cache
+            while len(self.caches) > self.max_caches:
+                self.caches.popitem(last=False)
+            return cache
+
+    def __get_path(self, seed: bytes) -> str:
+        return os.path.join(self.cache_dir, "ethash-{}.cache".format(seed.hex()))
+
+    def __load(self, seed: bytes, cache_size: int):
+        try:
+            with open(self.__get_path(seed), "rb") as f:
+                if os.fstat(f.fileno()).st_size != cache_size:
+                    return None
+                if self.use_mmap:
+                    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                return f.read()
+        except (OSError, ValueError):
+            return None
+
+    def __store(self, seed: bytes, cache: bytes):
+        path = self.__get_path(seed)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(cache)
+            os.replace(tmp_path, path)
+        except OSError:
+            # other processes will make the cache themselves
+            pass
+
+
 if ETHASH_LIB == "ethash":
+    CACHE_MANAGER = None
     get_cache = get_cache_slow
     hashimoto = hashimoto_slow
-elif ETHASH_LIB == "pyethash":
+elif ETHASH_LIB == "numpy":
+    # the cache is read in place, only the pages used are loaded
+    CACHE_MANAGER = CacheManager(ethash_numpy.mkcache_bytes, use_mmap=True)
+    get_cache = CACHE_MANAGER.get_cache
 
-    @lru_cache(10)
-    def calculate_cache(n):
-        return pyethash.mkcache_bytes(n * EPOCH_LENGTH)
+    def hashimoto(
+        block_number: int,
+        full_size: int,
+        cache: Union[List[List[int]], bytes],
+        mining_hash: bytes,
+        bin_nonce: bytes,
+    ):
+        return ethash_numpy.hashimoto_light(full_size, cache, mining_hash, bin_nonce)
 
-    def get_cache(cache_size: int, block_number: int):
-        return calculate_cache(block_number // EPOCH_LENGTH)
+
+elif ETHASH_LIB == "pyethash":
+    # pyethash takes the cache as read-only bytes, which a mapped file is not
+    CACHE_MANAGER = CacheManager(
+        lambda cache_size, block_number: pyethash.mkcache_bytes(block_number)
+    )
+    get_cache = CACHE_MANAGER.get_cache
 
     def hashimoto(
         block_number: int,
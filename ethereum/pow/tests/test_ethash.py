@@ -1,8 +1,16 @@
+import os
+import tempfile
 import unittest
 
+from ethereum.pow import ethash_numpy
 from ethereum.pow.ethash import mkcache, calc_dataset, hashimoto_light, hashimoto_full
-from ethereum.pow.ethash_utils import EPOCH_LENGTH, HASH_BYTES, serialize_hash
-from ethereum.pow.ethpow import EthashMiner, check_pow
+from ethereum.pow.ethash_utils import (
+    EPOCH_LENGTH,
+    HASH_BYTES,
+    serialize_cache,
+    serialize_hash,
+)
+from ethereum.pow.ethpow import CacheManager, EthashMiner, check_pow
 
 
 class TestEthash(unittest.TestCase):
@@ -129,3 +137,44 @@ class TestEthash(unittest.TestCase):
                 1, header_hash, mixhash, nonce_found, diff, is_test=False
             )
             self.assertTrue(validity)
+
+    def test_numpy_implementation(self):
+        header_hash = b"\xca/\xf0l\xaa\xe7\xc9M\xc9h\xbe}v\xd0\xfb\xf6\r\xd2\xe1\x98\x9e\xe9\xbf\rY1\xe4\x85d\xd5\x14;"
+        for block_number in (0, EPOCH_LENGTH):
+            cache = mkcache(1024, block_number)
+            cache_bytes = ethash_numpy.mkcache_bytes(1024, block_number)
+            self.assertEqual(cache_bytes, serialize_cache(cache))
+            for nonce in range(5):
+                bin_nonce = nonce.to_bytes(8, byteorder="big")
+                self.assertEqual(
+                    ethash_numpy.hashimoto_light(
+                        32 * 1024, cache_bytes, header_hash, bin_nonce
+                    ),
+                    hashimoto_light(32 * 1024, cache, header_hash, bin_nonce),
+                )
+
+    def test_cache_manager(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            manager = CacheManager(
+                ethash_numpy.mkcache_bytes, cache_dir=cache_dir, max_caches=2
+            )
+            cache = manager.get_cache(1024, 1)
+            self.assertEqual(cache, serialize_cache(mkcache(1024, 1)))
+            self.assertIs(manager.get_cache(1024, EPOCH_LENGTH - 1), cache)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            # loaded after a restart instead of being made again
+            other = CacheManager(None, cache_dir=cache_dir, use_mmap=True)
+            self.assertEqual(bytes(other.get_cache(1024, 1)), cache)
+            output = ethash_numpy.hashimoto_light(
+                32 * 1024, other.get_cache(1024, 1), bytes(32), bytes(8)
+            )
+            self.assertEqual(
+                output,
+                hashimoto_light(32 * 1024, mkcache(1024, 1), bytes(32), bytes(8)),
+            )
+
+            manager.get_cache(1024, EPOCH_LENGTH)
+            manager.get_cache(1024, EPOCH_LENGTH * 2)
+            self.assertEqual(len(manager.caches), 2)
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
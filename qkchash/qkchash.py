@@ -164,6 +164,14 @@ class QkcHashNative:
         ptr = self._cache_create(cache, len(cache))
         return QkcHashCache(self, ptr)
 
+    def create_cache(self, cache):
+        """Cache from a writable buffer of sorted uint64, e.g. an array("Q") or a
+        memory-mapped file, read in place and not kept"""
+        cache = memoryview(cache).cast("B").cast("Q")
+        array = (ctypes.c_uint64 * len(cache)).from_buffer(cache)
+        ptr = self._cache_create(array, len(cache))
+        return QkcHashCache(self, ptr)
+
     def calculate_hash(self, header, nonce, cache):
         s = sha3_512(header + nonce[::-1])
         seed = list_to_uint64_array(s)
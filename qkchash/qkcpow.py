@@ -1,9 +1,14 @@
+import mmap
 import os
+import threading
+from array import array
+from collections import OrderedDict
 from functools import lru_cache
 from typing import Optional, Tuple, Dict
 
 from qkchash.qkchash import (
     CACHE_ENTRIES,
+    EPOCH_LENGTH,
     make_cache,
     qkchash,
     QkcHashNative,
@@ -27,15 +32,109 @@ def init_qkc_hash_native():
 QKC_HASH_NATIVE = init_qkc_hash_native()
 
 
+class CacheManager:
+    """Caches of the epochs by seed, for the native library if it is loaded.
+
+    The caches of the last few epochs used are kept in memory.  With a cache_dir,
+    each cache is also stored in a file named after its seed, which the other
+    processes map instead of generating the cache again.  Using the cache of an
+    epoch starts preparing the cache of the next epoch in the background.
+    """
+
+    def __init__(self, native=None, cache_dir: Optional[str] = None, max_caches=4):
+        self.native = native
+        self.cache_dir = cache_dir
+        self.max_caches = max_caches
+        self.caches = OrderedDict()  # seed -> cache
+        self.pending = {}  # seed -> threading.Event set once the cache is ready
+        self.lock = threading.Lock()
+
+    def get_cache(self, block_number: int):
+        cache = self.get_cache_by_seed(get_seed_from_block_number(block_number))
+        self.precompute(get_seed_from_block_number(block_number + EPOCH_LENGTH))
+        return cache
+
+    def precompute(self, seed: bytes):
+        with self.lock:
+            if seed in self.caches or seed in self.pending:
+                return
+        threading.Thread(
+            target=self.get_cache_by_seed, args=(seed,), daemon=True
+        ).start()
+
+    def get_cache_by_seed(self, seed: bytes):
+        while True:
+            with self.lock:
+                if seed in self.caches:
+                    self.caches.move_to_end(seed)
+                    return self.caches[seed]
+                ready = self.pending.get(seed)
+                if ready is None:
+                    ready = self.pending[seed] = threading.Event()
+                    break
+            # being prepared by another thread
+            ready.wait()
+
+        cache = None
+        try:
+            cache = self.__load_or_make_cache(seed)
+        finally:
+            with self.lock:
+                del self.pending[seed]
+                if cache is not None:
+                    self.caches[seed] = cache
+                    while len(self.caches) > self.max_caches:
+                        self.caches.popitem(last=False)
+            ready.set()
+        return cache
+
+    def __get_path(self, seed: bytes) -> str:
+        return os.path.join(self.cache_dir, "{}.cache".format(seed.hex()))
+
+    def __load_or_make_cache(self, seed: bytes):
+        data = self.__load(seed) if self.cache_dir else None
+        if data is None:
+            data = array("Q", make_cache(CACHE_ENTRIES, seed))
+            if self.cache_dir:
+                self.__store(seed, data)
+        if self.native is None:
+            return data.tolist()
+        return self.native.create_cache(data)
+
+    def __load(self, seed: bytes) -> Optional[memoryview]:
+        try:
+            with open(self.__get_path(seed), "rb") as f:
+                # copy-on-write so that the native library can read it in place
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError):
+            return None
+        if len(data) != CACHE_ENTRIES * 8:
+            return None
+        return memoryview(data).cast("Q")
+
+    def __store(self, seed: bytes, data: array):
+        path = self.__get_path(seed)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                data.tofile(f)
+            os.replace(tmp_path, path)
+        except OSError:
+            # other processes will make the cache themselves
+            pass
+
+
+CACHE_MANAGER = CacheManager(QKC_HASH_NATIVE)
+
+
 def get_mining_output(
     block_number: int, header_hash: bytes, nonce: bytes
 ) -> Dict[str, bytes]:
-    seed = get_seed_from_block_number(block_number)
+    current_cache = CACHE_MANAGER.get_cache(block_number)
     if QKC_HASH_NATIVE is None:
-        current_cache = make_cache(CACHE_ENTRIES, seed)
         mining_output = qkchash(header_hash, nonce, current_cache)
     else:
-        current_cache = QKC_HASH_NATIVE.make_cache(CACHE_ENTRIES, seed)
         mining_output = QKC_HASH_NATIVE.calculate_hash(
             header_hash, nonce, current_cache
         )
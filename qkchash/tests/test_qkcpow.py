@@ -1,6 +1,9 @@
+import os
+import tempfile
 import unittest
 
-from qkchash.qkcpow import QkchashMiner, check_pow
+from qkchash.qkchash import EPOCH_LENGTH, get_seed_from_block_number, make_cache
+from qkchash.qkcpow import CacheManager, QkchashMiner, check_pow
 
 
 class TestQkcPow(unittest.TestCase):
@@ -26,3 +29,26 @@ class TestQkcPow(unittest.TestCase):
         # wrong epoch
         height = 30001
         self.assertFalse(check_pow(height, header, mixhash, nonce, diff))
+
+    def test_cache_manager(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            manager = CacheManager(cache_dir=cache_dir, max_caches=2)
+            cache = manager.get_cache(EPOCH_LENGTH)
+            seed = get_seed_from_block_number(EPOCH_LENGTH)
+            self.assertEqual(cache, make_cache(len(cache), seed))
+            self.assertIs(manager.get_cache(EPOCH_LENGTH + 1), cache)
+
+            # the next epoch is prepared in the background
+            next_seed = get_seed_from_block_number(EPOCH_LENGTH * 2)
+            self.assertIsNotNone(manager.get_cache_by_seed(next_seed))
+            self.assertEqual(
+                sorted(os.listdir(cache_dir)),
+                sorted(s.hex() + ".cache" for s in (seed, next_seed)),
+            )
+
+            # other processes map the file
+            other = CacheManager(cache_dir=cache_dir)
+            self.assertEqual(other.get_cache_by_seed(seed), cache)
+
+            manager.get_cache(0)
+            self.assertEqual(len(manager.caches), 2)
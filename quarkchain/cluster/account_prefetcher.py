@@ -0,0 +1,65 @@
+""" Reads the accounts a minor block is known to access before its transactions
+are executed
+
+The senders, recipients and the coinbase of a block are known before running
+it.  Their accounts are looked up in the state trie together, reading the trie
+nodes at each depth with one multi_get of the db, and cached in the EVM state so
+that executing the transactions does not wait on the db for them.  The work is
+split over a few threads, recovering the senders of the transactions and
+reading the storage root of the accounts as well.
+
+Only accounts existing in the trie are cached: blank accounts take the full
+shard key of the transaction creating them.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from quarkchain.evm import trie
+from quarkchain.utils import Logger
+
+
+def _recover_senders(evm_txs):
+    addresses = set()
+    for evm_tx in evm_txs:
+        try:
+            addresses.add(evm_tx.sender)
+        except Exception:
+            # left for the validation of the tx to reject
+            continue
+        if evm_tx.to:
+            addresses.add(evm_tx.to)
+    return addresses
+
+
+def _read_accounts(state, addresses):
+    return {
+        address: state.decode_account(address, rlpdata)
+        for address, rlpdata in state.trie.get_many(addresses).items()
+        if rlpdata != trie.BLANK_NODE
+    }
+
+
+class AccountPrefetcher:
+    def __init__(self, threads):
+        self.threads = threads
+        self.pool = ThreadPoolExecutor(threads)
+
+    def __split(self, items):
+        size = max((len(items) + self.threads - 1) // self.threads, 1)
+        return [items[i : i + size] for i in range(0, len(items), size)]
+
+    def prefetch(self, state, evm_txs):
+        """ Recovers the senders of evm_txs and caches the accounts of the txs
+        and of the coinbase in state, returns the number of accounts looked up """
+        addresses = {state.block_coinbase}
+        for chunk in self.pool.map(_recover_senders, self.__split(evm_txs)):
+            addresses.update(chunk)
+        addresses = [a for a in addresses if a not in state.cache]
+        try:
+            for accounts in self.pool.map(
+                _read_accounts, [state] * self.threads, self.__split(addresses)
+            ):
+                state.cache_accounts(accounts)
+        except Exception as e:
+            # the accounts are read again while executing the txs
+            Logger.warning("Failed to prefetch accounts: {}".format(e))
+        return len(addresses)
@@ -10,7 +10,7 @@ from quarkchain.cluster.monitoring import KafkaSampleLogger
 from quarkchain.cluster.rpc import SlaveInfo
 from quarkchain.config import BaseConfig, ChainConfig, QuarkChainConfig
 from quarkchain.core import Address, ChainMask
-from quarkchain.utils import Logger, check, is_p2
+from quarkchain.utils import Logger, check, is_p2, p2_roundup
 
 DEFAULT_HOST = socket.gethostbyname(socket.gethostname())
 
@@ -84,6 +84,10 @@ def update_genesis_alloc(cluser_config):
 
 class MasterConfig(BaseConfig):
     MASTER_TO_SLAVE_CONNECT_RETRY_DELAY = 1.0
+    # max in-flight sync / user RPCs from master to each slave, more are queued, 0 for unbounded
+    # consensus RPCs such as adding root blocks are never queued
+    SLAVE_RPC_SYNC_WINDOW = 0
+    SLAVE_RPC_USER_WINDOW = 64
 
 
 class SlaveConfig(BaseConfig):
@@ -91,6 +95,14 @@ class SlaveConfig(BaseConfig):
     PORT = 38392
     ID = ""
     CHAIN_MASK_LIST = None
+    # x-shard tx lists to other slaves are held for up to this long and sent in one batch, 0 to disable
+    XSHARD_BATCH_WINDOW_MS = 0
+    # send a pending batch right away once it holds this many deposits
+    XSHARD_BATCH_MAX_DEPOSITS = 10000
+    # compress x-shard batches larger than this many bytes if the peer also enables it, 0 to disable
+    XSHARD_COMPRESSION_THRESHOLD = 0
+    # threads opening the db and initializing the state of the shards when the slave starts
+    SHARD_INIT_THREADS = 4
 
     def to_dict(self):
         ret = super().to_dict()
@@ -129,6 +141,12 @@ class MonitoringConfig(BaseConfig):
     MINER_TOPIC = "qkc_miner"
     PROPAGATION_TOPIC = "block_propagation"
     ERRORS = "error"
+    # samples are posted to Kafka in batches of up to KAFKA_BATCH_SIZE records,
+    # at least every KAFKA_FLUSH_INTERVAL_SEC seconds
+    KAFKA_BATCH_SIZE = 100
+    KAFKA_FLUSH_INTERVAL_SEC = 1.0
+    # samples buffered while Kafka is slow, dropping the oldest ones beyond it
+    KAFKA_BUFFER_SIZE = 10000
 
 
 class ClusterConfig(BaseConfig):
@@ -137,7 +155,32 @@ class ClusterConfig(BaseConfig):
     PRIVATE_JSON_RPC_PORT = 38491
     JSON_RPC_HOST = "localhost"
     PRIVATE_JSON_RPC_HOST = "localhost"
+    # port pushing new work to remote miners, on PRIVATE_JSON_RPC_HOST, 0 to disable
+    MINING_PUSH_PORT = 0
     ENABLE_TRANSACTION_HISTORY = False
+    # execute the txs of a block speculatively on this many processes, 0 or 1 to disable
+    PARALLEL_TX_WORKERS = 0
+    # read the accounts of a block with this many threads before running it, 0 to disable
+    PREFETCH_ACCOUNT_THREADS = 0
+    # number of processes mining each chain when mining locally
+    MINING_WORKERS = 1
+    # directory of the Unix sockets the slaves listen on besides their TCP ports,
+    # which the master and the slaves on the same host connect to, empty to disable
+    UNIX_SOCKET_DIR = ""
+    # ask the peers to relay new minor blocks as compact blocks, only for networks of
+    # nodes all knowing the commands as the others drop the connection on them
+    COMPACT_BLOCK_RELAY = False
+    # ask the peers to announce new transactions by hash, pulling the ones missing,
+    # only for networks of nodes all knowing the commands as for COMPACT_BLOCK_RELAY
+    TX_ANNOUNCEMENT = False
+    # transactions to a peer are held for up to this long and sent in one command, 0 to disable
+    TX_BROADCAST_WINDOW_MS = 0
+    # responses of the hot read JSON-RPC methods cached until the tips change, 0 to disable
+    JSON_RPC_CACHE_SIZE = 0
+    # seconds the responses not depending on the tips are cached, e.g. getStats
+    JSON_RPC_CACHE_TTL_SEC = 1.0
+    # seconds the blocks looked up by hash are cached
+    JSON_RPC_CACHE_IMMUTABLE_TTL_SEC = 600.0
 
     DB_PATH_ROOT = "./db"
     LOG_LEVEL = "info"
@@ -181,6 +224,14 @@ class ClusterConfig(BaseConfig):
             )
         return results
 
+    def get_slave_socket_path(self, id):
+        """ Returns the path of the Unix socket of the slave, empty if disabled """
+        if not self.UNIX_SOCKET_DIR:
+            return ""
+        if isinstance(id, bytes):
+            id = id.decode("ascii")
+        return os.path.join(self.UNIX_SOCKET_DIR, "slave-{}.sock".format(id))
+
     def get_slave_config(self, id):
         for slave in self.SLAVE_LIST:
             if slave.ID == id:
@@ -201,6 +252,10 @@ class ClusterConfig(BaseConfig):
     def use_mem_db(self):
         return not self.DB_PATH_ROOT
 
+    def get_pow_cache_dir(self):
+        """ PoW caches shared by the master and the slaves """
+        return os.path.join(self.DB_PATH_ROOT, "pow_cache")
+
     @classmethod
     def attach_arguments(cls, parser):
         parser.add_argument("--cluster_config", default="", type=str)
@@ -237,6 +292,13 @@ class ClusterConfig(BaseConfig):
         )
 
         parser.add_argument("--num_slaves", default=4, type=int)
+        parser.add_argument(
+            "--slave_per_chain",
+            action="store_true",
+            default=False,
+            dest="slave_per_chain",
+            help="runs the shards of each chain on a slave process of its own, ignoring --num_slaves",
+        )
         parser.add_argument("--port_start", default=38000, type=int)
         parser.add_argument(
             "--db_path_root", default=ClusterConfig.DB_PATH_ROOT, type=str
@@ -262,6 +324,42 @@ class ClusterConfig(BaseConfig):
             default=ClusterConfig.PRIVATE_JSON_RPC_HOST,
             type=str,
         )
+        parser.add_argument(
+            "--mining_push_port", default=ClusterConfig.MINING_PUSH_PORT, type=int
+        )
+        parser.add_argument(
+            "--unix_socket_dir", default=ClusterConfig.UNIX_SOCKET_DIR, type=str
+        )
+        parser.add_argument(
+            "--compact_block_relay",
+            action="store_true",
+            default=False,
+            dest="compact_block_relay",
+        )
+        parser.add_argument(
+            "--tx_announcement",
+            action="store_true",
+            default=False,
+            dest="tx_announcement",
+        )
+        parser.add_argument(
+            "--tx_broadcast_window_ms",
+            default=ClusterConfig.TX_BROADCAST_WINDOW_MS,
+            type=int,
+        )
+        parser.add_argument(
+            "--json_rpc_cache_size", default=ClusterConfig.JSON_RPC_CACHE_SIZE, type=int
+        )
+        parser.add_argument(
+            "--json_rpc_cache_ttl_sec",
+            default=ClusterConfig.JSON_RPC_CACHE_TTL_SEC,
+            type=float,
+        )
+        parser.add_argument(
+            "--json_rpc_cache_immutable_ttl_sec",
+            default=ClusterConfig.JSON_RPC_CACHE_IMMUTABLE_TTL_SEC,
+            type=float,
+        )
         parser.add_argument(
             "--enable_transaction_history",
             action="store_true",
@@ -323,7 +421,10 @@ class ClusterConfig(BaseConfig):
                 is_p2(args.num_shards_per_chain),
                 "--num_shards_per_chain must be power of 2",
             )
-            check(is_p2(args.num_slaves), "--num_slaves must be power of 2")
+            num_slaves = args.num_slaves
+            if args.slave_per_chain:
+                num_slaves = p2_roundup(args.num_chains)
+            check(is_p2(num_slaves), "--num_slaves must be power of 2")
 
             config = ClusterConfig()
             config.LOG_LEVEL = args.log_level
@@ -334,10 +435,20 @@ class ClusterConfig(BaseConfig):
             config.PRIVATE_JSON_RPC_PORT = args.json_rpc_private_port
             config.JSON_RPC_HOST = args.json_rpc_host
             config.PRIVATE_JSON_RPC_HOST = args.json_rpc_private_host
+            config.MINING_PUSH_PORT = args.mining_push_port
+            config.UNIX_SOCKET_DIR = args.unix_socket_dir
 
             config.CLEAN = args.clean
             config.START_SIMULATED_MINING = args.start_simulated_mining
             config.ENABLE_TRANSACTION_HISTORY = args.enable_transaction_history
+            config.COMPACT_BLOCK_RELAY = args.compact_block_relay
+            config.TX_ANNOUNCEMENT = args.tx_announcement
+            config.TX_BROADCAST_WINDOW_MS = args.tx_broadcast_window_ms
+            config.JSON_RPC_CACHE_SIZE = args.json_rpc_cache_size
+            config.JSON_RPC_CACHE_TTL_SEC = args.json_rpc_cache_ttl_sec
+            config.JSON_RPC_CACHE_IMMUTABLE_TTL_SEC = (
+                args.json_rpc_cache_immutable_ttl_sec
+            )
 
             config.QUARKCHAIN.update(
                 args.num_chains,
@@ -371,11 +482,14 @@ class ClusterConfig(BaseConfig):
                 )
 
             config.SLAVE_LIST = []
-            for i in range(args.num_slaves):
+            for i in range(num_slaves):
+                # slave i covers chain i only, past the last chain there is none
+                if args.slave_per_chain and i >= args.num_chains:
+                    break
                 slave_config = SlaveConfig()
                 slave_config.PORT = args.port_start + i
                 slave_config.ID = "S{}".format(i)
-                slave_config.CHAIN_MASK_LIST = [ChainMask(i | args.num_slaves)]
+                slave_config.CHAIN_MASK_LIST = [ChainMask(i | num_slaves)]
 
                 config.SLAVE_LIST.append(slave_config)
 
@@ -0,0 +1,361 @@
+""" A read-only JSON-RPC gateway running as its own process.
+
+The gateway connects to the slaves directly and serves the public read methods
+of JSONRPCServer from them, so read traffic does not go through the master.
+Everything else (e.g. sendRawTransaction, submitWork and the root chain
+queries) is forwarded to the JSON-RPC server of the master.
+
+Start it after the slaves.  It tells them it is a read-only client in its
+ping, so it may connect to them before or after master does.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+from async_armor import armor
+from jsonrpcserver.async_methods import AsyncMethods
+
+from quarkchain.cluster.cluster_config import ClusterConfig
+from quarkchain.cluster.jsonrpc import (
+    JSON_RPC_CLIENT_REQUEST_MAX_SIZE,
+    JSONRPCServer,
+    public_methods,
+)
+from quarkchain.cluster.master import MasterServer, SlaveConnection
+from quarkchain.cluster.protocol import open_slave_connection
+from quarkchain.cluster.rpc import (
+    ClusterOp,
+    CLUSTER_OP_SERIALIZER_MAP,
+    GetEcoInfoListRequest,
+    Ping,
+)
+from quarkchain.core import Branch
+from quarkchain.env import DEFAULT_ENV
+from quarkchain.protocol import Connection
+from quarkchain.utils import check, Logger
+
+# Public methods served from the slaves, the others are forwarded to master
+GATEWAY_METHODS = [
+    "echoQuantity",
+    "echoData",
+    "net_version",
+    "getTransactionCount",
+    "getBalances",
+    "getAccountData",
+    "getMinorBlockById",
+    "getMinorBlockByHeight",
+    "getTransactionById",
+    "call",
+    "estimateGas",
+    "getTransactionReceipt",
+    "getLogs",
+    "getStorageAt",
+    "getCode",
+    "getTransactionsByAddress",
+    "gasPrice",
+    "eth_gasPrice",
+    "eth_getBlockByNumber",
+    "eth_getBalance",
+    "eth_getTransactionCount",
+    "eth_getCode",
+    "eth_call",
+    "eth_getTransactionReceipt",
+    "eth_estimateGas",
+    "eth_getLogs",
+    "eth_getStorageAt",
+]
+
+
+class GatewaySlaveConnection(Connection):
+    def __init__(
+        self, env, reader, writer, gateway_server, slave_id, chain_mask_list, name=None
+    ):
+        super().__init__(
+            env, reader, writer, CLUSTER_OP_SERIALIZER_MAP, {}, {}, name=name
+        )
+        self.gateway_server = gateway_server
+        self.id = slave_id
+        self.chain_mask_list = chain_mask_list
+
+        asyncio.ensure_future(self.active_and_loop_forever())
+
+    async def send_ping(self):
+        req = Ping(self.gateway_server.id, [], None, read_only=True)
+        op, resp, rpc_id = await self.write_rpc_request(ClusterOp.PING, req)
+        return resp.id, resp.chain_mask_list
+
+    async def get_tip_height(self, branch: Branch) -> Optional[int]:
+        _, resp, _ = await self.write_rpc_request(
+            ClusterOp.GET_ECO_INFO_LIST_REQUEST, GetEcoInfoListRequest()
+        )
+        for eco_info in resp.eco_info_list:
+            if eco_info.branch == branch:
+                # eco info carries the height of the next block
+                return eco_info.height - 1
+        return None
+
+    def close(self):
+        Logger.info("Lost connection with slave {}".format(self.id))
+        super().close()
+        self.gateway_server.shutdown()
+
+    # Same queries as the ones from master
+    has_shard = SlaveConnection.has_shard
+    execute_transaction = SlaveConnection.execute_transaction
+    get_minor_block_by_hash = SlaveConnection.get_minor_block_by_hash
+    get_minor_block_by_height = SlaveConnection.get_minor_block_by_height
+    get_transaction_by_hash = SlaveConnection.get_transaction_by_hash
+    get_transaction_receipt = SlaveConnection.get_transaction_receipt
+    get_transactions_by_address = SlaveConnection.get_transactions_by_address
+    get_logs = SlaveConnection.get_logs
+    estimate_gas = SlaveConnection.estimate_gas
+    get_storage_at = SlaveConnection.get_storage_at
+    get_code = SlaveConnection.get_code
+    gas_price = SlaveConnection.gas_price
+
+
+class GatewayServer:
+    """ Serves the public JSON-RPC read methods from the slaves """
+
+    def __init__(
+        self,
+        env,
+        master_json_rpc_url,
+        port,
+        host="localhost",
+        cache_ttl=1.0,
+        cache_size=10000,
+        name="gateway",
+    ):
+        self.loop = asyncio.get_event_loop()
+        self.env = env
+        self.master_json_rpc_url = master_json_rpc_url
+        self.port = port
+        self.host = host
+        self.name = name
+        self.id = "{}_{}".format(name, port)
+
+        # branch value -> a list of slave running the shard
+        self.branch_to_slaves = dict()
+        self.slave_pool = set()
+
+        # (method, params) -> (expire time, result), least recently used first
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hit_count = 0
+        self.cache_miss_count = 0
+
+        methods = AsyncMethods()
+        for method in GATEWAY_METHODS:
+            methods.add(public_methods[method])
+        # The handlers are bound to a JSONRPCServer whose master is this gateway
+        self.json_rpc_server = JSONRPCServer(env, self, port, host, methods)
+        self.session = None
+        self.runner = None
+        self.shutdown_future = self.loop.create_future()
+
+    async def __connect_to_slaves(self):
+        futures = []
+        slaves = []
+        for slave_info in self.env.cluster_config.get_slave_info_list():
+            reader, writer = await open_slave_connection(
+                self.env.cluster_config, slave_info, loop=self.loop
+            )
+            slave = GatewaySlaveConnection(
+                self.env,
+                reader,
+                writer,
+                self,
+                slave_info.id,
+                slave_info.chain_mask_list,
+                name="{}_slave_{}".format(self.name, slave_info.id),
+            )
+            await slave.wait_until_active()
+            futures.append(slave.send_ping())
+            slaves.append(slave)
+
+        results = await asyncio.gather(*futures)
+
+        full_shard_ids = self.env.quark_chain_config.get_full_shard_ids()
+        for slave, result in zip(slaves, results):
+            id, chain_mask_list = result
+            check(id == slave.id)
+            check(chain_mask_list == slave.chain_mask_list)
+            self.slave_pool.add(slave)
+            for full_shard_id in full_shard_ids:
+                if slave.has_shard(full_shard_id):
+                    self.branch_to_slaves.setdefault(full_shard_id, []).append(slave)
+
+    async def __handle(self, request):
+        body = await request.text()
+        try:
+            d = json.loads(body)
+        except Exception:
+            d = None
+        # batch requests and methods not served here go to master
+        if not isinstance(d, dict) or d.get("method") not in GATEWAY_METHODS:
+            return await self.__forward_to_master(body)
+
+        key = (d["method"], json.dumps(d.get("params"), sort_keys=True))
+        entry = self.cache.get(key, None)
+        if entry is not None and entry[0] > time.time():
+            self.cache_hit_count += 1
+            self.cache.move_to_end(key)
+            if "id" not in d:
+                return web.Response()
+            return web.json_response(
+                {"jsonrpc": "2.0", "result": entry[1], "id": d["id"]}
+            )
+
+        self.cache_miss_count += 1
+        response = await armor(self.json_rpc_server.handlers.dispatch(body))
+        if "result" in response and self.cache_ttl > 0:
+            self.cache[key] = (time.time() + self.cache_ttl, response["result"])
+            self.cache.move_to_end(key)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        if "error" in response:
+            Logger.error(response)
+        if response.is_notification:
+            return web.Response()
+        return web.json_response(response, status=response.http_status)
+
+    async def __forward_to_master(self, body):
+        async with self.session.post(
+            self.master_json_rpc_url,
+            data=body,
+            headers={"Content-Type": "application/json"},
+        ) as resp:
+            return web.Response(
+                body=await resp.read(),
+                status=resp.status,
+                content_type=resp.content_type,
+            )
+
+    def start(self):
+        self.loop.run_until_complete(self.__connect_to_slaves())
+        self.session = aiohttp.ClientSession(loop=self.loop)
+
+        app = web.Application(client_max_size=JSON_RPC_CLIENT_REQUEST_MAX_SIZE)
+        app.router.add_post("/", self.__handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, self.host, self.port)
+        self.loop.run_until_complete(site.start())
+        Logger.info("Gateway listening on {}:{}".format(self.host, self.port))
+
+    def do_loop(self):
+        try:
+            self.loop.run_until_complete(self.shutdown_future)
+        except KeyboardInterrupt:
+            pass
+
+    def shutdown(self):
+        if not self.shutdown_future.done():
+            self.shutdown_future.set_result(None)
+
+    def stop(self):
+        """ Close the connections and the JSON-RPC server """
+        self.shutdown()
+        for slave in self.slave_pool:
+            slave.close()
+        if self.runner:
+            self.loop.run_until_complete(self.runner.cleanup())
+        if self.session:
+            self.loop.run_until_complete(self.session.close())
+
+    def get_cache_stats(self):
+        return {
+            "size": len(self.cache),
+            "hitCount": self.cache_hit_count,
+            "missCount": self.cache_miss_count,
+        }
+
+    async def __get_tip_height(self, branch):
+        return await self.branch_to_slaves[branch.value][0].get_tip_height(branch)
+
+    # Queries that need nothing but the slaves are the same as master's
+    get_account_data = MasterServer.get_account_data
+    get_primary_account_data = MasterServer.get_primary_account_data
+    execute_transaction = MasterServer.execute_transaction
+    get_minor_block_by_hash = MasterServer.get_minor_block_by_hash
+    get_transaction_by_hash = MasterServer.get_transaction_by_hash
+    get_transaction_receipt = MasterServer.get_transaction_receipt
+    get_transactions_by_address = MasterServer.get_transactions_by_address
+    estimate_gas = MasterServer.estimate_gas
+    get_storage_at = MasterServer.get_storage_at
+    get_code = MasterServer.get_code
+    gas_price = MasterServer.gas_price
+
+    # Master knows the shard tips from the headers slaves send to it,
+    # the gateway asks the slave instead
+    async def get_minor_block_by_height(self, height: Optional[int], branch):
+        if branch.value not in self.branch_to_slaves:
+            return None
+
+        slave = self.branch_to_slaves[branch.value][0]
+        if height is None:
+            height = await slave.get_tip_height(branch)
+        return await slave.get_minor_block_by_height(height, branch)
+
+    async def get_logs(self, addresses, topics, start_block, end_block, branch):
+        if branch.value not in self.branch_to_slaves:
+            return None
+
+        if start_block == "latest" or end_block == "latest":
+            height = await self.__get_tip_height(branch)
+            if start_block == "latest":
+                start_block = height
+            if end_block == "latest":
+                end_block = height
+
+        slave = self.branch_to_slaves[branch.value][0]
+        return await slave.get_logs(branch, addresses, topics, start_block, end_block)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    ClusterConfig.attach_arguments(parser)
+    parser.add_argument("--gateway_port", default=38591, type=int)
+    parser.add_argument("--gateway_host", default="localhost", type=str)
+    # seconds a read result is served from the cache, 0 to disable
+    parser.add_argument("--gateway_cache_ttl", default=1.0, type=float)
+    parser.add_argument("--gateway_cache_size", default=10000, type=int)
+    args = parser.parse_args()
+
+    env = DEFAULT_ENV.copy()
+    env.cluster_config = ClusterConfig.create_from_args(args)
+    return env, args
+
+
+def main():
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    env, args = parse_args()
+
+    master_json_rpc_url = "http://{}:{}".format(
+        env.cluster_config.JSON_RPC_HOST, env.cluster_config.JSON_RPC_PORT
+    )
+    gateway_server = GatewayServer(
+        env,
+        master_json_rpc_url,
+        args.gateway_port,
+        args.gateway_host,
+        cache_ttl=args.gateway_cache_ttl,
+        cache_size=args.gateway_cache_size,
+    )
+    gateway_server.start()
+    gateway_server.do_loop()
+    gateway_server.stop()
+
+    Logger.info("Gateway is shutdown")
+
+
+if __name__ == "__main__":
+    main()
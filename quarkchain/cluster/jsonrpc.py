@@ -1,6 +1,8 @@
 import asyncio
 import inspect
 import json
+import time
+from collections import Counter, OrderedDict
 from typing import Callable, Dict, List
 
 import aiohttp_cors
@@ -394,6 +396,39 @@ def eth_address_to_quarkchain_address_decoder(hex_str):
     return address_decoder("0x" + eth_hex + full_shard_key_hex)
 
 
+def id_full_shard_key_decoder(hex_str):
+    return id_decoder(hex_str)[1]
+
+
+def address_full_shard_key_decoder(hex_str):
+    return int.from_bytes(address_decoder(hex_str)[20:], byteorder="big")
+
+
+# Cached until a new root tip
+CACHE_ROOT_TIP = "root_tip"
+# Looked up by hash, cached for JSON_RPC_CACHE_IMMUTABLE_TTL_SEC
+CACHE_IMMUTABLE = "immutable"
+# Cached for JSON_RPC_CACHE_TTL_SEC
+CACHE_TTL = "ttl"
+
+# Methods whose responses are cached if JSON_RPC_CACHE_SIZE is set, either the scope
+# above or (argument, decoder to the full shard key) for the responses depending
+# on the tip of a shard, cached until a new root tip or a new block in the shard
+CACHED_METHODS = {
+    "networkInfo": CACHE_TTL,
+    "getStats": CACHE_TTL,
+    "getRootBlockById": CACHE_IMMUTABLE,
+    "getRootBlockByHeight": CACHE_ROOT_TIP,
+    "getMinorBlockById": CACHE_IMMUTABLE,
+    "getMinorBlockByHeight": ("full_shard_key", quantity_decoder),
+    "getTransactionById": ("tx_id", id_full_shard_key_decoder),
+    "getTransactionReceipt": ("tx_id", id_full_shard_key_decoder),
+    "getTransactionCount": ("address", address_full_shard_key_decoder),
+    "getBalances": ("address", address_full_shard_key_decoder),
+    "gasPrice": ("full_shard_key", quantity_decoder),
+}
+
+
 public_methods = AsyncMethods()
 private_methods = AsyncMethods()
 
@@ -451,6 +486,12 @@ class JSONRPCServer:
         self.master = master_server
         self.counters = dict()
 
+        # (method, arguments, tips) -> (expire time, encoded result), least recently used first
+        self.cache_size = env.cluster_config.JSON_RPC_CACHE_SIZE
+        self.cache = OrderedDict()
+        self.cache_hit_counts = Counter()
+        self.cache_miss_counts = Counter()
+
         # Bind RPC handler functions to this instance
         self.handlers = AsyncMethods()
         for rpc_name in methods:
@@ -471,15 +512,101 @@ class JSONRPCServer:
             self.counters[method] += 1
         else:
             self.counters[method] = 1
+
+        key = self.__get_cache_key(d)
+        if key is not None:
+            entry = self.cache.get(key, None)
+            if entry is not None and entry[0] > time.time():
+                self.cache_hit_counts[method] += 1
+                self.cache.move_to_end(key)
+                # the result is not encoded again
+                return web.Response(
+                    text='{{"jsonrpc": "2.0", "result": {}, "id": {}}}'.format(
+                        entry[1], json.dumps(d["id"])
+                    ),
+                    content_type="application/json",
+                )
+            self.cache_miss_counts[method] += 1
+
         # Use armor to prevent the handler from being cancelled when
         # aiohttp server loses connection to client
         response = await armor(self.handlers.dispatch(request))
+        # the missing blocks and txs may show up without a new tip
+        if key is not None and response.get("result", None) is not None:
+            self.__put_cache(key, response["result"])
         if "error" in response:
             Logger.error(response)
         if response.is_notification:
             return web.Response()
         return web.json_response(response, status=response.http_status)
 
+    def __get_cache_key(self, d):
+        """ Returns the key of the cached response to the request, None if not cached """
+        if not isinstance(d, dict) or "id" not in d or self.cache_size <= 0:
+            return None
+        method = d.get("method", None)
+        if method not in CACHED_METHODS or method not in self.handlers:
+            return None
+        params = d.get("params", None)
+        signature = inspect.signature(self.handlers[method])
+        try:
+            if isinstance(params, dict):
+                call_args = signature.bind(**params)
+            else:
+                call_args = signature.bind(*(params or []))
+            call_args.apply_defaults()
+            args = json.dumps(call_args.arguments, sort_keys=True)
+            scope = CACHED_METHODS[method]
+            if scope in (CACHE_IMMUTABLE, CACHE_TTL):
+                return method, args
+            root_tip_hash = self.master.root_state.tip.get_hash()
+            if scope == CACHE_ROOT_TIP:
+                return method, args, root_tip_hash
+            name, decoder = scope
+            full_shard_id = self.env.quark_chain_config.get_full_shard_id_by_full_shard_key(
+                decoder(call_args.arguments[name])
+            )
+        except Exception:
+            # invalid params are left to the handler to report
+            return None
+        minor_block_hash = self.master.branch_to_last_minor_block_hash.get(
+            full_shard_id, None
+        )
+        return method, args, root_tip_hash, minor_block_hash
+
+    def __put_cache(self, key, result):
+        scope = CACHED_METHODS[key[0]]
+        if scope == CACHE_TTL:
+            ttl = self.env.cluster_config.JSON_RPC_CACHE_TTL_SEC
+        elif scope == CACHE_IMMUTABLE:
+            ttl = self.env.cluster_config.JSON_RPC_CACHE_IMMUTABLE_TTL_SEC
+        else:
+            # replaced by the entries of the new tips
+            ttl = float("inf")
+        self.cache[key] = (time.time() + ttl, json.dumps(result))
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def get_cache_stats(self):
+        hit_count = sum(self.cache_hit_counts.values())
+        miss_count = sum(self.cache_miss_counts.values())
+        return {
+            "size": len(self.cache),
+            "hitCount": hit_count,
+            "missCount": miss_count,
+            "hitRate": hit_count / (hit_count + miss_count)
+            if hit_count + miss_count
+            else 0,
+            "methods": {
+                method: {
+                    "hitCount": self.cache_hit_counts[method],
+                    "missCount": self.cache_miss_counts[method],
+                }
+                for method in set(self.cache_hit_counts) | set(self.cache_miss_counts)
+            },
+        }
+
     def start(self):
         app = web.Application(client_max_size=JSON_RPC_CLIENT_REQUEST_MAX_SIZE)
         cors = aiohttp_cors.setup(app)
@@ -859,6 +986,10 @@ class JSONRPCServer:
     async def getJrpcCalls(self):
         return self.counters
 
+    @public_methods.add
+    async def getJrpcCacheStats(self):
+        return self.get_cache_stats()
+
     @public_methods.add
     async def gasPrice(self, full_shard_key: int):
         full_shard_key = shard_id_decoder(full_shard_key)
@@ -1160,6 +1291,10 @@ class JSONRPCServer:
     async def getJrpcCalls(self):
         return self.counters
 
+    @private_methods.add
+    async def getJrpcCacheStats(self):
+        return self.get_cache_stats()
+
     @private_methods.add
     async def getKadRoutingTable(self):
         """ returns a list of nodes in the p2p discovery routing table, in the enode format
@@ -8,7 +8,13 @@ from collections import deque
 from typing import Optional, List, Union, Dict, Tuple
 
 from quarkchain.cluster.guardian import Guardian
-from quarkchain.cluster.miner import Miner, MiningWork, validate_seal
+from quarkchain.cluster.miner import (
+    Miner,
+    MiningWork,
+    set_pow_cache_dir,
+    validate_seal,
+    validate_seal_batch,
+)
 from quarkchain.cluster.p2p_commands import (
     CommandOp,
     Direction,
@@ -22,6 +28,7 @@ from quarkchain.cluster.protocol import (
     P2PConnection,
     ROOT_BRANCH,
     NULL_CONNECTION,
+    open_slave_connection,
 )
 from quarkchain.cluster.root_state import RootState
 from quarkchain.cluster.rpc import (
@@ -58,6 +65,7 @@ from quarkchain.cluster.rpc import (
     ConnectToSlavesRequest,
     ClusterOp,
     CLUSTER_OP_SERIALIZER_MAP,
+    CLUSTER_OP_PRIORITY_MAP,
     ExecuteTransactionRequest,
     Ping,
     GetTransactionReceiptRequest,
@@ -87,6 +95,9 @@ from quarkchain.constants import (
     ROOT_BLOCK_HEADER_LIST_LIMIT,
 )
 
+# seconds between the logs of the slaves initializing their shards
+SHARD_INIT_PROGRESS_INTERVAL = 10
+
 
 class SyncTask:
     """ Given a header and a peer, the task will synchronize the local state
@@ -234,6 +245,9 @@ class SyncTask:
                 # TODO: Remote chain may reorg, may retry the sync
                 raise RuntimeError("Bad peer sending incorrect canonical headers")
 
+            if not await self.__validate_block_header_seals(block_header_chain):
+                raise RuntimeError("Bad peer sending root block headers with bad seal")
+
             while len(block_header_chain) > 0:
                 block_chain = await asyncio.wait_for(
                     self.__download_blocks(block_header_chain[:ROOT_BLOCK_BATCH_SIZE]),
@@ -258,6 +272,27 @@ class SyncTask:
     def __has_block_hash(self, block_hash):
         return self.root_state.db.contain_root_block_by_hash(block_hash)
 
+    async def __validate_block_header_seals(self, block_header_list):
+        """ Checks the PoW of the headers before downloading their blocks
+        The full validation happens when the blocks are added """
+        config = self.master_server.env.quark_chain_config
+        diff_list = []
+        for header in block_header_list:
+            diff = header.difficulty
+            if not config.SKIP_ROOT_DIFFICULTY_CHECK and header.verify_signature(
+                config.guardian_public_key
+            ):
+                diff = Guardian.adjust_difficulty(diff, header.height)
+            diff_list.append(diff)
+        valid_list = await asyncio.get_event_loop().run_in_executor(
+            None,
+            validate_seal_batch,
+            block_header_list,
+            config.ROOT.CONSENSUS_TYPE,
+            diff_list,
+        )
+        return all(valid_list)
+
     async def __download_blocks(self, block_header_list):
         block_hash_list = [b.get_hash() for b in block_header_list]
         op, resp, rpc_id = await self.peer.write_rpc_request(
@@ -440,6 +475,17 @@ class SlaveConnection(ClusterConnection):
         self.chain_mask_list = chain_mask_list
         check(len(chain_mask_list) > 0)
 
+        # keep heavy user queries from delaying block propagation
+        master_config = env.cluster_config.MASTER
+        self.set_rpc_flow_control(
+            CLUSTER_OP_PRIORITY_MAP,
+            [
+                0,
+                master_config.SLAVE_RPC_SYNC_WINDOW,
+                master_config.SLAVE_RPC_USER_WINDOW,
+            ],
+        )
+
         asyncio.ensure_future(self.active_and_loop_forever())
 
     def get_connection_to_forward(self, metadata):
@@ -484,7 +530,7 @@ class SlaveConnection(ClusterConnection):
                 branch=ROOT_BRANCH, cluster_peer_id=RESERVED_CLUSTER_PEER_ID
             ),
         )
-        return resp.id, resp.chain_mask_list
+        return resp
 
     async def send_connect_to_slaves(self, slave_info_list):
         """ Make slave connect to other slaves.
@@ -654,9 +700,12 @@ class SlaveConnection(ClusterConnection):
             req.minor_block_header.get_hash(), req.coinbase_amount_map.balance_map
         )
         self.master_server.update_shard_stats(req.shard_stats)
+        self.master_server.update_last_minor_block_hash(req.minor_block_header)
         self.master_server.update_tx_count_history(
             req.tx_count, req.x_shard_tx_count, req.minor_block_header.create_time
         )
+        if self.master_server.work_notifier:
+            self.master_server.work_notifier.notify(req.minor_block_header.branch)
         return AddMinorBlockHeaderResponse(
             error_code=0,
             artificial_tx_config=self.master_server.get_artificial_tx_config(),
@@ -673,6 +722,7 @@ class SlaveConnection(ClusterConnection):
             Logger.info(
                 "adding {} mblock to db".format(minor_block_header.get_hash().hex())
             )
+            self.master_server.update_last_minor_block_hash(minor_block_header)
         return AddMinorBlockHeaderListResponse(error_code=0)
 
 
@@ -700,6 +750,7 @@ class MasterServer:
         self.env = env
         self.root_state = root_state  # type: RootState
         self.network = None  # will be set by network constructor
+        self.work_notifier = None  # will be set by WorkNotifier.start_server
         self.cluster_config = env.cluster_config
 
         # branch value -> a list of slave running the shard
@@ -720,6 +771,8 @@ class MasterServer:
         self.synchronizer = Synchronizer()
 
         self.branch_to_shard_stats = dict()  # type: Dict[int, ShardStats]
+        # hash of the last block added to each shard, keying the cached JSON-RPC responses
+        self.branch_to_last_minor_block_hash = dict()  # type: Dict[int, bytes]
         # (epoch in minute, tx_count in the minute)
         self.tx_count_history = deque()
 
@@ -752,6 +805,7 @@ class MasterServer:
             __get_mining_params,
             remote=root_config.CONSENSUS_CONFIG.REMOTE_MINE,
             guardian_private_key=self.env.quark_chain_config.guardian_private_key,
+            workers=self.env.cluster_config.MINING_WORKERS,
         )
 
     async def __rebroadcast_committing_root_block(self):
@@ -781,13 +835,15 @@ class MasterServer:
             self.env.quark_chain_config.get_full_shard_ids()
         ) and all([len(slaves) > 0 for _, slaves in self.branch_to_slaves.items()])
 
-    async def __connect(self, host, port):
+    async def __connect(self, slave_info):
         """ Retries until success """
+        host = slave_info.host.decode("ascii")
+        port = slave_info.port
         Logger.info("Trying to connect {}:{}".format(host, port))
         while True:
             try:
-                reader, writer = await asyncio.open_connection(
-                    host, port, loop=self.loop
+                reader, writer = await open_slave_connection(
+                    self.cluster_config, slave_info, loop=self.loop
                 )
                 break
             except Exception as e:
@@ -803,8 +859,7 @@ class MasterServer:
         futures = []
         slaves = []
         for slave_info in self.cluster_config.get_slave_info_list():
-            host = slave_info.host.decode("ascii")
-            reader, writer = await self.__connect(host, slave_info.port)
+            reader, writer = await self.__connect(slave_info)
 
             slave = SlaveConnection(
                 self.env,
@@ -824,7 +879,7 @@ class MasterServer:
         full_shard_ids = self.env.quark_chain_config.get_full_shard_ids()
         for slave, result in zip(slaves, results):
             # Verify the slave does have the same id and shard mask list as the config file
-            id, chain_mask_list = result
+            id, chain_mask_list = result.id, result.chain_mask_list
             if id != slave.id:
                 Logger.error(
                     "Slave id does not match. expect {} got {}".format(slave.id, id)
@@ -856,10 +911,30 @@ class MasterServer:
                 self.shutdown()
 
     async def __init_shards(self):
-        futures = []
+        futures = dict()
         for slave in self.slave_pool:
-            futures.append(slave.send_ping(initialize_shard_state=True))
-        await asyncio.gather(*futures)
+            futures[slave] = asyncio.ensure_future(
+                slave.send_ping(initialize_shard_state=True)
+            )
+        # the slaves initialize their shards in parallel, which may take minutes
+        while True:
+            done, pending = await asyncio.wait(
+                futures.values(), timeout=SHARD_INIT_PROGRESS_INTERVAL
+            )
+            if not pending:
+                break
+            for slave, future in futures.items():
+                if future.done():
+                    continue
+                pong = await slave.send_ping()
+                Logger.info(
+                    "Slave {} initialized {}/{} shards".format(
+                        slave.id,
+                        pong.shard_count,
+                        pong.shard_count + pong.pending_shard_count,
+                    )
+                )
+        await asyncio.gather(*futures.values())
 
     async def __send_mining_config_to_slaves(self, mining):
         futures = []
@@ -1052,8 +1127,8 @@ class MasterServer:
                 return account_branch_data
         return None
 
-    async def add_transaction(self, tx: TypedTransaction, from_peer=None):
-        """ Add transaction to the cluster and broadcast to peers """
+    async def add_transaction(self, tx: TypedTransaction):
+        """ Add transaction to the cluster, the shards broadcast it to the peers """
         evm_tx = tx.tx.to_evm_tx()
         evm_tx.set_quark_chain_config(self.env.quark_chain_config)
         branch = Branch(evm_tx.from_full_shard_id)
@@ -1064,19 +1139,7 @@ class MasterServer:
         for slave in self.branch_to_slaves[branch.value]:
             futures.append(slave.add_transaction(tx))
 
-        success = all(await asyncio.gather(*futures))
-        if not success:
-            return False
-
-        if self.network is not None:
-            for peer in self.network.iterate_peers():
-                if peer == from_peer:
-                    continue
-                try:
-                    peer.send_transaction(tx)
-                except Exception:
-                    Logger.log_exception()
-        return True
+        return all(await asyncio.gather(*futures))
 
     async def execute_transaction(
         self, tx: TypedTransaction, from_address, block_height: Optional[int]
@@ -1115,6 +1178,8 @@ class MasterServer:
         except ValueError as e:
             Logger.log_exception()
             raise e
+        if update_tip:
+            self.root_miner.reset_work()
 
         try:
             if update_tip and self.network is not None:
@@ -1129,6 +1194,9 @@ class MasterServer:
         result_list = await asyncio.gather(*future_list)
         check(all([resp.error_code == 0 for _, resp, _ in result_list]))
         self.root_state.clear_committing_hash()
+        # the work of the shards changes with the root tip as well
+        if update_tip and self.work_notifier:
+            self.work_notifier.notify_all()
 
     async def add_raw_minor_block(self, branch, block_data):
         if branch.value not in self.branch_to_slaves:
@@ -1232,6 +1300,9 @@ class MasterServer:
     def update_shard_stats(self, shard_state):
         self.branch_to_shard_stats[shard_state.branch.value] = shard_state
 
+    def update_last_minor_block_hash(self, header):
+        self.branch_to_last_minor_block_hash[header.branch.value] = header.get_hash()
+
     def update_tx_count_history(self, tx_count, xshard_tx_count, timestamp):
         """ maintain a list of tuples of (epoch minute, tx count, xshard tx count) of 12 hours window
         Note that this is also counting transactions on forks and thus larger than if only couting the best chains. """
@@ -1272,6 +1343,7 @@ class MasterServer:
             shard["blockCount60s"] = shard_stats.block_count60s
             shard["staleBlockCount60s"] = shard_stats.stale_block_count60s
             shard["lastBlockTime"] = shard_stats.last_block_time
+            shard["miningHashRates"] = shard_stats.mining_hash_rates
             shards.append(shard)
         shards.sort(key=lambda x: x["fullShardId"])
 
@@ -1335,11 +1407,20 @@ class MasterServer:
             "totalTxCount": total_tx_count,
             "syncing": self.synchronizer.running,
             "mining": self.root_miner.is_enabled(),
+            "rootMiningHashRates": self.root_miner.get_hash_rates(),
             "shards": shards,
+            "slaveRpcLanes": {
+                slave.id: slave.get_rpc_lane_stats() for slave in self.slave_pool
+            },
+            "kafkaExporter": self.env.cluster_config.kafka_logger.get_stats(),
             "peers": [
                 "{}:{}".format(peer.ip, peer.port)
                 for _, peer in self.network.active_peer_pool.items()
             ],
+            "peerBandwidth": {
+                "{}:{}".format(peer.ip, peer.port): peer.get_bandwidth_stats()
+                for peer in self.network.active_peer_pool.values()
+            },
             "minor_block_interval": self.get_artificial_tx_config().target_minor_block_time,
             "root_block_interval": self.get_artificial_tx_config().target_root_block_time,
             "cpus": psutil.cpu_percent(percpu=True),
@@ -1501,12 +1582,14 @@ def parse_args():
             "{path}/master.db".format(path=env.cluster_config.DB_PATH_ROOT),
             clean=env.cluster_config.CLEAN,
         )
+        set_pow_cache_dir(env.cluster_config.get_pow_cache_dir())
 
     return env
 
 
 def main():
     from quarkchain.cluster.jsonrpc import JSONRPCServer
+    from quarkchain.cluster.work_notifier import WorkNotifier
 
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
@@ -1531,11 +1614,16 @@ def main():
 
     public_json_rpc_server = JSONRPCServer.start_public_server(env, master)
     private_json_rpc_server = JSONRPCServer.start_private_server(env, master)
+    work_notifier = None
+    if env.cluster_config.MINING_PUSH_PORT:
+        work_notifier = WorkNotifier.start_server(env, master)
 
     master.do_loop()
 
     public_json_rpc_server.shutdown()
     private_json_rpc_server.shutdown()
+    if work_notifier:
+        work_notifier.shutdown()
 
     Logger.info("Master server is shutdown")
 
@@ -1,17 +1,38 @@
 import asyncio
 import copy
 import json
+import multiprocessing
 import random
 import time
 from abc import ABC, abstractmethod
+from concurrent.futures import (
+    BrokenExecutor,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
 from queue import Queue, Empty as QueueEmpty
-from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Union
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import numpy
 from aioprocessing import AioProcess, AioQueue
 from eth_keys import KeyAPI
 
+from ethereum.pow.ethash_utils import EPOCH_LENGTH as ETHASH_EPOCH_LENGTH
+from ethereum.pow import ethpow
 from ethereum.pow.ethpow import EthashMiner, check_pow
+from qkchash import qkcpow
+from qkchash.qkchash import EPOCH_LENGTH as QKCHASH_EPOCH_LENGTH
 from qkchash.qkcpow import QkchashMiner, check_pow as qkchash_check_pow
 from quarkchain.config import ConsensusType
 from quarkchain.core import MinorBlock, MinorBlockHeader, RootBlock, RootBlockHeader
@@ -21,36 +42,133 @@ Block = Union[MinorBlock, RootBlock]
 MAX_NONCE = 2 ** 64 - 1  # 8-byte nonce max
 
 
+def _check_seal(
+    consensus_type: ConsensusType,
+    height: int,
+    mining_hash: bytes,
+    mixhash: bytes,
+    nonce: int,
+    diff: int,
+) -> bool:
+    nonce_bytes = nonce.to_bytes(8, byteorder="big")
+    if consensus_type == ConsensusType.POW_ETHASH:
+        return check_pow(height, mining_hash, mixhash, nonce_bytes, diff)
+    elif consensus_type == ConsensusType.POW_QKCHASH:
+        return qkchash_check_pow(height, mining_hash, mixhash, nonce_bytes, diff)
+    elif consensus_type == ConsensusType.POW_DOUBLESHA256:
+        target = (2 ** 256 // (diff or 1) - 1).to_bytes(32, byteorder="big")
+        h = sha256(sha256(mining_hash + nonce_bytes))
+        return h < target
+    return True
+
+
+def _check_seals(consensus_type: ConsensusType, seals: List[Tuple]) -> List[bool]:
+    return [_check_seal(consensus_type, *seal) for seal in seals]
+
+
 def validate_seal(
     block_header: Union[RootBlockHeader, MinorBlockHeader],
     consensus_type: ConsensusType,
     adjusted_diff: int = None,  # for overriding
 ) -> None:
     diff = adjusted_diff if adjusted_diff is not None else block_header.difficulty
-    nonce_bytes = block_header.nonce.to_bytes(8, byteorder="big")
-    if consensus_type == ConsensusType.POW_ETHASH:
-        if not check_pow(
-            block_header.height,
-            block_header.get_hash_for_mining(),
-            block_header.mixhash,
-            nonce_bytes,
-            diff,
-        ):
-            raise ValueError("invalid pow proof")
-    elif consensus_type == ConsensusType.POW_QKCHASH:
-        if not qkchash_check_pow(
-            block_header.height,
-            block_header.get_hash_for_mining(),
-            block_header.mixhash,
-            nonce_bytes,
-            diff,
-        ):
-            raise ValueError("invalid pow proof")
-    elif consensus_type == ConsensusType.POW_DOUBLESHA256:
-        target = (2 ** 256 // (diff or 1) - 1).to_bytes(32, byteorder="big")
-        h = sha256(sha256(block_header.get_hash_for_mining() + nonce_bytes))
-        if not h < target:
-            raise ValueError("invalid pow proof")
+    if not _check_seal(
+        consensus_type,
+        block_header.height,
+        block_header.get_hash_for_mining(),
+        block_header.mixhash,
+        block_header.nonce,
+        diff,
+    ):
+        raise ValueError("invalid pow proof")
+
+
+# batches smaller than this are verified in the calling thread
+SEAL_BATCH_MIN_SIZE = 8
+SEAL_BATCH_WORKERS = max(multiprocessing.cpu_count() - 1, 1)
+_seal_executors = dict()  # type: Dict[bool, Executor]
+
+
+def _get_seal_executor(use_threads: bool) -> Executor:
+    if use_threads not in _seal_executors:
+        _seal_executors[use_threads] = (
+            ThreadPoolExecutor(SEAL_BATCH_WORKERS)
+            if use_threads
+            # not forked, the PoW cache managers may hold their locks in other threads
+            else ProcessPoolExecutor(
+                SEAL_BATCH_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=set_pow_cache_dir,
+                initargs=(qkcpow.CACHE_MANAGER.cache_dir,),
+            )
+        )
+    return _seal_executors[use_threads]
+
+
+def validate_seal_batch(
+    block_headers: List[Union[RootBlockHeader, MinorBlockHeader]],
+    consensus_type: ConsensusType,
+    adjusted_diffs: Optional[List[int]] = None,  # for overriding
+) -> List[bool]:
+    """ Checks the seals of block_headers, returns whether each one is valid
+
+    Headers of the same epoch are verified together so that a worker only needs
+    the cache of that epoch.  Ethash and the Python qkchash run in a process
+    pool, the native qkchash releases the GIL and runs in a thread pool.
+    """
+    if adjusted_diffs is None:
+        adjusted_diffs = [h.difficulty for h in block_headers]
+    seals = [
+        (h.height, h.get_hash_for_mining(), h.mixhash, h.nonce, diff)
+        for h, diff in zip(block_headers, adjusted_diffs)
+    ]
+    if (
+        consensus_type not in (ConsensusType.POW_ETHASH, ConsensusType.POW_QKCHASH)
+        or len(seals) < SEAL_BATCH_MIN_SIZE
+    ):
+        return _check_seals(consensus_type, seals)
+
+    epoch_length = (
+        ETHASH_EPOCH_LENGTH
+        if consensus_type == ConsensusType.POW_ETHASH
+        else QKCHASH_EPOCH_LENGTH
+    )
+    epochs = dict()  # type: Dict[int, List[int]]
+    for idx, seal in enumerate(seals):
+        epochs.setdefault(seal[0] // epoch_length, []).append(idx)
+    chunk_size = max((len(seals) + SEAL_BATCH_WORKERS - 1) // SEAL_BATCH_WORKERS, 1)
+    chunks = [
+        indices[i : i + chunk_size]
+        for indices in epochs.values()
+        for i in range(0, len(indices), chunk_size)
+    ]
+
+    use_threads = (
+        consensus_type == ConsensusType.POW_QKCHASH
+        and qkcpow.QKC_HASH_NATIVE is not None
+    )
+    results = [False] * len(seals)
+    try:
+        executor = _get_seal_executor(use_threads)
+        futures = [
+            executor.submit(_check_seals, consensus_type, [seals[i] for i in chunk])
+            for chunk in chunks
+        ]
+        for chunk, future in zip(chunks, futures):
+            for idx, valid in zip(chunk, future.result()):
+                results[idx] = valid
+    except BrokenExecutor as e:
+        Logger.warning("Failed to verify seals in parallel: {}".format(e))
+        _seal_executors.pop(use_threads, None)
+        return _check_seals(consensus_type, seals)
+    return results
+
+
+def set_pow_cache_dir(cache_dir: Optional[str]):
+    """ Stores the PoW caches in cache_dir to share them between processes """
+    qkcpow.CACHE_MANAGER.cache_dir = cache_dir
+    if ethpow.CACHE_MANAGER is not None:
+        ethpow.CACHE_MANAGER.cache_dir = cache_dir
 
 
 MiningWork = NamedTuple(
@@ -142,12 +260,14 @@ class Miner:
         get_mining_param_func: Callable[[], Dict[str, Any]],
         remote: bool = False,
         guardian_private_key: Optional[KeyAPI.PrivateKey] = None,
+        workers: int = 1,
     ):
-        """Mining will happen on a subprocess managed by this class
+        """Mining will happen on subprocesses managed by this class
 
         create_block_async_func: takes no argument, returns a block (either RootBlock or MinorBlock)
         add_block_async_func: takes a block, add it to chain
         get_mining_param_func: takes no argument, returns the mining-specific params
+        workers: number of subprocesses, each mining its own part of the nonce space
         """
         self.consensus_type = consensus_type
 
@@ -155,10 +275,16 @@ class Miner:
         self.add_block_async_func = add_block_async_func
         self.get_mining_param_func = get_mining_param_func
         self.enabled = False
-        self.process = None
+        self.processes = []
 
-        self.input_q = AioQueue()  # [(MiningWork, param dict)]
+        # simulated mining does not iterate nonces
+        if consensus_type == ConsensusType.POW_SIMULATE:
+            workers = 1
+        # [(MiningWork, param dict)] for each subprocess, new work is sent to all
+        self.input_qs = [AioQueue() for _ in range(workers)]
         self.output_q = AioQueue()  # [MiningResult]
+        # hashes per second of each subprocess
+        self.hash_rates = multiprocessing.Array("d", workers)
 
         # header hash -> work
         self.work_map = {}  # type: Dict[bytes, Block]
@@ -178,18 +304,35 @@ class Miner:
         return self.enabled
 
     def disable(self):
-        """Stop the mining process if there is one"""
-        if self.enabled and self.process:
-            # end the mining process
-            self.input_q.put((None, {}))
+        """Stop the mining processes if there are any"""
+        if self.enabled and self.processes:
+            # end the mining processes
+            self._put_work(None, {})
         self.enabled = False
 
+    def get_hash_rates(self) -> List[int]:
+        """Hashes per second of each mining process"""
+        if not self.processes:
+            return []
+        return [int(rate) for rate in self.hash_rates]
+
+    def _put_work(self, work: Optional[MiningWork], mining_params: Dict):
+        for input_q in self.input_qs:
+            input_q.put((work, mining_params))
+
     def _mine_new_block_async(self):
         async def handle_mined_block():
+            ended = 0
             while True:
                 res = await self.output_q.coro_get()  # type: MiningResult
                 if not res:
-                    return  # empty result means ending
+                    # empty result means ending
+                    ended += 1
+                    if ended == len(self.processes):
+                        return
+                    continue
+                if res.header_hash not in self.work_map:
+                    continue  # solved by another process already
                 # start mining before processing and propagating mined block
                 self._mine_new_block_async()
                 block = self.work_map[res.header_hash]
@@ -215,7 +358,7 @@ class Miner:
             """
             block = await self.create_block_async_func()
             if not block:
-                self.input_q.put((None, {}))
+                self._put_work(None, {})
                 return
             mining_params = self.get_mining_param_func()
             mining_params["consensus_type"] = self.consensus_type
@@ -232,15 +375,24 @@ class Miner:
                 block.header.difficulty,
             )
             self.work_map[work.hash] = block
-            if self.process:
-                self.input_q.put((work, mining_params))
+            if self.processes:
+                self._put_work(work, mining_params)
                 return
 
-            self.process = AioProcess(
-                target=self.mine_loop,
-                args=(work, mining_params, self.input_q, self.output_q),
-            )
-            self.process.start()
+            self.processes = [
+                AioProcess(
+                    target=self.mine_loop,
+                    args=(work, mining_params, input_q, self.output_q),
+                    kwargs={
+                        "worker": i,
+                        "workers": len(self.input_qs),
+                        "hash_rates": self.hash_rates,
+                    },
+                )
+                for i, input_q in enumerate(self.input_qs)
+            ]
+            for process in self.processes:
+                process.start()
             await handle_mined_block()
 
         # no-op if enabled or mining remotely
@@ -279,6 +431,11 @@ class Miner:
             copy.deepcopy(self.current_work),
         )
 
+    def reset_work(self):
+        """Makes get_work create a new block, e.g. once the tip has changed.
+        Work given out before can still be submitted"""
+        self.current_work = None
+
     async def submit_work(
         self,
         header_hash: bytes,
@@ -321,7 +478,12 @@ class Miner:
         input_q: Queue,
         output_q: Queue,
         debug=False,
+        worker: int = 0,
+        workers: int = 1,
+        hash_rates=None,
     ):
+        """Mines nonces in the part `worker` of `workers` equal parts of the nonce
+        space, and reports the hash rate to hash_rates[worker] if given"""
         consensus_to_mining_algo = {
             ConsensusType.POW_SIMULATE: Simulate,
             ConsensusType.POW_ETHASH: Ethash,
@@ -329,6 +491,9 @@ class Miner:
             ConsensusType.POW_DOUBLESHA256: DoubleSHA256,
         }
         progress = {}
+        part_size = (MAX_NONCE + 1) // workers
+        min_nonce = worker * part_size
+        max_nonce = MAX_NONCE if worker == workers - 1 else min_nonce + part_size - 1
 
         def debug_log(msg: str, prob: float):
             if not debug:
@@ -361,13 +526,18 @@ class Miner:
                         continue
 
                 rounds = mining_params.get("rounds", 100)
-                start_nonce = random.randint(0, MAX_NONCE)
+                start_nonce = random.randint(min_nonce, max_nonce)
                 # inner loop for iterating nonce
                 while True:
-                    if start_nonce > MAX_NONCE:
-                        start_nonce = 0
-                    end_nonce = min(start_nonce + rounds, MAX_NONCE + 1)
+                    if start_nonce > max_nonce:
+                        start_nonce = min_nonce
+                    end_nonce = min(start_nonce + rounds, max_nonce + 1)
+                    start_time = time.time()
                     res = mining_algo.mine(start_nonce, end_nonce)  # [start, end)
+                    if hash_rates is not None:
+                        hash_rates[worker] = (end_nonce - start_nonce) / max(
+                            time.time() - start_time, 1e-6
+                        )
                     debug_log("one round of mining", 0.01)
                     if res:
                         debug_log("mining success", 1.0)
@@ -1,12 +1,20 @@
+import asyncio
 import json
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
 import requests
 import aiohttp
 from quarkchain.utils import Logger
 
+POST_CONNECTION_LIMIT = 4
+POST_TIMEOUT = 10
+
 
 class KafkaSampleLogger:
     def __init__(self, cluster_config):
         self.cluster_config = cluster_config
+        self.exporter = None  # type: Optional[KafkaExporter]
 
     def log_kafka_sample(self, topic: str, sample: dict):
         """This is for testing/debugging only, use async version for production"""
@@ -29,7 +37,7 @@ class KafkaSampleLogger:
         except Exception as ex:
             Logger.error_only("Failed to log sample to Kafka: {}".format(ex))
 
-    async def log_kafka_sample_async(self, topic: str, sample: dict):
+    def add_kafka_sample(self, topic: str, sample: dict):
         """logs sample to Kafka topic asynchronously
         Sample for monitoring purpose:
         Supports logging samples to Kafka via REST API (Confluent)
@@ -38,27 +46,128 @@ class KafkaSampleLogger:
         time: epoch in seconds
         sample_rate: pre-sampled record shall set this to sample rate, e.g., 100 means one sample is logged out of 100
         column type shall be log int, str, or vector of str
+
+        The sample is buffered and posted in a batch by KafkaExporter
         """
         if not self.cluster_config.MONITORING.KAFKA_REST_ADDRESS or not topic:
             return
-        url = "http://{}/topics/{}".format(
-            self.cluster_config.MONITORING.KAFKA_REST_ADDRESS, topic
+        if self.exporter is None:
+            monitoring = self.cluster_config.MONITORING
+            self.exporter = KafkaExporter(
+                monitoring.KAFKA_REST_ADDRESS,
+                buffer_size=monitoring.KAFKA_BUFFER_SIZE,
+                batch_size=monitoring.KAFKA_BATCH_SIZE,
+                flush_interval=monitoring.KAFKA_FLUSH_INTERVAL_SEC,
+            )
+        self.exporter.add(topic, sample)
+
+    async def log_kafka_sample_async(self, topic: str, sample: dict):
+        self.add_kafka_sample(topic, sample)
+
+    def get_stats(self) -> Dict[str, int]:
+        return self.exporter.get_stats() if self.exporter else dict()
+
+
+class KafkaExporter:
+    """ Posts samples to the Kafka REST proxy in batches with one HTTP session
+
+    Samples are kept in a ring buffer of buffer_size dropping the oldest ones,
+    and posted with up to batch_size records per request once batch_size samples
+    are buffered or flush_interval seconds after the first one.
+    """
+
+    def __init__(
+        self, rest_address: str, buffer_size=10000, batch_size=100, flush_interval=1.0
+    ):
+        self.rest_address = rest_address
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # (topic, serialized sample)
+        self.buffer = deque(maxlen=buffer_size)  # type: Deque[Tuple[str, str]]
+        self.session = None  # type: Optional[aiohttp.ClientSession]
+        self.flush_task = None  # type: Optional[asyncio.Future]
+        self.batch_ready = None  # type: Optional[asyncio.Event]
+        self.stats = Counter()  # type: Dict[str, int]
+
+    def add(self, topic: str, sample: dict):
+        try:
+            value = json.dumps(sample)
+        except Exception as ex:
+            self.stats["invalid"] += 1
+            Logger.error_only_every_n(
+                "Failed to log sample to Kafka: {}".format(ex), 100
+            )
+            return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.stats["dropped"] += 1
+        self.buffer.append((topic, value))
+        self.stats["added"] += 1
+
+        if self.flush_task is None or self.flush_task.done():
+            self.batch_ready = asyncio.Event()
+            self.flush_task = asyncio.ensure_future(self.__flush_loop())
+        if len(self.buffer) >= self.batch_size:
+            self.batch_ready.set()
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        stats["buffered"] = len(self.buffer)
+        return stats
+
+    async def __flush_loop(self):
+        while self.buffer:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+            await self.flush()
+
+    async def flush(self):
+        """ Posts all the samples buffered """
+        while self.buffer:
+            topic = self.buffer[0][0]
+            values = []
+            while (
+                self.buffer
+                and self.buffer[0][0] == topic
+                and len(values) < self.batch_size
+            ):
+                values.append(self.buffer.popleft()[1])
+            await self.__post(topic, values)
+
+    async def close(self):
+        await self.flush()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __post(self, topic: str, values: List[str]):
+        url = "http://{}/topics/{}".format(self.rest_address, topic)
+        record_data = '{"records": [%s]}' % ", ".join(
+            '{"value": %s}' % value for value in values
         )
+        headers = {
+            "Content-Type": "application/vnd.kafka.json.v2+json",
+            "Accept": "application/vnd.kafka.v2+json",
+        }
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=POST_CONNECTION_LIMIT)
+            )
         try:
-            record_data = json.dumps({"records": [{"value": sample}]})
-            headers = {
-                "Content-Type": "application/vnd.kafka.json.v2+json",
-                "Accept": "application/vnd.kafka.v2+json",
-            }
-            session = aiohttp.ClientSession()
-            response = await session.post(url, data=record_data, headers=headers)
-            if response.status != 200:
-                raise Exception(
-                    "non-OK response status code: {}".format(response.status_code)
-                )
+            async with self.session.post(
+                url, data=record_data, headers=headers, timeout=POST_TIMEOUT
+            ) as response:
+                if response.status != 200:
+                    raise Exception(
+                        "non-OK response status code: {}".format(response.status)
+                    )
+            self.stats["posts"] += 1
+            self.stats["sent"] += len(values)
         except Exception as ex:
+            self.stats["failed_posts"] += 1
+            self.stats["failed"] += len(values)
             Logger.error_only_every_n(
                 "Failed to log sample to Kafka: {}".format(ex), 100
             )
-        finally:
-            await session.close()
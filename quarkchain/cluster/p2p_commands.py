@@ -2,15 +2,22 @@ from enum import IntEnum
 
 from quarkchain.core import (
     Branch,
+    boolean,
     uint8,
     uint16,
     uint32,
+    uint64,
     uint128,
     hash256,
+    MinorBlockMeta,
     TypedTransaction,
 )
 from quarkchain.core import RootBlockHeader, MinorBlockHeader, RootBlock, MinorBlock
-from quarkchain.core import Serializable, PrependedSizeListSerializer
+from quarkchain.core import (
+    Serializable,
+    PrependedSizeBytesSerializer,
+    PrependedSizeListSerializer,
+)
 from quarkchain.utils import check
 
 
@@ -91,6 +98,41 @@ class NewTransactionListCommand(Serializable):
         self.transaction_list = transaction_list if transaction_list is not None else []
 
 
+class SendTransactionHashesCommand(Serializable):
+    """ Tells the peer whether new transactions may be announced by their hashes """
+
+    FIELDS = [("enabled", boolean)]
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+
+
+class NewTransactionHashListCommand(Serializable):
+    """ Announce transactions, which the peer requests with GetTransactionListRequest
+    if it does not have them """
+
+    FIELDS = [("tx_hash_list", PrependedSizeListSerializer(4, hash256))]
+
+    def __init__(self, tx_hash_list=None):
+        self.tx_hash_list = tx_hash_list if tx_hash_list is not None else []
+
+
+class GetTransactionListRequest(Serializable):
+    FIELDS = [("tx_hash_list", PrependedSizeListSerializer(4, hash256))]
+
+    def __init__(self, tx_hash_list=None):
+        self.tx_hash_list = tx_hash_list if tx_hash_list is not None else []
+
+
+class GetTransactionListResponse(Serializable):
+    """ The transactions requested still in the tx pool """
+
+    FIELDS = [("transaction_list", PrependedSizeListSerializer(4, TypedTransaction))]
+
+    def __init__(self, transaction_list=None):
+        self.transaction_list = transaction_list if transaction_list is not None else []
+
+
 class Direction(IntEnum):
     GENESIS = 0
     TIP = 1
@@ -301,6 +343,70 @@ class NewRootBlockCommand(Serializable):
         self.block = block
 
 
+class SendCompactBlockMinorCommand(Serializable):
+    """ Tells the peer whether new minor blocks may be sent as compact blocks """
+
+    FIELDS = [("enabled", boolean)]
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+
+
+class NewCompactBlockMinorCommand(Serializable):
+    """ A new minor block with the short ids of its transactions instead of the
+    transactions, which the peer takes from its tx pool or requests with
+    GetMinorBlockTxListRequest
+    """
+
+    FIELDS = [
+        ("header", MinorBlockHeader),
+        ("meta", MinorBlockMeta),
+        ("short_tx_id_list", PrependedSizeListSerializer(4, uint64)),
+        ("tracking_data", PrependedSizeBytesSerializer(2)),
+    ]
+
+    def __init__(self, header, meta, short_tx_id_list, tracking_data=b""):
+        self.header = header
+        self.meta = meta
+        self.short_tx_id_list = short_tx_id_list
+        self.tracking_data = tracking_data
+
+    @staticmethod
+    def get_short_tx_id(tx_hash):
+        return int.from_bytes(tx_hash[:8], byteorder="big")
+
+    @classmethod
+    def from_block(cls, block):
+        return cls(
+            block.header,
+            block.meta,
+            [cls.get_short_tx_id(tx.get_hash()) for tx in block.tx_list],
+            block.tracking_data,
+        )
+
+
+class GetMinorBlockTxListRequest(Serializable):
+    """ Requests the transactions of a minor block by their indices """
+
+    FIELDS = [
+        ("minor_block_hash", hash256),
+        ("tx_index_list", PrependedSizeListSerializer(4, uint32)),
+    ]
+
+    def __init__(self, minor_block_hash, tx_index_list):
+        self.minor_block_hash = minor_block_hash
+        self.tx_index_list = tx_index_list
+
+
+class GetMinorBlockTxListResponse(Serializable):
+    """ Empty if the block is unknown """
+
+    FIELDS = [("tx_list", PrependedSizeListSerializer(4, TypedTransaction))]
+
+    def __init__(self, tx_list=None):
+        self.tx_list = tx_list if tx_list is not None else []
+
+
 class PingPongCommand(Serializable):
     """
     with 32B message which is undefined at the moment
@@ -334,6 +440,14 @@ class CommandOp:
     NEW_ROOT_BLOCK = 18
     GET_MINOR_BLOCK_HEADER_LIST_WITH_SKIP_REQUEST = 19
     GET_MINOR_BLOCK_HEADER_LIST_WITH_SKIP_RESPONSE = 20
+    SEND_COMPACT_BLOCK_MINOR = 21
+    NEW_COMPACT_BLOCK_MINOR = 22
+    GET_MINOR_BLOCK_TX_LIST_REQUEST = 23
+    GET_MINOR_BLOCK_TX_LIST_RESPONSE = 24
+    SEND_TRANSACTION_HASHES = 25
+    NEW_TRANSACTION_HASH_LIST = 26
+    GET_TRANSACTION_LIST_REQUEST = 27
+    GET_TRANSACTION_LIST_RESPONSE = 28
 
 
 OP_SERIALIZER_MAP = {
@@ -358,4 +472,12 @@ OP_SERIALIZER_MAP = {
     CommandOp.NEW_ROOT_BLOCK: NewRootBlockCommand,
     CommandOp.GET_MINOR_BLOCK_HEADER_LIST_WITH_SKIP_REQUEST: GetMinorBlockHeaderListWithSkipRequest,
     CommandOp.GET_MINOR_BLOCK_HEADER_LIST_WITH_SKIP_RESPONSE: GetMinorBlockHeaderListResponse,
+    CommandOp.SEND_COMPACT_BLOCK_MINOR: SendCompactBlockMinorCommand,
+    CommandOp.NEW_COMPACT_BLOCK_MINOR: NewCompactBlockMinorCommand,
+    CommandOp.GET_MINOR_BLOCK_TX_LIST_REQUEST: GetMinorBlockTxListRequest,
+    CommandOp.GET_MINOR_BLOCK_TX_LIST_RESPONSE: GetMinorBlockTxListResponse,
+    CommandOp.SEND_TRANSACTION_HASHES: SendTransactionHashesCommand,
+    CommandOp.NEW_TRANSACTION_HASH_LIST: NewTransactionHashListCommand,
+    CommandOp.GET_TRANSACTION_LIST_REQUEST: GetTransactionListRequest,
+    CommandOp.GET_TRANSACTION_LIST_RESPONSE: GetTransactionListResponse,
 }
@@ -0,0 +1,343 @@
+""" Optimistic parallel execution of the transactions of a minor block
+
+The transactions are first executed speculatively on forked worker processes,
+each one against the state before the transactions of the block, recording the
+accounts and storage slots it reads and writes.  They are then committed in
+block order on the block state: a transaction none of whose reads was written by
+a transaction before it has its changes applied from the speculative run, the
+others are executed again.  The result is the same as executing the transactions
+one after another.
+
+Balance deltas are recorded as writes only, so that paying fees to the coinbase
+or value to a recipient does not conflict with other transactions.
+"""
+import multiprocessing
+
+from quarkchain.evm import utils
+from quarkchain.evm.messages import Log, apply_transaction, mk_receipt
+from quarkchain.utils import Logger
+
+# only speculate if each worker gets at least this many transactions
+MIN_TXS_PER_WORKER = 4
+
+# state and [(evm_tx, tx_wrapper_hash)] being speculated, inherited by the workers
+_speculation = None
+
+
+class AccessRecorder:
+    """ Wraps an EVM state and records what a transaction reads and writes:
+    an address for an account (nonce, balances, code), (address, key) for a
+    storage slot, and (address, None) for all the storage of an account.
+    """
+
+    def __init__(self, state):
+        object.__setattr__(self, "_state", state)
+        object.__setattr__(self, "reads", set())
+        object.__setattr__(self, "writes", set())
+        # whether the changes can be applied from the account fields and slots
+        object.__setattr__(self, "replayable", True)
+
+    def __getattr__(self, name):
+        return getattr(self._state, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._state, name, value)
+
+    def _read(self, address):
+        address = utils.normalize_address(address)
+        self.reads.add(address)
+        return address
+
+    def _write(self, address):
+        address = utils.normalize_address(address)
+        self.writes.add(address)
+        return address
+
+    def _reset(self, address):
+        address = self._write(address)
+        self.writes.add((address, None))
+        object.__setattr__(self, "replayable", False)
+
+    def get_balances(self, address):
+        return self._state.get_balances(self._read(address))
+
+    def get_balance(self, address, token_id=None):
+        return self._state.get_balance(self._read(address), token_id=token_id)
+
+    def get_code(self, address):
+        return self._state.get_code(self._read(address))
+
+    def get_code_hash(self, address):
+        return self._state.get_code_hash(self._read(address))
+
+    def get_nonce(self, address):
+        return self._state.get_nonce(self._read(address))
+
+    def get_full_shard_key(self, address):
+        return self._state.get_full_shard_key(self._read(address))
+
+    def account_exists(self, address):
+        return self._state.account_exists(self._read(address))
+
+    def account_to_dict(self, address):
+        return self._state.account_to_dict(self._read(address))
+
+    def get_storage_data(self, address, key):
+        address = self._read(address)
+        self.reads.add((address, key))
+        self.reads.add((address, None))
+        return self._state.get_storage_data(address, key)
+
+    def set_balances(self, address, token_balances):
+        self._read(address)
+        self._state.set_balances(self._write(address), token_balances)
+
+    def set_token_balance(self, address, token_id, val):
+        self._read(address)
+        self._state.set_token_balance(self._write(address), token_id, val)
+
+    def set_balance(self, address, val):
+        self._read(address)
+        self._state.set_balance(self._write(address), val)
+
+    def delta_token_balance(self, address, token_id, value):
+        self._state.delta_token_balance(self._write(address), token_id, value)
+
+    def set_code(self, address, value):
+        self._state.set_code(self._write(address), value)
+
+    def set_nonce(self, address, value):
+        self._state.set_nonce(self._write(address), value)
+
+    def increment_nonce(self, address):
+        self._read(address)
+        self._state.increment_nonce(self._write(address))
+
+    def set_storage_data(self, address, key, value):
+        address = self._write(address)
+        self.writes.add((address, key))
+        self._state.set_storage_data(address, key, value)
+
+    def transfer_value(self, from_addr, to_addr, token_id, value):
+        self._read(from_addr)
+        self._write(from_addr)
+        self._write(to_addr)
+        return self._state.transfer_value(from_addr, to_addr, token_id, value)
+
+    def deduct_value(self, from_addr, token_id, value):
+        self._read(from_addr)
+        self._write(from_addr)
+        return self._state.deduct_value(from_addr, token_id, value)
+
+    def add_suicide(self, address):
+        self._reset(address)
+        self._state.add_suicide(address)
+
+    def del_account(self, address):
+        self._reset(address)
+        self._state.del_account(address)
+
+    def reset_storage(self, address):
+        self._reset(address)
+        self._state.reset_storage(address)
+
+
+class SpeculativeResult:
+    """ The reads, writes and net changes of a transaction executed on the state
+    before the transactions of the block """
+
+    def __init__(self, reads, writes):
+        self.reads = reads
+        self.writes = writes
+        # address -> (touched, nonce, token balance deltas, code)
+        # with None for a nonce or code that did not change
+        self.accounts = {}
+        # (address, key) -> value
+        self.storage = {}
+        self.gas_used = 0
+        self.fee_tokens = {}
+        self.xshard_list = []
+        self.refunds = 0
+        self.success = 0
+        self.output = b""
+        self.logs = []
+        self.contract_address = b""
+        self.contract_full_shard_key = 0
+
+
+def _account_fields(state, address):
+    acct = state.get_and_cache_account(address)
+    return acct.touched, acct.nonce, dict(acct.token_balances.balances), acct.code_hash
+
+
+def speculate(state, evm_tx, tx_wrapper_hash):
+    """ Executes a transaction and reverts it, returns None if it failed or its
+    changes cannot be replayed """
+    snapshot = state.snapshot()
+    gas_used = state.gas_used
+    fee_tokens = dict(state.block_fee_tokens)
+    xshard_count = len(state.xshard_list)
+    recorder = AccessRecorder(state)
+    try:
+        success, output = apply_transaction(recorder, evm_tx, tx_wrapper_hash)
+    except Exception:
+        state.revert(snapshot)
+        return None
+    if not recorder.replayable:
+        state.revert(snapshot)
+        return None
+
+    result = SpeculativeResult(recorder.reads, recorder.writes)
+    addresses = [k for k in recorder.writes if not isinstance(k, tuple)]
+    slots = [k for k in recorder.writes if isinstance(k, tuple)]
+    after = {address: _account_fields(state, address) for address in addresses}
+    storage = {
+        (address, key): state.get_and_cache_account(address).storage_cache[key]
+        for address, key in slots
+    }
+    result.gas_used = state.gas_used - gas_used
+    result.fee_tokens = {
+        k: v - fee_tokens.get(k, 0)
+        for k, v in state.block_fee_tokens.items()
+        if k not in fee_tokens or v != fee_tokens[k]
+    }
+    result.xshard_list = state.xshard_list[xshard_count:]
+    result.refunds = state.refunds
+    receipt = state.receipts[-1]
+    result.success = success
+    result.output = output
+    result.logs = [(log.address, log.topics, log.data) for log in receipt.logs]
+    result.contract_address = receipt.contract_address
+    result.contract_full_shard_key = receipt.contract_full_shard_key
+    state.revert(snapshot)
+
+    for address in addresses:
+        touched, nonce, balances, code_hash = after[address]
+        _, nonce_before, balances_before, code_hash_before = _account_fields(
+            state, address
+        )
+        deltas = {
+            token_id: balance - balances_before.get(token_id, 0)
+            for token_id, balance in balances.items()
+            if balance != balances_before.get(token_id, 0)
+        }
+        for token_id, balance in balances_before.items():
+            if token_id not in balances and balance != 0:
+                deltas[token_id] = -balance
+        result.accounts[address] = (
+            touched,
+            nonce if nonce != nonce_before else None,
+            deltas,
+            state.db[code_hash] if code_hash != code_hash_before else None,
+        )
+    for (address, key), value in storage.items():
+        if value != state.get_and_cache_account(address).storage_cache[key]:
+            result.storage[(address, key)] = value
+    return result
+
+
+def _use_overlay_db():
+    state, _ = _speculation
+    state.use_overlay_db()
+
+
+def _speculate_range(start, stop):
+    state, txs = _speculation
+    return [speculate(state, *txs[i]) for i in range(start, stop)]
+
+
+class BlockSpeculation:
+    """ Commits the transactions of a block in order, from their speculative
+    results where no transaction before them wrote what they read """
+
+    def __init__(self, state, results):
+        self.state = state
+        self.results = results
+        self.dirty = set()
+        self.replayed = 0
+        self.executed = 0
+
+    def apply_transaction(self, idx, evm_tx, tx_wrapper_hash):
+        """ Same as messages.apply_transaction on a validated transaction """
+        result = self.results[idx]
+        if result is None or not self.dirty.isdisjoint(result.reads):
+            recorder = AccessRecorder(self.state)
+            try:
+                return apply_transaction(recorder, evm_tx, tx_wrapper_hash)
+            finally:
+                self.dirty.update(recorder.writes)
+                self.executed += 1
+
+        state = self.state
+        state.full_shard_key = evm_tx.to_full_shard_key
+        # accounts are cached with the full shard key of the tx reading them first
+        for key in result.reads:
+            if not isinstance(key, tuple):
+                state.get_and_cache_account(key)
+        for address, (touched, nonce, deltas, code) in result.accounts.items():
+            if nonce is not None:
+                state.set_nonce(address, nonce)
+            if code is not None:
+                state.set_code(address, code)
+            for token_id, delta in deltas.items():
+                state.delta_token_balance(address, token_id, delta)
+            if touched:
+                state.delta_token_balance(
+                    address, state.shard_config.default_chain_token, 0
+                )
+        for (address, key), value in result.storage.items():
+            state.set_storage_data(address, key, value)
+        utils.add_dict(state.block_fee_tokens, result.fee_tokens)
+        state.xshard_list.extend(result.xshard_list)
+        state.gas_used += result.gas_used
+        state.logs = []
+        state.suicides = []
+        state.refunds = result.refunds
+
+        logs = [Log(address, topics, data) for address, topics, data in result.logs]
+        r = mk_receipt(
+            state,
+            result.success,
+            logs,
+            result.contract_address,
+            result.contract_full_shard_key,
+        )
+        state.add_receipt(r)
+        state.set_param("bloom", state.bloom | r.bloom)
+        state.set_param("txindex", state.txindex + 1)
+
+        self.dirty.update(result.writes)
+        self.replayed += 1
+        return result.success, result.output
+
+
+class ParallelTxExecutor:
+    def __init__(self, workers):
+        self.workers = workers
+
+    def speculate(self, state, txs):
+        """ Executes [(evm_tx, tx_wrapper_hash)] on forked workers against state,
+        returns a BlockSpeculation or None if there are too few txs """
+        global _speculation
+        workers = min(self.workers, len(txs) // MIN_TXS_PER_WORKER)
+        if workers < 2:
+            return None
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            return None
+
+        size = (len(txs) + workers - 1) // workers
+        _speculation = (state, txs)
+        try:
+            with context.Pool(workers, initializer=_use_overlay_db) as pool:
+                chunks = pool.starmap(
+                    _speculate_range,
+                    [(i, min(i + size, len(txs))) for i in range(0, len(txs), size)],
+                )
+        except Exception as e:
+            Logger.warning("Failed to speculate transactions: {}".format(e))
+            return None
+        finally:
+            _speculation = None
+        return BlockSpeculation(state, [r for chunk in chunks for r in chunk])
@@ -1,15 +1,32 @@
 import asyncio
-from collections import deque
+import os
+from collections import Counter, deque
 
+from quarkchain.cluster.p2p_commands import CommandOp
 from quarkchain.core import uint64, Branch
 from quarkchain.protocol import Connection, AbstractConnection
 from quarkchain.protocol import Metadata
-from quarkchain.utils import check
+from quarkchain.utils import Logger, check
 
 ROOT_SHARD_ID = 0
 ROOT_BRANCH = Branch(ROOT_SHARD_ID)
 
 
+async def open_slave_connection(cluster_config, slave_info, loop=None):
+    """ Connects to the slave over its Unix socket if it runs on this host,
+    skipping the TCP stack, otherwise over TCP.  Returns (reader, writer).
+    """
+    path = cluster_config.get_slave_socket_path(slave_info.id)
+    if path and os.path.exists(path):
+        try:
+            return await asyncio.open_unix_connection(path, loop=loop)
+        except OSError as e:
+            Logger.info("Failed to connect {}, using TCP: {}".format(path, e))
+    return await asyncio.open_connection(
+        slave_info.host.decode("ascii"), slave_info.port, loop=loop
+    )
+
+
 class ProxyConnection(Connection):
     """
     A connection that forwards received data to other connections based on metadata
@@ -208,6 +225,27 @@ class P2PConnection(ProxyConnection):
             name=metadata_class,
             command_size_limit=command_size_limit,
         )
+        # op -> bytes of the commands received from and sent to the peer
+        self.bytes_received = Counter()
+        self.bytes_sent = Counter()
+
+    def get_bandwidth_stats(self):
+        op_names = {v: k for k, v in vars(CommandOp).items() if k.isupper()}
+        return {
+            direction: {op_names.get(op, str(op)): size for op, size in counter.items()}
+            for direction, counter in (
+                ("received", self.bytes_received),
+                ("sent", self.bytes_sent),
+            )
+        }
+
+    async def handle_metadata_and_raw_data(self, metadata, raw_data):
+        self.bytes_received[raw_data[0]] += len(raw_data)
+        await super().handle_metadata_and_raw_data(metadata, raw_data)
+
+    def write_raw_data(self, metadata, raw_data):
+        self.bytes_sent[raw_data[0]] += len(raw_data)
+        super().write_raw_data(metadata, raw_data)
 
     def get_cluster_peer_id(self):
         """ To be implemented by subclass """
@@ -1,4 +1,3 @@
-import asyncio
 import json
 import time
 from fractions import Fraction
@@ -620,10 +619,8 @@ class RootState:
                 "propagation_latency_ms": start_ms - tracking_data.get("mined", 0),
                 "num_tx": len(block.minor_block_header_list),
             }
-            asyncio.ensure_future(
-                self.env.cluster_config.kafka_logger.log_kafka_sample_async(
-                    self.env.cluster_config.MONITORING.PROPAGATION_TOPIC, sample
-                )
+            self.env.cluster_config.kafka_logger.add_kafka_sample(
+                self.env.cluster_config.MONITORING.PROPAGATION_TOPIC, sample
             )
 
         if self.tip.total_difficulty < block.header.total_difficulty:
@@ -34,6 +34,7 @@ from quarkchain.core import (
     boolean,
     signature65,
 )
+from quarkchain.protocol import RpcPriority
 
 
 # RPCs to initialize a cluster
@@ -44,9 +45,20 @@ class Ping(Serializable):
         ("id", PrependedSizeBytesSerializer(4)),
         ("chain_mask_list", PrependedSizeListSerializer(4, ChainMask)),
         ("root_tip", Optional(RootBlock)),  # Initialize ShardState if not None
+        # slave -> slave only: sender accepts compressed x-shard tx lists
+        ("accept_compressed_xshard", boolean),
+        # gateway -> slave only: sender is a read-only client with no shards
+        ("read_only", boolean),
     ]
 
-    def __init__(self, id, chain_mask_list, root_tip):
+    def __init__(
+        self,
+        id,
+        chain_mask_list,
+        root_tip,
+        accept_compressed_xshard=False,
+        read_only=False,
+    ):
         """ Empty chain_mask_list means root """
         if isinstance(id, bytes):
             self.id = id
@@ -54,21 +66,38 @@ class Ping(Serializable):
             self.id = bytes(id, "ascii")
         self.chain_mask_list = chain_mask_list
         self.root_tip = root_tip
+        self.accept_compressed_xshard = accept_compressed_xshard
+        self.read_only = read_only
 
 
 class Pong(Serializable):
     FIELDS = [
         ("id", PrependedSizeBytesSerializer(4)),
         ("chain_mask_list", PrependedSizeListSerializer(4, ChainMask)),
+        # slave -> slave only: sender accepts compressed x-shard tx lists
+        ("accept_compressed_xshard", boolean),
+        # slave -> master only: shards initialized and still initializing
+        ("shard_count", uint32),
+        ("pending_shard_count", uint32),
     ]
 
-    def __init__(self, id, chain_mask_list):
+    def __init__(
+        self,
+        id,
+        chain_mask_list,
+        accept_compressed_xshard=False,
+        shard_count=0,
+        pending_shard_count=0,
+    ):
         """ Empty slave_id and chain_mask_list means root """
         if isinstance(id, bytes):
             self.id = id
         else:
             self.id = bytes(id, "ascii")
         self.chain_mask_list = chain_mask_list
+        self.accept_compressed_xshard = accept_compressed_xshard
+        self.shard_count = shard_count
+        self.pending_shard_count = pending_shard_count
 
 
 class SlaveInfo(Serializable):
@@ -533,6 +562,7 @@ class ShardStats(Serializable):
         ("block_count60s", uint32),
         ("stale_block_count60s", uint32),
         ("last_block_time", uint32),
+        ("mining_hash_rates", PrependedSizeListSerializer(4, uint64)),
     ]
 
     def __init__(
@@ -548,6 +578,7 @@ class ShardStats(Serializable):
         block_count60s: int,
         stale_block_count60s: int,
         last_block_time: int,
+        mining_hash_rates: List[int] = None,
     ):
         self.branch = branch
         self.height = height
@@ -560,6 +591,7 @@ class ShardStats(Serializable):
         self.block_count60s = block_count60s
         self.stale_block_count60s = stale_block_count60s
         self.last_block_time = last_block_time
+        self.mining_hash_rates = mining_hash_rates or []
 
 
 class RootBlockSychronizerStats(Serializable):
@@ -715,6 +747,17 @@ class BatchAddXshardTxListResponse(Serializable):
         self.error_code = error_code
 
 
+class CompressedBatchAddXshardTxListRequest(Serializable):
+    """ A zlib-compressed BatchAddXshardTxListRequest.
+    Only sent to slaves that set accept_compressed_xshard in Ping/Pong.
+    """
+
+    FIELDS = [("data", PrependedSizeBytesSerializer(4))]
+
+    def __init__(self, data):
+        self.data = data
+
+
 class GetLogRequest(Serializable):
     FIELDS = [
         ("branch", Branch),
@@ -947,6 +990,8 @@ class ClusterOp:
     SUBMIT_WORK_RESPONSE = 58 + CLUSTER_OP_BASE
     ADD_MINOR_BLOCK_HEADER_LIST_REQUEST = 59 + CLUSTER_OP_BASE
     ADD_MINOR_BLOCK_HEADER_LIST_RESPONSE = 60 + CLUSTER_OP_BASE
+    COMPRESSED_BATCH_ADD_XSHARD_TX_LIST_REQUEST = 61 + CLUSTER_OP_BASE
+    COMPRESSED_BATCH_ADD_XSHARD_TX_LIST_RESPONSE = 62 + CLUSTER_OP_BASE
 
 
 CLUSTER_OP_SERIALIZER_MAP = {
@@ -1009,4 +1054,37 @@ CLUSTER_OP_SERIALIZER_MAP = {
     ClusterOp.SUBMIT_WORK_RESPONSE: SubmitWorkResponse,
     ClusterOp.ADD_MINOR_BLOCK_HEADER_LIST_REQUEST: AddMinorBlockHeaderListRequest,
     ClusterOp.ADD_MINOR_BLOCK_HEADER_LIST_RESPONSE: AddMinorBlockHeaderListResponse,
+    ClusterOp.COMPRESSED_BATCH_ADD_XSHARD_TX_LIST_REQUEST: CompressedBatchAddXshardTxListRequest,
+    ClusterOp.COMPRESSED_BATCH_ADD_XSHARD_TX_LIST_RESPONSE: BatchAddXshardTxListResponse,
+}
+
+
+# Lanes of the requests sent from master to slaves, see AbstractConnection.set_rpc_flow_control()
+# Requests not listed here are never held back
+CLUSTER_OP_PRIORITY_MAP = {
+    ClusterOp.PING: RpcPriority.CONSENSUS,
+    ClusterOp.CONNECT_TO_SLAVES_REQUEST: RpcPriority.CONSENSUS,
+    ClusterOp.ADD_ROOT_BLOCK_REQUEST: RpcPriority.CONSENSUS,
+    ClusterOp.ADD_MINOR_BLOCK_REQUEST: RpcPriority.CONSENSUS,
+    ClusterOp.GET_ECO_INFO_LIST_REQUEST: RpcPriority.CONSENSUS,
+    ClusterOp.GET_NEXT_BLOCK_TO_MINE_REQUEST: RpcPriority.CONSENSUS,
+    ClusterOp.GET_UNCONFIRMED_HEADERS_REQUEST: RpcPriority.CONSENSUS,
+    ClusterOp.CREATE_CLUSTER_PEER_CONNECTION_REQUEST: RpcPriority.CONSENSUS,
+    ClusterOp.MINE_REQUEST: RpcPriority.CONSENSUS,
+    ClusterOp.GET_WORK_REQUEST: RpcPriority.CONSENSUS,
+    ClusterOp.SUBMIT_WORK_REQUEST: RpcPriority.CONSENSUS,
+    ClusterOp.SYNC_MINOR_BLOCK_LIST_REQUEST: RpcPriority.SYNC,
+    ClusterOp.GET_ACCOUNT_DATA_REQUEST: RpcPriority.USER,
+    ClusterOp.ADD_TRANSACTION_REQUEST: RpcPriority.USER,
+    ClusterOp.GET_MINOR_BLOCK_REQUEST: RpcPriority.USER,
+    ClusterOp.GET_TRANSACTION_REQUEST: RpcPriority.USER,
+    ClusterOp.EXECUTE_TRANSACTION_REQUEST: RpcPriority.USER,
+    ClusterOp.GET_TRANSACTION_RECEIPT_REQUEST: RpcPriority.USER,
+    ClusterOp.GEN_TX_REQUEST: RpcPriority.USER,
+    ClusterOp.GET_TRANSACTION_LIST_BY_ADDRESS_REQUEST: RpcPriority.USER,
+    ClusterOp.GET_LOG_REQUEST: RpcPriority.USER,
+    ClusterOp.ESTIMATE_GAS_REQUEST: RpcPriority.USER,
+    ClusterOp.GET_STORAGE_REQUEST: RpcPriority.USER,
+    ClusterOp.GET_CODE_REQUEST: RpcPriority.USER,
+    ClusterOp.GAS_PRICE_REQUEST: RpcPriority.USER,
 }
@@ -1,8 +1,8 @@
 import asyncio
-from collections import deque
+from collections import Counter, OrderedDict, deque
 from typing import List
 
-from quarkchain.cluster.miner import Miner, validate_seal
+from quarkchain.cluster.miner import Miner, validate_seal, validate_seal_batch
 from quarkchain.cluster.p2p_commands import (
     OP_SERIALIZER_MAP,
     CommandOp,
@@ -11,23 +11,37 @@ from quarkchain.cluster.p2p_commands import (
     GetMinorBlockHeaderListResponse,
     GetMinorBlockListRequest,
     GetMinorBlockListResponse,
+    GetMinorBlockTxListRequest,
+    GetMinorBlockTxListResponse,
+    GetTransactionListRequest,
+    GetTransactionListResponse,
     NewBlockMinorCommand,
+    NewCompactBlockMinorCommand,
     NewMinorBlockHeaderListCommand,
+    NewTransactionHashListCommand,
     NewTransactionListCommand,
+    SendCompactBlockMinorCommand,
+    SendTransactionHashesCommand,
 )
 from quarkchain.cluster.protocol import ClusterMetadata, VirtualConnection
+from quarkchain.cluster.rpc import ShardStats
 from quarkchain.cluster.shard_state import ShardState
 from quarkchain.cluster.tx_generator import TransactionGenerator
 from quarkchain.config import ShardConfig
 from quarkchain.core import (
     Address,
     Branch,
+    MinorBlock,
     MinorBlockHeader,
     RootBlock,
     TypedTransaction,
 )
 from quarkchain.constants import (
     ALLOWED_FUTURE_BLOCKS_TIME_BROADCAST,
+    COMPACT_BLOCK_CACHE_SIZE,
+    KNOWN_TX_LIMIT,
+    KNOWN_TX_TTL_SEC,
+    TX_REQUEST_TIMEOUT_SEC,
     NEW_TRANSACTION_LIST_LIMIT,
     MINOR_BLOCK_BATCH_SIZE,
     MINOR_BLOCK_HEADER_LIST_LIMIT,
@@ -37,7 +51,7 @@ from quarkchain.constants import (
     BLOCK_COMMITTED,
 )
 from quarkchain.db import InMemoryDb, PersistentDb
-from quarkchain.utils import Logger, check, time_ms
+from quarkchain.utils import Logger, RecentHashSet, check, time_ms
 from quarkchain.p2p.utils import RESERVED_CLUSTER_PEER_ID
 
 
@@ -54,6 +68,15 @@ class PeerShardConnection(VirtualConnection):
         self.shard_state = shard.state
         self.best_root_block_header_observed = None
         self.best_minor_block_header_observed = None
+        # whether the peer asked for compact blocks and tx hashes
+        self.compact_block_enabled = False
+        self.tx_announcement_enabled = False
+        self.announcement_received = False
+        # txs the peer has, which are not sent to it
+        self.known_txs = RecentHashSet(KNOWN_TX_LIMIT, KNOWN_TX_TTL_SEC)
+        # txs waiting for the broadcast window
+        self.pending_tx_list = []
+        self.tx_flush_handle = None
 
     def get_metadata_to_write(self, metadata):
         """ Override VirtualConnection.get_metadata_to_write()
@@ -76,7 +99,26 @@ class PeerShardConnection(VirtualConnection):
             op=CommandOp.NEW_BLOCK_MINOR, cmd=NewBlockMinorCommand(block)
         )
 
+    def send_new_compact_block(self, cmd):
+        self.write_command(op=CommandOp.NEW_COMPACT_BLOCK_MINOR, cmd=cmd)
+
+    def send_announcements(self):
+        """ Asks the peer for the compact blocks and the tx hashes if enabled """
+        if self.shard.compact_block_relay:
+            self.write_command(
+                op=CommandOp.SEND_COMPACT_BLOCK_MINOR,
+                cmd=SendCompactBlockMinorCommand(True),
+            )
+        if self.shard.tx_announcement:
+            self.write_command(
+                op=CommandOp.SEND_TRANSACTION_HASHES,
+                cmd=SendTransactionHashesCommand(True),
+            )
+
     def broadcast_new_tip(self):
+        # the announcements sent when connecting are dropped if the peer is not ready yet
+        if not self.announcement_received:
+            self.send_announcements()
         if self.best_root_block_header_observed:
             if (
                 self.shard_state.root_tip.total_difficulty
@@ -100,9 +142,42 @@ class PeerShardConnection(VirtualConnection):
         )
 
     def broadcast_tx_list(self, tx_list):
-        self.write_command(
-            op=CommandOp.NEW_TRANSACTION_LIST, cmd=NewTransactionListCommand(tx_list)
-        )
+        """ Sends the txs the peer does not have, within the broadcast window if any """
+        new_tx_list = []
+        for tx in tx_list:
+            tx_hash = tx.get_hash()
+            if tx_hash not in self.known_txs:
+                self.known_txs.add(tx_hash)
+                new_tx_list.append(tx)
+        if not new_tx_list:
+            return
+        if self.shard.tx_broadcast_window <= 0:
+            return self.__write_tx_list(new_tx_list)
+        self.pending_tx_list.extend(new_tx_list)
+        if self.tx_flush_handle is None:
+            self.tx_flush_handle = asyncio.get_event_loop().call_later(
+                self.shard.tx_broadcast_window, self.__flush_pending_tx_list
+            )
+
+    def __flush_pending_tx_list(self):
+        self.tx_flush_handle = None
+        tx_list, self.pending_tx_list = self.pending_tx_list, []
+        if not self.is_closed():
+            self.__write_tx_list(tx_list)
+
+    def __write_tx_list(self, tx_list):
+        for i in range(0, len(tx_list), NEW_TRANSACTION_LIST_LIMIT):
+            chunk = tx_list[i : i + NEW_TRANSACTION_LIST_LIMIT]
+            if self.tx_announcement_enabled:
+                self.write_command(
+                    op=CommandOp.NEW_TRANSACTION_HASH_LIST,
+                    cmd=NewTransactionHashListCommand([tx.get_hash() for tx in chunk]),
+                )
+            else:
+                self.write_command(
+                    op=CommandOp.NEW_TRANSACTION_LIST,
+                    cmd=NewTransactionListCommand(chunk),
+                )
 
     ################## RPC handlers ###################
 
@@ -179,10 +254,101 @@ class PeerShardConnection(VirtualConnection):
 
         return GetMinorBlockListResponse(m_block_list)
 
+    async def handle_get_minor_block_tx_list_request(self, request):
+        block = self.shard.get_relayed_block(request.minor_block_hash)
+        if block is None:
+            return GetMinorBlockTxListResponse()
+        if any(i >= len(block.tx_list) for i in request.tx_index_list):
+            self.close_with_error("Bad tx index")
+            return GetMinorBlockTxListResponse()
+        return GetMinorBlockTxListResponse(
+            [block.tx_list[i] for i in request.tx_index_list]
+        )
+
     async def handle_new_block_minor_command(self, _op, cmd, _rpc_id):
         self.best_minor_block_header_observed = cmd.block.header
         await self.shard.handle_new_block(cmd.block)
 
+    def __handle_announcement(self):
+        # answering the first announcement in case the peer dropped ours
+        if not self.announcement_received:
+            self.announcement_received = True
+            self.send_announcements()
+
+    async def handle_send_compact_block_minor_command(self, _op, cmd, _rpc_id):
+        self.compact_block_enabled = cmd.enabled
+        self.__handle_announcement()
+
+    async def handle_send_transaction_hashes_command(self, _op, cmd, _rpc_id):
+        self.tx_announcement_enabled = cmd.enabled
+        self.__handle_announcement()
+
+    async def handle_new_compact_block_minor_command(self, _op, cmd, _rpc_id):
+        self.best_minor_block_header_observed = cmd.header
+        if self.shard.synchronizer.running:
+            return
+        block_hash = cmd.header.get_hash()
+        if (
+            block_hash in self.shard_state.new_block_header_pool
+            or self.shard_state.db.contain_minor_block_by_hash(block_hash)
+        ):
+            return
+        if cmd.header.hash_meta != cmd.meta.get_hash():
+            self.close_with_error("compact block meta does not match its header")
+            return
+        block = await self.__rebuild_compact_block(cmd)
+        if block is None:
+            # the block is downloaded by the sync following the new tip of the peer
+            self.shard.compact_block_stats["failed"] += 1
+            return
+        await self.shard.handle_new_block(block)
+
+    async def __rebuild_compact_block(self, cmd):
+        """ Returns the block of cmd with the txs from the tx pool or from the peer,
+        None if the peer does not have the missing txs """
+        stats = self.shard.compact_block_stats
+        stats["received"] += 1
+        pool = dict()
+        for tx_hash, tx in self.shard_state.tx_dict.items():
+            short_id = NewCompactBlockMinorCommand.get_short_tx_id(tx_hash)
+            # the txs with the same short id are requested from the peer
+            pool[short_id] = None if short_id in pool else tx
+        block = MinorBlock(
+            cmd.header,
+            cmd.meta,
+            [pool.get(short_id) for short_id in cmd.short_tx_id_list],
+            cmd.tracking_data,
+        )
+        missing = [i for i, tx in enumerate(block.tx_list) if tx is None]
+        if missing and not await self.__download_block_txs(block, missing):
+            return None
+        if block.calculate_merkle_root() == block.meta.hash_merkle_root:
+            return block
+        # a tx of the pool has the short id of another tx of the block
+        stats["collisions"] += 1
+        if not await self.__download_block_txs(block, range(len(block.tx_list))):
+            return None
+        if block.calculate_merkle_root() == block.meta.hash_merkle_root:
+            return block
+        return None
+
+    async def __download_block_txs(self, block, tx_index_list):
+        tx_index_list = list(tx_index_list)
+        try:
+            op, resp, rpc_id = await self.write_rpc_request(
+                op=CommandOp.GET_MINOR_BLOCK_TX_LIST_REQUEST,
+                cmd=GetMinorBlockTxListRequest(block.header.get_hash(), tx_index_list),
+            )
+        except Exception as e:
+            Logger.warning("Failed to get compact block txs: {}".format(e))
+            return False
+        if len(resp.tx_list) != len(tx_index_list):
+            return False
+        for i, tx in zip(tx_index_list, resp.tx_list):
+            block.tx_list[i] = tx
+        self.shard.compact_block_stats["txs_downloaded"] += len(tx_index_list)
+        return True
+
     async def handle_new_minor_block_header_list_command(self, _op, cmd, _rpc_id):
         # TODO: allow multiple headers if needed
         if len(cmd.minor_block_header_list) != 1:
@@ -243,14 +409,65 @@ class PeerShardConnection(VirtualConnection):
     async def handle_new_transaction_list_command(self, op_code, cmd, rpc_id):
         if len(cmd.transaction_list) > NEW_TRANSACTION_LIST_LIMIT:
             self.close_with_error("Too many transactions in one command")
+        for tx in cmd.transaction_list:
+            self.known_txs.add(tx.get_hash())
         self.shard.add_tx_list(cmd.transaction_list, self)
 
+    async def handle_new_transaction_hash_list_command(self, op_code, cmd, rpc_id):
+        if len(cmd.tx_hash_list) > NEW_TRANSACTION_LIST_LIMIT:
+            self.close_with_error("Too many transactions in one command")
+            return
+        requested_txs = self.shard.requested_txs
+        tx_hash_list = []
+        for tx_hash in cmd.tx_hash_list:
+            self.known_txs.add(tx_hash)
+            if (
+                tx_hash in requested_txs
+                or tx_hash in self.shard_state.tx_dict
+                or self.shard_state.db.contain_transaction_hash(tx_hash)
+            ):
+                continue
+            requested_txs.add(tx_hash)
+            tx_hash_list.append(tx_hash)
+        if not tx_hash_list:
+            return
+
+        try:
+            op, resp, rpc_id = await self.write_rpc_request(
+                op=CommandOp.GET_TRANSACTION_LIST_REQUEST,
+                cmd=GetTransactionListRequest(tx_hash_list),
+            )
+        except Exception as e:
+            Logger.warning("Failed to get transactions: {}".format(e))
+            return
+        finally:
+            # the txs not received can be requested from other peers
+            for tx_hash in tx_hash_list:
+                requested_txs.discard(tx_hash)
+        tx_hash_set = set(tx_hash_list)
+        self.shard.add_tx_list(
+            [tx for tx in resp.transaction_list if tx.get_hash() in tx_hash_set], self
+        )
+
+    async def handle_get_transaction_list_request(self, request):
+        if len(request.tx_hash_list) > NEW_TRANSACTION_LIST_LIMIT:
+            self.close_with_error("Too many transactions requested")
+            return GetTransactionListResponse()
+        tx_dict = self.shard_state.tx_dict
+        return GetTransactionListResponse(
+            [tx_dict[h] for h in request.tx_hash_list if h in tx_dict]
+        )
+
 
 # P2P command definitions
 OP_NONRPC_MAP = {
     CommandOp.NEW_MINOR_BLOCK_HEADER_LIST: PeerShardConnection.handle_new_minor_block_header_list_command,
     CommandOp.NEW_TRANSACTION_LIST: PeerShardConnection.handle_new_transaction_list_command,
     CommandOp.NEW_BLOCK_MINOR: PeerShardConnection.handle_new_block_minor_command,
+    CommandOp.SEND_COMPACT_BLOCK_MINOR: PeerShardConnection.handle_send_compact_block_minor_command,
+    CommandOp.NEW_COMPACT_BLOCK_MINOR: PeerShardConnection.handle_new_compact_block_minor_command,
+    CommandOp.SEND_TRANSACTION_HASHES: PeerShardConnection.handle_send_transaction_hashes_command,
+    CommandOp.NEW_TRANSACTION_HASH_LIST: PeerShardConnection.handle_new_transaction_hash_list_command,
 }
 
 
@@ -266,7 +483,15 @@ OP_RPC_MAP = {
     CommandOp.GET_MINOR_BLOCK_HEADER_LIST_WITH_SKIP_REQUEST: (
         CommandOp.GET_MINOR_BLOCK_HEADER_LIST_WITH_SKIP_RESPONSE,
         PeerShardConnection.handle_get_minor_block_header_list_with_skip_request,
-    )
+    ),
+    CommandOp.GET_MINOR_BLOCK_TX_LIST_REQUEST: (
+        CommandOp.GET_MINOR_BLOCK_TX_LIST_RESPONSE,
+        PeerShardConnection.handle_get_minor_block_tx_list_request,
+    ),
+    CommandOp.GET_TRANSACTION_LIST_REQUEST: (
+        CommandOp.GET_TRANSACTION_LIST_RESPONSE,
+        PeerShardConnection.handle_get_transaction_list_request,
+    ),
 }
 
 
@@ -330,7 +555,7 @@ class SyncTask:
                     self.shard_state.branch.to_str(), len(block_header_list)
                 )
             )
-            if not self.__validate_block_headers(block_header_list):
+            if not await self.__validate_block_headers(block_header_list):
                 # TODO: tag bad peer
                 return self.shard_conn.close_with_error(
                     "Bad peer sending discontinuing block headers"
@@ -371,28 +596,39 @@ class SyncTask:
     def __has_block_hash(self, block_hash):
         return self.shard_state.db.contain_minor_block_by_hash(block_hash)
 
-    def __validate_block_headers(self, block_header_list: List[MinorBlockHeader]):
+    async def __validate_block_headers(
+        self, block_header_list: List[MinorBlockHeader]
+    ):
         for i in range(len(block_header_list) - 1):
             header, prev = block_header_list[i : i + 2]  # type: MinorBlockHeader
             if header.height != prev.height + 1:
                 return False
             if header.hash_prev_minor_block != prev.get_hash():
                 return False
-            try:
-                # Note that PoSW may lower diff, so checks here are necessary but not sufficient
-                # More checks happen during block addition
-                shard_config = self.shard.env.quark_chain_config.shards[
-                    header.branch.get_full_shard_id()
-                ]
-                consensus_type = shard_config.CONSENSUS_TYPE
-                diff = header.difficulty
-                if shard_config.POSW_CONFIG.ENABLED:
-                    diff //= shard_config.POSW_CONFIG.DIFF_DIVIDER
-                validate_seal(header, consensus_type, adjusted_diff=diff)
-            except Exception as e:
+
+        # Note that PoSW may lower diff, so checks here are necessary but not sufficient
+        # More checks happen during block addition
+        shard_config = self.shard.env.quark_chain_config.shards[
+            self.shard_state.full_shard_id
+        ]
+        header_list = block_header_list[:-1]
+        diff_list = [header.difficulty for header in header_list]
+        if shard_config.POSW_CONFIG.ENABLED:
+            diff_list = [
+                diff // shard_config.POSW_CONFIG.DIFF_DIVIDER for diff in diff_list
+            ]
+        valid_list = await asyncio.get_event_loop().run_in_executor(
+            None,
+            validate_seal_batch,
+            header_list,
+            shard_config.CONSENSUS_TYPE,
+            diff_list,
+        )
+        for header, valid in zip(header_list, valid_list):
+            if not valid:
                 Logger.warning(
                     "[{}] got block with bad seal in sync: {}".format(
-                        header.branch.to_str(), str(e)
+                        header.branch.to_str(), header.get_hash().hex()
                     )
                 )
                 return False
@@ -441,17 +677,27 @@ class Synchronizer:
 
 
 class Shard:
-    def __init__(self, env, full_shard_id, slave):
+    def __init__(self, env, full_shard_id, slave, state=None):
         self.env = env
         self.full_shard_id = full_shard_id
         self.slave = slave
 
-        self.state = ShardState(env, full_shard_id, self.__init_shard_db())
+        self.state = (
+            state if state is not None else self.create_state(env, full_shard_id)
+        )
 
         self.loop = asyncio.get_event_loop()
         self.synchronizer = Synchronizer()
 
         self.peers = dict()  # cluster_peer_id -> PeerShardConnection
+        self.compact_block_relay = env.cluster_config.COMPACT_BLOCK_RELAY
+        self.tx_announcement = env.cluster_config.TX_ANNOUNCEMENT
+        self.tx_broadcast_window = env.cluster_config.TX_BROADCAST_WINDOW_MS / 1000
+        # txs announced by a peer and requested from it
+        self.requested_txs = RecentHashSet(KNOWN_TX_LIMIT, TX_REQUEST_TIMEOUT_SEC)
+        # block hash -> block recently broadcasted, for the peers missing its txs
+        self.relayed_blocks = OrderedDict()
+        self.compact_block_stats = Counter()
 
         # block hash -> future (that will return when the block is fully propagated in the cluster)
         # the block that has been added locally but not have been fully propagated will have an entry here
@@ -461,17 +707,20 @@ class Shard:
 
         self.__init_miner()
 
-    def __init_shard_db(self):
+    @staticmethod
+    def create_state(env, full_shard_id) -> ShardState:
         """
-        Create a PersistentDB or use the env.db if DB_PATH_ROOT is not specified in the ClusterConfig.
+        Create the shard state on a PersistentDB, or an InMemoryDb if DB_PATH_ROOT is not specified in the ClusterConfig.
+        Does not use the event loop so that it may run in another thread.
         """
-        if self.env.cluster_config.use_mem_db():
-            return InMemoryDb()
-
-        db_path = "{path}/shard-{shard_id}.db".format(
-            path=self.env.cluster_config.DB_PATH_ROOT, shard_id=self.full_shard_id
-        )
-        return PersistentDb(db_path, clean=self.env.cluster_config.CLEAN)
+        if env.cluster_config.use_mem_db():
+            db = InMemoryDb()
+        else:
+            db_path = "{path}/shard-{shard_id}.db".format(
+                path=env.cluster_config.DB_PATH_ROOT, shard_id=full_shard_id
+            )
+            db = PersistentDb(db_path, clean=env.cluster_config.CLEAN)
+        return ShardState(env, full_shard_id, db)
 
     def __init_miner(self):
         miner_address = Address.create_from(
@@ -510,14 +759,21 @@ class Shard:
             __add_block,
             __get_mining_param,
             remote=shard_config.CONSENSUS_CONFIG.REMOTE_MINE,
+            workers=self.env.cluster_config.MINING_WORKERS,
         )
 
+    def get_shard_stats(self) -> ShardStats:
+        stats = self.state.get_shard_stats()
+        stats.mining_hash_rates = self.miner.get_hash_rates()
+        return stats
+
     @property
     def genesis_root_height(self):
         return self.env.quark_chain_config.get_genesis_root_height(self.full_shard_id)
 
     def add_peer(self, peer: PeerShardConnection):
         self.peers[peer.cluster_peer_id] = peer
+        peer.send_announcements()
         Logger.info(
             "[{}] connected to peer {}".format(
                 Branch(self.full_shard_id).to_str(), peer.cluster_peer_id
@@ -539,8 +795,13 @@ class Shard:
         for conn in conns:
             self.add_peer(conn)
 
-    async def __init_genesis_state(self, root_block: RootBlock):
-        block, coinbase_amount_map = self.state.init_genesis_state(root_block)
+    async def __init_genesis_state(self, root_block: RootBlock, executor=None):
+        if executor is None:
+            block, coinbase_amount_map = self.state.init_genesis_state(root_block)
+        else:
+            block, coinbase_amount_map = await self.loop.run_in_executor(
+                executor, self.state.init_genesis_state, root_block
+            )
         xshard_list = []
         await self.slave.broadcast_xshard_tx_list(
             block, xshard_list, root_block.header.height
@@ -550,28 +811,52 @@ class Shard:
             len(block.tx_list),
             len(xshard_list),
             coinbase_amount_map,
-            self.state.get_shard_stats(),
+            self.get_shard_stats(),
         )
 
-    async def init_from_root_block(self, root_block: RootBlock):
-        """ Either recover state from local db or create genesis state based on config"""
+    async def init_from_root_block(self, root_block: RootBlock, executor=None):
+        """ Either recover state from local db or create genesis state based on config
+        The state is initialized in executor if given, only before the shard is used
+        """
         if root_block.header.height > self.genesis_root_height:
-            return self.state.init_from_root_block(root_block)
+            if executor is None:
+                return self.state.init_from_root_block(root_block)
+            return await self.loop.run_in_executor(
+                executor, self.state.init_from_root_block, root_block
+            )
 
         if root_block.header.height == self.genesis_root_height:
-            await self.__init_genesis_state(root_block)
+            await self.__init_genesis_state(root_block, executor)
 
     async def add_root_block(self, root_block: RootBlock):
         if root_block.header.height > self.genesis_root_height:
-            return self.state.add_root_block(root_block)
+            updated = self.state.add_root_block(root_block)
+            if updated:
+                self.miner.reset_work()
+            return updated
 
         # this happens when there is a root chain fork
         if root_block.header.height == self.genesis_root_height:
             await self.__init_genesis_state(root_block)
 
     def broadcast_new_block(self, block):
+        compact_block = None
         for cluster_peer_id, peer in self.peers.items():
-            peer.send_new_block(block)
+            if not peer.compact_block_enabled:
+                peer.send_new_block(block)
+                continue
+            if compact_block is None:
+                compact_block = NewCompactBlockMinorCommand.from_block(block)
+            peer.send_new_compact_block(compact_block)
+        self.relayed_blocks[block.header.get_hash()] = block
+        if len(self.relayed_blocks) > COMPACT_BLOCK_CACHE_SIZE:
+            self.relayed_blocks.popitem(last=False)
+
+    def get_relayed_block(self, block_hash):
+        block = self.relayed_blocks.get(block_hash)
+        if block is None:
+            block = self.state.db.get_minor_block_by_hash(block_hash)
+        return block
 
     def broadcast_new_tip(self):
         for cluster_peer_id, peer in self.peers.items():
@@ -714,11 +999,12 @@ class Shard:
         # TODO add ttl to blocks in new_block_header_pool
         self.state.new_block_header_pool.pop(block_hash, None)
         # block has been added to local state, broadcast tip so that peers can sync if needed
-        try:
-            if old_tip != self.state.header_tip:
+        if old_tip != self.state.header_tip:
+            self.miner.reset_work()
+            try:
                 self.broadcast_new_tip()
-        except Exception:
-            Logger.warning_every_sec("broadcast tip failure", 1)
+            except Exception:
+                Logger.warning_every_sec("broadcast tip failure", 1)
 
         # Add the block in future and wait
         self.add_block_futures[block_hash] = self.loop.create_future()
@@ -732,7 +1018,7 @@ class Shard:
             len(block.tx_list),
             len(xshard_list),
             coinbase_amount_map,
-            self.state.get_shard_stats(),
+            self.get_shard_stats(),
         )
 
         # Commit the block
@@ -1,14 +1,15 @@
-import asyncio
 import functools
 import json
 import time
 from collections import Counter, deque, defaultdict
 from fractions import Fraction
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Deque, Dict, List, Optional, Tuple, Union
 
+from quarkchain.cluster.account_prefetcher import AccountPrefetcher
 from quarkchain.cluster.filter import Filter
 from quarkchain.cluster.miner import validate_seal
 from quarkchain.cluster.neighbor import is_neighbor
+from quarkchain.cluster.parallel_executor import ParallelTxExecutor
 from quarkchain.cluster.rpc import ShardStats, TransactionDetail
 from quarkchain.cluster.shard_db_operator import ShardDbOperator
 from quarkchain.core import (
@@ -37,6 +38,7 @@ from quarkchain.evm.state import State as EvmState
 from quarkchain.evm.transaction_queue import TransactionQueue
 from quarkchain.evm.transactions import Transaction as EvmTransaction
 from quarkchain.evm.utils import add_dict
+from quarkchain.evm.vm import code_cache
 from quarkchain.genesis import GenesisManager
 from quarkchain.reward import ConstMinorBlockRewardCalcultor
 from quarkchain.utils import Logger, check, time_ms
@@ -251,14 +253,20 @@ class ShardState:
 
         # new blocks that passed POW validation and should be made available to whole network
         self.new_block_header_pool = dict()
-        # header hash -> (height, [coinbase address]) during previous blocks (ascending)
+        # header hash -> (height, [coinbase address], counts) during previous blocks (ascending)
         self.coinbase_addr_cache = defaultdict(
             dict
-        )  # type: Dict[int, Dict[bytes, Tuple[int, Deque[bytes]]]]
+        )  # type: Dict[int, Dict[bytes, Tuple[int, Deque[bytes], Counter]]]
+        # header hash -> (height, {coinbase address: stakes}) in the state of the block
+        self.posw_stake_cache = dict()  # type: Dict[bytes, Tuple[int, dict]]
         self.genesis_token_id = self.env.quark_chain_config.genesis_token
         self.local_fee_rate = (
             1 - self.env.quark_chain_config.reward_tax_rate
         )  # type: Fraction
+        workers = self.env.cluster_config.PARALLEL_TX_WORKERS
+        self.tx_executor = ParallelTxExecutor(workers) if workers > 1 else None
+        threads = self.env.cluster_config.PREFETCH_ACCOUNT_THREADS
+        self.account_prefetcher = AccountPrefetcher(threads) if threads > 0 else None
 
     def init_from_root_block(self, root_block):
         """ Master will send its root chain tip when it connects to slaves.
@@ -388,9 +396,12 @@ class ShardState:
         from_address=None,
         gas=None,
         xshard_gas_limit=None,
+        evm_tx=None,
     ) -> EvmTransaction:
-        """from_address will be set for execute_tx"""
-        evm_tx = tx.tx.to_evm_tx()
+        """from_address will be set for execute_tx
+        evm_tx is tx.tx.to_evm_tx() if it has been decoded already"""
+        if evm_tx is None:
+            evm_tx = tx.tx.to_evm_tx()
 
         if from_address:
             check(evm_tx.from_full_shard_key == from_address.full_shard_key)
@@ -719,13 +730,27 @@ class ShardState:
         if evm_state.gas_used < block.meta.evm_xshard_gas_limit:
             evm_state.gas_limit -= block.meta.evm_xshard_gas_limit - evm_state.gas_used
 
+        evm_txs = [tx.tx.to_evm_tx() for tx in block.tx_list]
+        if self.account_prefetcher:
+            self.account_prefetcher.prefetch(evm_state, evm_txs)
+
+        speculation = None
+        if self.tx_executor:
+            speculation = self.__speculate_block_txs(block, evm_state, evm_txs)
+
         for idx, tx in enumerate(block.tx_list):
             try:
                 evm_tx = self.__validate_tx(
-                    tx, evm_state, xshard_gas_limit=block.meta.evm_xshard_gas_limit
+                    tx,
+                    evm_state,
+                    xshard_gas_limit=block.meta.evm_xshard_gas_limit,
+                    evm_tx=evm_txs[idx],
                 )
                 evm_tx.set_quark_chain_config(self.env.quark_chain_config)
-                apply_transaction(evm_state, evm_tx, tx.get_hash())
+                if speculation:
+                    speculation.apply_transaction(idx, evm_tx, tx.get_hash())
+                else:
+                    apply_transaction(evm_state, evm_tx, tx.get_hash())
             except Exception as e:
                 Logger.debug_exception()
                 Logger.debug(
@@ -735,6 +760,13 @@ class ShardState:
                 )
                 raise e
 
+        if speculation:
+            Logger.debug(
+                "Speculated {} txs, {} executed again".format(
+                    len(block.tx_list), speculation.executed
+                )
+            )
+
         # Pay miner
         pure_coinbase_amount = self.get_coinbase_amount_map(block.header.height)
         for k, v in pure_coinbase_amount.balance_map.items():
@@ -744,6 +776,14 @@ class ShardState:
         evm_state.commit()
         return evm_state
 
+    def __speculate_block_txs(self, block, evm_state, evm_txs):
+        """ Executes the txs of the block on worker processes against evm_state """
+        txs = []
+        for tx, evm_tx in zip(block.tx_list, evm_txs):
+            evm_tx.set_quark_chain_config(self.env.quark_chain_config)
+            txs.append((evm_tx, tx.get_hash()))
+        return self.tx_executor.speculate(evm_state, txs)
+
     def __is_minor_block_linked_to_root_tip(self, m_block):
         """ Determine whether a minor block is a descendant of a minor block confirmed by root tip
         """
@@ -944,6 +984,7 @@ class ShardState:
                 time.time() - start_time, len(block.tx_list)
             )
         )
+        Logger.debug("EVM code cache {}".format(code_cache.get_stats()))
         tracking_data_str = block.tracking_data.decode("utf-8")
         if tracking_data_str != "":
             tracking_data = json.loads(tracking_data_str)
@@ -962,10 +1003,8 @@ class ShardState:
                 "propagation_latency_ms": start_ms - tracking_data.get("mined", 0),
                 "num_tx": len(block.tx_list),
             }
-            asyncio.ensure_future(
-                self.env.cluster_config.kafka_logger.log_kafka_sample_async(
-                    self.env.cluster_config.MONITORING.PROPAGATION_TOPIC, sample
-                )
+            self.env.cluster_config.kafka_logger.add_kafka_sample(
+                self.env.cluster_config.MONITORING.PROPAGATION_TOPIC, sample
             )
         return evm_state.xshard_list, coinbase_amount_map
 
@@ -1669,17 +1708,14 @@ class ShardState:
         diff = header.difficulty
         coinbase_recipient = header.coinbase_address.recipient
         # Evaluate stakes before the to-be-added block
-        evm_state = self._get_evm_state_for_new_block(block, ephemeral=True)
         config = self.shard_config.POSW_CONFIG
-        stakes = evm_state.get_balance(
-            coinbase_recipient, self.env.quark_chain_config.genesis_token
-        )
+        stakes = self._get_posw_stakes(header.hash_prev_minor_block, coinbase_recipient)
         block_threshold = stakes // config.TOTAL_STAKE_PER_BLOCK
         block_threshold = min(config.WINDOW_SIZE, block_threshold)
         # The func is inclusive, so need to fetch block counts until prev block
         # Also only fetch prev window_size - 1 block counts because the
         # new window should count the current block
-        block_cnt = self._get_posw_coinbase_blockcnt(
+        _, block_cnt = self.__get_coinbase_addresses_until_block(
             header.hash_prev_minor_block, length=config.WINDOW_SIZE - 1
         )
         cnt = block_cnt.get(coinbase_recipient, 0)
@@ -1704,20 +1740,28 @@ class ShardState:
 
     def __get_coinbase_addresses_until_block(
         self, header_hash: bytes, length: int
-    ) -> List[bytes]:
-        """Get coinbase addresses up until block of given hash within the window."""
+    ) -> Tuple[Deque[bytes], Counter]:
+        """Get coinbase addresses up until block of given hash within the window,
+        along with their block counts. Both are cached and must not be modified."""
+        cache = self.coinbase_addr_cache[length]
+        if header_hash in cache:
+            _, addrs, blockcnt = cache[header_hash]
+            return addrs, blockcnt
         header = self.db.get_minor_block_header_by_hash(header_hash)
         if not header:
             raise ValueError("curr block not found: hash {}".format(header_hash.hex()))
         height = header.height
         prev_hash = header.hash_prev_minor_block
-        cache = self.coinbase_addr_cache[length]
         if prev_hash in cache:  # mem cache hit
-            _, addrs = cache[prev_hash]
-            addrs = addrs.copy()
+            _, addrs, blockcnt = cache[prev_hash]
+            addrs, blockcnt = addrs.copy(), blockcnt.copy()
             if len(addrs) == length:
-                addrs.popleft()
+                addr = addrs.popleft()
+                blockcnt[addr] -= 1
+                if blockcnt[addr] == 0:
+                    del blockcnt[addr]
             addrs.append(header.coinbase_address.recipient)
+            blockcnt[header.coinbase_address.recipient] += 1
         else:  # miss, iterating DB
             addrs = deque()
             for _ in range(length):
@@ -1728,17 +1772,18 @@ class ShardState:
                     header.hash_prev_minor_block
                 )
                 check(header is not None, "mysteriously missing block")
-        cache[header_hash] = (height, addrs)
+            blockcnt = Counter(addrs)
+        cache[header_hash] = (height, addrs, blockcnt)
         # in case cached too much, clean up
         if len(cache) > 128:  # size around 640KB if window size 256
             self.coinbase_addr_cache[length] = {
-                k: (h, addrs)
-                for k, (h, addrs) in cache.items()
-                if h > height - 16  # keep most recent ones
+                k: v
+                for k, v in cache.items()
+                if v[0] > height - 16  # keep most recent ones
             }
 
         check(len(addrs) <= length)
-        return list(addrs)
+        return addrs, blockcnt
 
     def _get_posw_coinbase_blockcnt(
         self, header_hash: bytes, length: int
@@ -1748,8 +1793,39 @@ class ShardState:
 
         Raise ValueError if anything goes wrong.
         """
-        coinbase_addrs = self.__get_coinbase_addresses_until_block(header_hash, length)
-        return Counter(coinbase_addrs)
+        _, blockcnt = self.__get_coinbase_addresses_until_block(header_hash, length)
+        return blockcnt.copy()
+
+    def _get_posw_stakes(self, header_hash: bytes, recipient: bytes) -> int:
+        """ PoSW needed function: get the stakes of a coinbase address in the state
+        of the given block, cached by block hash.
+
+        Raise ValueError if anything goes wrong.
+        """
+        if header_hash not in self.posw_stake_cache:
+            header = self.db.get_minor_block_header_by_hash(header_hash)
+            if not header:
+                raise ValueError(
+                    "curr block not found: hash {}".format(header_hash.hex())
+                )
+            self.posw_stake_cache[header_hash] = (header.height, dict())
+            # in case cached too much, clean up
+            if len(self.posw_stake_cache) > 128:
+                self.posw_stake_cache = {
+                    k: v
+                    for k, v in self.posw_stake_cache.items()
+                    if v[0] > header.height - 16  # keep most recent ones
+                }
+        _, stakes = self.posw_stake_cache[header_hash]
+        if recipient not in stakes:
+            # read only, no need for an ephemeral state or the disallow map
+            evm_state = self.__create_evm_state(
+                self.db.get_minor_block_evm_root_hash_by_hash(header_hash), {}
+            )
+            stakes[recipient] = evm_state.get_balance(
+                recipient, self.env.quark_chain_config.genesis_token
+            )
+        return stakes[recipient]
 
     def _get_sender_disallow_map(self, header_hash, recipient=None) -> Dict[bytes, int]:
         """Take an additional recipient parameter and add its block count."""
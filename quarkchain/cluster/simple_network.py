@@ -15,10 +15,7 @@ from quarkchain.cluster.p2p_commands import (
     GetRootBlockHeaderListResponse,
     Direction,
 )
-from quarkchain.cluster.p2p_commands import (
-    NewTransactionListCommand,
-    GetRootBlockListResponse,
-)
+from quarkchain.cluster.p2p_commands import GetRootBlockListResponse
 from quarkchain.cluster.protocol import P2PConnection, ROOT_SHARD_ID
 from quarkchain.constants import (
     NEW_TRANSACTION_LIST_LIMIT,
@@ -214,7 +211,7 @@ class Peer(P2PConnection):
             Logger.debug(
                 "Received tx {} from peer {}".format(tx.get_hash().hex(), self.id.hex())
             )
-            await self.master_server.add_transaction(tx, self)
+            await self.master_server.add_transaction(tx)
 
     async def handle_new_minor_block_header_list(self, op, cmd, rpc_id):
         if len(cmd.minor_block_header_list) != 0:
@@ -333,11 +330,6 @@ class Peer(P2PConnection):
             cmd=NewMinorBlockHeaderListCommand(self.root_state.tip, []),
         )
 
-    def send_transaction(self, tx):
-        self.write_command(
-            op=CommandOp.NEW_TRANSACTION_LIST, cmd=NewTransactionListCommand([tx])
-        )
-
 
 # Only for non-RPC (fire-and-forget) and RPC request commands
 OP_NONRPC_MAP = {
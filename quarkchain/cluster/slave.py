@@ -2,16 +2,19 @@ import argparse
 import asyncio
 import errno
 import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple, Dict, List, Union
 
 from quarkchain.cluster.cluster_config import ClusterConfig
-from quarkchain.cluster.miner import MiningWork
+from quarkchain.cluster.miner import MiningWork, set_pow_cache_dir
 from quarkchain.cluster.neighbor import is_neighbor
 from quarkchain.cluster.p2p_commands import CommandOp, GetMinorBlockListRequest
 from quarkchain.cluster.protocol import (
     ClusterConnection,
     ForwardingVirtualConnection,
     NULL_CONNECTION,
+    open_slave_connection,
 )
 from quarkchain.cluster.rpc import (
     AddMinorBlockHeaderRequest,
@@ -50,6 +53,7 @@ from quarkchain.cluster.rpc import (
     AccountBranchData,
     BatchAddXshardTxListRequest,
     BatchAddXshardTxListResponse,
+    CompressedBatchAddXshardTxListRequest,
     MineResponse,
     GenTxResponse,
     GetTransactionListByAddressResponse,
@@ -103,6 +107,9 @@ class MasterConnection(ClusterConnection):
 
         # cluster_peer_id -> {branch_value -> shard_conn}
         self.v_conn_map = dict()
+        # set by handle_ping if the connection is from a read-only client
+        self.read_only = False
+        self.ping_received_future = self.loop.create_future()
 
     def get_connection_to_forward(self, metadata):
         """ Override ProxyConnection.get_connection_to_forward()
@@ -144,6 +151,11 @@ class MasterConnection(ClusterConnection):
         )
 
     def close(self):
+        if self.read_only:
+            Logger.info("Lost connection with read-only client")
+            super().close()
+            return
+
         for shard in self.shards.values():
             for peer_shard_conn in shard.peers.values():
                 peer_shard_conn.get_forwarding_connection().close()
@@ -166,9 +178,26 @@ class MasterConnection(ClusterConnection):
     # Cluster RPC handlers
 
     async def handle_ping(self, ping):
+        if not self.ping_received_future.done():
+            self.ping_received_future.set_result(None)
+        if ping.read_only:
+            # A read-only client connected before master, which is the next one
+            self.read_only = True
+            self.op_non_rpc_map = dict()
+            self.op_rpc_map = READ_ONLY_OP_RPC_MAP
+            if self.slave_server.master is self:
+                self.slave_server.master = None
+            Logger.info("Read-only client {} connected".format(ping.id))
+            return Pong(self.slave_server.id, self.slave_server.chain_mask_list)
+
         if ping.root_tip:
             await self.slave_server.create_shards(ping.root_tip)
-        return Pong(self.slave_server.id, self.slave_server.chain_mask_list)
+        return Pong(
+            self.slave_server.id,
+            self.slave_server.chain_mask_list,
+            shard_count=len(self.slave_server.shards),
+            pending_shard_count=len(self.slave_server.pending_shards),
+        )
 
     async def handle_connect_to_slaves_request(self, connect_to_slave_request):
         """
@@ -461,7 +490,7 @@ class MasterConnection(ClusterConnection):
             check(shard is not None)
             return SyncMinorBlockListResponse(
                 error_code=0,
-                shard_stats=shard.state.get_shard_stats(),
+                shard_stats=shard.get_shard_stats(),
                 block_coinbase_map=block_coinbase_map,
             )
         except Exception:
@@ -643,6 +672,18 @@ class SlaveConnection(Connection):
         self.chain_mask_list = chain_mask_list
         self.shards = self.slave_server.shards
 
+        self.xshard_batch_window = env.slave_config.XSHARD_BATCH_WINDOW_MS / 1000
+        self.xshard_batch_max_deposits = env.slave_config.XSHARD_BATCH_MAX_DEPOSITS
+        self.xshard_compression_threshold = (
+            env.slave_config.XSHARD_COMPRESSION_THRESHOLD
+        )
+        # set from the remote slave's Ping/Pong
+        self.peer_accept_compressed_xshard = False
+        # list of (AddXshardTxListRequest, future) waiting for the batch window
+        self.pending_xshard_list = []
+        self.pending_xshard_deposit_count = 0
+        self.xshard_flush_handle = None
+
         self.ping_received_future = asyncio.get_event_loop().create_future()
 
         asyncio.ensure_future(self.active_and_loop_forever())
@@ -650,6 +691,11 @@ class SlaveConnection(Connection):
     async def wait_until_ping_received(self):
         await self.ping_received_future
 
+    def close(self):
+        super().close()
+        # fail the pending requests as the connection is no longer active
+        self.__flush_pending_xshard_list()
+
     def has_shard(self, full_shard_id: int):
         for chain_mask in self.chain_mask_list:
             if chain_mask.contain_full_shard_id(full_shard_id):
@@ -666,10 +712,80 @@ class SlaveConnection(Connection):
             self.slave_server.id,
             self.slave_server.chain_mask_list,
             RootBlock(RootBlockHeader()),
+            accept_compressed_xshard=self.xshard_compression_threshold > 0,
         )
         op, resp, rpc_id = await self.write_rpc_request(ClusterOp.PING, req)
+        self.peer_accept_compressed_xshard = resp.accept_compressed_xshard
         return (resp.id, resp.chain_mask_list)
 
+    def write_xshard_tx_list_request(self, request: AddXshardTxListRequest):
+        """ Send the x-shard deposits of a block to the remote slave.
+        Returns a future that is done once the remote slave has added them.
+        With XSHARD_BATCH_WINDOW_MS, requests are held for at most the window
+        and sent together with the ones from other blocks.
+        """
+        if self.xshard_batch_window <= 0:
+            return self.write_batch_xshard_tx_list_request([request])
+
+        future = asyncio.get_event_loop().create_future()
+        self.pending_xshard_list.append((request, future))
+        self.pending_xshard_deposit_count += len(request.tx_list.tx_list)
+        if self.pending_xshard_deposit_count >= self.xshard_batch_max_deposits:
+            self.__flush_pending_xshard_list()
+        elif self.xshard_flush_handle is None:
+            self.xshard_flush_handle = asyncio.get_event_loop().call_later(
+                self.xshard_batch_window, self.__flush_pending_xshard_list
+            )
+        return future
+
+    def write_batch_xshard_tx_list_request(self, request_list):
+        """ Send a list of AddXshardTxListRequest in one RPC, compressed if both
+        ends enable compression and the payload is above the threshold.
+        """
+        if len(request_list) == 1:
+            op = ClusterOp.ADD_XSHARD_TX_LIST_REQUEST
+            data = request_list[0].serialize()
+        else:
+            op = ClusterOp.BATCH_ADD_XSHARD_TX_LIST_REQUEST
+            data = BatchAddXshardTxListRequest(request_list).serialize()
+
+        if (
+            self.peer_accept_compressed_xshard
+            and 0 < self.xshard_compression_threshold < len(data)
+        ):
+            if op == ClusterOp.ADD_XSHARD_TX_LIST_REQUEST:
+                data = BatchAddXshardTxListRequest(request_list).serialize()
+            op = ClusterOp.COMPRESSED_BATCH_ADD_XSHARD_TX_LIST_REQUEST
+            data = CompressedBatchAddXshardTxListRequest(
+                zlib.compress(data)
+            ).serialize()
+
+        return self.write_raw_rpc_request(op, data)
+
+    def __flush_pending_xshard_list(self):
+        if self.xshard_flush_handle is not None:
+            self.xshard_flush_handle.cancel()
+            self.xshard_flush_handle = None
+        pending_xshard_list = self.pending_xshard_list
+        self.pending_xshard_list = []
+        self.pending_xshard_deposit_count = 0
+        if not pending_xshard_list:
+            return
+
+        def __on_done(rpc_future):
+            for _, future in pending_xshard_list:
+                if future.cancelled():
+                    continue
+                if rpc_future.exception():
+                    future.set_exception(rpc_future.exception())
+                else:
+                    future.set_result(rpc_future.result())
+
+        rpc_future = self.write_batch_xshard_tx_list_request(
+            [request for request, _ in pending_xshard_list]
+        )
+        rpc_future.add_done_callback(__on_done)
+
     # Cluster RPC handlers
 
     async def handle_ping(self, ping: Ping):
@@ -677,14 +793,24 @@ class SlaveConnection(Connection):
             self.id = ping.id
             self.chain_mask_list = ping.chain_mask_list
 
-        if len(self.chain_mask_list) == 0:
+        # A read-only client such as a JSON-RPC gateway has no shards and
+        # never receives x-shard tx lists
+        if ping.read_only:
+            self.chain_mask_list = []
+            Logger.info("Read-only client {} connected".format(self.id))
+        elif len(self.chain_mask_list) == 0:
             return self.close_with_error(
                 "Empty shard mask list from slave {}".format(self.id)
             )
 
+        self.peer_accept_compressed_xshard = ping.accept_compressed_xshard
         self.ping_received_future.set_result(None)
 
-        return Pong(self.slave_server.id, self.slave_server.chain_mask_list)
+        return Pong(
+            self.slave_server.id,
+            self.slave_server.chain_mask_list,
+            accept_compressed_xshard=self.xshard_compression_threshold > 0,
+        )
 
     # Blockchain RPC handlers
 
@@ -707,6 +833,77 @@ class SlaveConnection(Connection):
                 return BatchAddXshardTxListResponse(error_code=response.error_code)
         return BatchAddXshardTxListResponse(error_code=0)
 
+    async def handle_compressed_batch_add_xshard_tx_list_request(self, request):
+        # bound the decompressed size as for the uncompressed commands
+        size_limit = (
+            self.command_size_limit
+            or self.env.quark_chain_config.P2P_COMMAND_SIZE_LIMIT
+        )
+        decompressor = zlib.decompressobj()
+        data = decompressor.decompress(request.data, size_limit)
+        if decompressor.unconsumed_tail:
+            Logger.error(
+                "Compressed x-shard tx lists from {} exceed {} bytes".format(
+                    self.id, size_limit
+                )
+            )
+            return BatchAddXshardTxListResponse(error_code=errno.E2BIG)
+        batch_request = BatchAddXshardTxListRequest.deserialize(data)
+        return await self.handle_batch_add_xshard_tx_list_request(batch_request)
+
+
+# Read-only queries, served the same way as those from master
+READ_ONLY_OP_RPC_MAP = {
+    ClusterOp.GET_ECO_INFO_LIST_REQUEST: (
+        ClusterOp.GET_ECO_INFO_LIST_RESPONSE,
+        MasterConnection.handle_get_eco_info_list_request,
+    ),
+    ClusterOp.GET_ACCOUNT_DATA_REQUEST: (
+        ClusterOp.GET_ACCOUNT_DATA_RESPONSE,
+        MasterConnection.handle_get_account_data_request,
+    ),
+    ClusterOp.GET_MINOR_BLOCK_REQUEST: (
+        ClusterOp.GET_MINOR_BLOCK_RESPONSE,
+        MasterConnection.handle_get_minor_block_request,
+    ),
+    ClusterOp.GET_TRANSACTION_REQUEST: (
+        ClusterOp.GET_TRANSACTION_RESPONSE,
+        MasterConnection.handle_get_transaction_request,
+    ),
+    ClusterOp.EXECUTE_TRANSACTION_REQUEST: (
+        ClusterOp.EXECUTE_TRANSACTION_RESPONSE,
+        MasterConnection.handle_execute_transaction,
+    ),
+    ClusterOp.GET_TRANSACTION_RECEIPT_REQUEST: (
+        ClusterOp.GET_TRANSACTION_RECEIPT_RESPONSE,
+        MasterConnection.handle_get_transaction_receipt_request,
+    ),
+    ClusterOp.GET_TRANSACTION_LIST_BY_ADDRESS_REQUEST: (
+        ClusterOp.GET_TRANSACTION_LIST_BY_ADDRESS_RESPONSE,
+        MasterConnection.handle_get_transaction_list_by_address_request,
+    ),
+    ClusterOp.GET_LOG_REQUEST: (
+        ClusterOp.GET_LOG_RESPONSE,
+        MasterConnection.handle_get_logs,
+    ),
+    ClusterOp.ESTIMATE_GAS_REQUEST: (
+        ClusterOp.ESTIMATE_GAS_RESPONSE,
+        MasterConnection.handle_estimate_gas,
+    ),
+    ClusterOp.GET_STORAGE_REQUEST: (
+        ClusterOp.GET_STORAGE_RESPONSE,
+        MasterConnection.handle_get_storage_at,
+    ),
+    ClusterOp.GET_CODE_REQUEST: (
+        ClusterOp.GET_CODE_RESPONSE,
+        MasterConnection.handle_get_code,
+    ),
+    ClusterOp.GAS_PRICE_REQUEST: (
+        ClusterOp.GAS_PRICE_RESPONSE,
+        MasterConnection.handle_gas_price,
+    ),
+}
+
 
 SLAVE_OP_NONRPC_MAP = {}
 
@@ -721,6 +918,11 @@ SLAVE_OP_RPC_MAP = {
         ClusterOp.BATCH_ADD_XSHARD_TX_LIST_RESPONSE,
         SlaveConnection.handle_batch_add_xshard_tx_list_request,
     ),
+    ClusterOp.COMPRESSED_BATCH_ADD_XSHARD_TX_LIST_REQUEST: (
+        ClusterOp.COMPRESSED_BATCH_ADD_XSHARD_TX_LIST_RESPONSE,
+        SlaveConnection.handle_compressed_batch_add_xshard_tx_list_request,
+    ),
+    **READ_ONLY_OP_RPC_MAP,
 }
 
 
@@ -777,7 +979,9 @@ class SlaveConnectionManager:
         host = slave_info.host.decode("ascii")
         port = slave_info.port
         try:
-            reader, writer = await asyncio.open_connection(host, port, loop=self.loop)
+            reader, writer = await open_slave_connection(
+                self.env.cluster_config, slave_info, loop=self.loop
+            )
         except Exception as e:
             err_msg = "Failed to connect {}:{} with exception {}".format(host, port, e)
             Logger.info(err_msg)
@@ -828,9 +1032,13 @@ class SlaveServer:
         self.master = None
         self.name = name
         self.mining = False
+        self.server = None
+        self.unix_server = None
 
         self.artificial_tx_config = None
         self.shards = dict()  # type: Dict[Branch, Shard]
+        # shards being initialized by create_shards
+        self.pending_shards = dict()  # type: Dict[Branch, asyncio.Future]
         self.shutdown_future = self.loop.create_future()
 
         # block hash -> future (that will return when the block is fully propagated in the cluster)
@@ -853,19 +1061,27 @@ class SlaveServer:
 
     async def create_shards(self, root_block: RootBlock):
         """ Create shards based on GENESIS config and root block height if they have
-        not been created yet."""
+        not been created yet.
+        Opening the db and recovering or creating the genesis state of the new shards
+        run in SHARD_INIT_THREADS threads, before the shards are used."""
 
-        async def __init_shard(shard):
-            await shard.init_from_root_block(root_block)
-            await shard.create_peer_shard_connections(
-                self.cluster_peer_ids, self.master
-            )
-            branch = Branch(shard.full_shard_id)
-            self.shards[branch] = shard
-            if self.mining:
-                shard.miner.start()
+        async def __init_shard(branch, executor):
+            try:
+                state = await self.loop.run_in_executor(
+                    executor, Shard.create_state, self.env, branch.value
+                )
+                shard = Shard(self.env, branch.value, self, state)
+                await shard.init_from_root_block(root_block, executor)
+                await shard.create_peer_shard_connections(
+                    self.cluster_peer_ids, self.master
+                )
+                self.shards[branch] = shard
+                if self.mining:
+                    shard.miner.start()
+            finally:
+                del self.pending_shards[branch]
 
-        new_shards = []
+        branches = []
         for (full_shard_id, shard_config) in self.env.quark_chain_config.shards.items():
             branch = Branch(full_shard_id)
             if branch in self.shards:
@@ -873,9 +1089,24 @@ class SlaveServer:
             if not self.__cover_shard_id(full_shard_id) or not shard_config.GENESIS:
                 continue
             if root_block.header.height >= shard_config.GENESIS.ROOT_HEIGHT:
-                new_shards.append(Shard(self.env, full_shard_id, self))
+                branches.append(branch)
 
-        await asyncio.gather(*[__init_shard(shard) for shard in new_shards])
+        new_branches = [b for b in branches if b not in self.pending_shards]
+        if not new_branches:
+            # the shards being created by a previous call
+            await asyncio.gather(*[self.pending_shards[b] for b in branches])
+            return
+        executor = ThreadPoolExecutor(
+            min(self.env.slave_config.SHARD_INIT_THREADS, len(new_branches))
+        )
+        for branch in new_branches:
+            self.pending_shards[branch] = asyncio.ensure_future(
+                __init_shard(branch, executor)
+            )
+        try:
+            await asyncio.gather(*[self.pending_shards[b] for b in branches])
+        finally:
+            executor.shutdown(wait=False)
 
     def start_mining(self, artificial_tx_config):
         self.artificial_tx_config = artificial_tx_config
@@ -901,7 +1132,10 @@ class SlaveServer:
             shard.miner.disable()
 
     async def __handle_new_connection(self, reader, writer):
-        # The first connection should always come from master
+        # The first connection is taken as the one from master, unless its ping
+        # tells it is from a read-only client, so wait for the ping to tell
+        if self.master and not self.master.ping_received_future.done():
+            await self.master.ping_received_future
         if not self.master:
             self.master = MasterConnection(
                 self.env, reader, writer, self, name="{}_master".format(self.name)
@@ -911,6 +1145,17 @@ class SlaveServer:
 
     async def __start_server(self):
         """ Run the server until shutdown is called """
+        # listening on the Unix socket first, for the master to find it when connecting
+        path = self.env.cluster_config.get_slave_socket_path(self.id)
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # left by a slave not shut down cleanly
+            if os.path.exists(path):
+                os.remove(path)
+            self.unix_server = await asyncio.start_unix_server(
+                self.__handle_new_connection, path, loop=self.loop
+            )
+            Logger.info("Listening on {} for intra-cluster RPC".format(path))
         self.server = await asyncio.start_server(
             self.__handle_new_connection,
             "0.0.0.0",
@@ -938,6 +1183,11 @@ class SlaveServer:
 
         self.slave_connection_manager.close_all()
         self.server.close()
+        if self.unix_server:
+            self.unix_server.close()
+            path = self.env.cluster_config.get_slave_socket_path(self.id)
+            if os.path.exists(path):
+                os.remove(path)
 
     def get_shutdown_future(self):
         return self.shutdown_future
@@ -1048,9 +1298,7 @@ class SlaveServer:
             ) in self.slave_connection_manager.get_connections_by_full_shard_id(
                 branch.get_full_shard_id()
             ):
-                future = slave_conn.write_rpc_request(
-                    ClusterOp.ADD_XSHARD_TX_LIST_REQUEST, request
-                )
+                future = slave_conn.write_xshard_tx_list_request(request)
                 rpc_futures.append(future)
         responses = await asyncio.gather(*rpc_futures)
         check(all([response.error_code == 0 for _, response, _ in responses]))
@@ -1102,15 +1350,12 @@ class SlaveServer:
                         request.minor_block_hash, request.tx_list
                     )
 
-            batch_request = BatchAddXshardTxListRequest(request_list)
             for (
                 slave_conn
             ) in self.slave_connection_manager.get_connections_by_full_shard_id(
                 branch.get_full_shard_id()
             ):
-                future = slave_conn.write_rpc_request(
-                    ClusterOp.BATCH_ADD_XSHARD_TX_LIST_REQUEST, batch_request
-                )
+                future = slave_conn.write_batch_xshard_tx_list_request(request_list)
                 rpc_futures.append(future)
         responses = await asyncio.gather(*rpc_futures)
         check(all([response.error_code == 0 for _, response, _ in responses]))
@@ -1133,7 +1378,10 @@ class SlaveServer:
         shard = self.shards.get(branch, None)
         if not shard:
             return False
-        return shard.add_tx(tx)
+        if not shard.add_tx(tx):
+            return False
+        shard.broadcast_tx_list([tx])
+        return True
 
     def execute_tx(self, tx: TypedTransaction, from_address) -> Optional[bytes]:
         evm_tx = tx.tx.to_evm_tx()
@@ -1326,6 +1574,8 @@ def parse_args():
     env = DEFAULT_ENV.copy()
     env.cluster_config = ClusterConfig.create_from_args(args)
     env.slave_config = env.cluster_config.get_slave_config(args.node_id)
+    if not env.cluster_config.use_mem_db():
+        set_pow_cache_dir(env.cluster_config.get_pow_cache_dir())
 
     return env
 
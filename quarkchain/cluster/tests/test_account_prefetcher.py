@@ -0,0 +1,82 @@
+import unittest
+
+from quarkchain.cluster.account_prefetcher import AccountPrefetcher
+from quarkchain.cluster.tests.test_shard_state import create_default_shard_state
+from quarkchain.cluster.tests.test_utils import (
+    create_transfer_transaction,
+    get_test_env,
+)
+from quarkchain.core import Address, Identity
+
+
+class TestAccountPrefetcher(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.id1 = Identity.create_random_identity()
+        self.acc1 = Address.create_from_identity(self.id1, full_shard_key=0)
+        self.acc2 = Address.create_random_account(full_shard_key=0)
+        self.env = get_test_env(
+            genesis_account=self.acc1, genesis_minor_quarkash=10 ** 20
+        )
+        self.state = create_default_shard_state(env=self.env)
+        # Add a root block to have all the shards initialized
+        root_block = self.state.root_tip.create_block_to_append().finalize()
+        self.state.add_root_block(root_block)
+
+    def create_block(self, to_address, count, nonce=0):
+        block = self.state.get_tip().create_block_to_append()
+        for i in range(count):
+            block.add_tx(
+                create_transfer_transaction(
+                    shard_state=self.state,
+                    key=self.id1.get_key(),
+                    from_address=self.acc1,
+                    to_address=to_address,
+                    value=12345,
+                    nonce=nonce + i,
+                )
+            )
+        return block
+
+    def test_prefetch(self):
+        block = self.create_block(self.acc2, 2)
+        evm_state = self.state._get_evm_state_for_new_block(block)
+        evm_txs = [tx.tx.to_evm_tx() for tx in block.tx_list]
+        prefetcher = AccountPrefetcher(2)
+        self.assertEqual(prefetcher.prefetch(evm_state, evm_txs), 3)
+        # the recipient does not exist yet
+        self.assertEqual(set(evm_state.cache), {self.acc1.recipient})
+        self.assertEqual(
+            evm_state.get_balance(self.acc1.recipient),
+            self.state.get_token_balance(
+                self.acc1.recipient, self.state.genesis_token_id
+            ),
+        )
+        self.assertEqual(evm_txs[0].sender, self.acc1.recipient)
+
+        self.state.finalize_and_add_block(block)
+        block = self.create_block(self.acc1, 0)
+        evm_state = self.state._get_evm_state_for_new_block(block)
+        prefetcher.prefetch(evm_state, [])
+        self.assertEqual(
+            set(evm_state.cache), {block.header.coinbase_address.recipient}
+        )
+
+    def test_add_block(self):
+        self.state.account_prefetcher = AccountPrefetcher(2)
+        self.state.finalize_and_add_block(self.create_block(self.acc2, 3))
+        block = self.create_block(self.acc2, 5, nonce=3)
+        expected = self.state.run_block(block, evm_state=None)
+        self.state.account_prefetcher = None
+        self.assertEqual(
+            self.state.run_block(block, evm_state=None).trie.root_hash,
+            expected.trie.root_hash,
+        )
+        self.state.finalize_and_add_block(block)
+        self.assertEqual(self.state.header_tip, block.header)
+        self.assertEqual(
+            self.state.get_token_balance(
+                self.acc2.recipient, self.state.genesis_token_id
+            ),
+            12345 * 8,
+        )
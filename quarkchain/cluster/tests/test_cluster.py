@@ -1,4 +1,11 @@
+import asyncio
+import errno
+import os
+import socket
+import tempfile
 import unittest
+import zlib
+from quarkchain.cluster.rpc import ClusterOp, CompressedBatchAddXshardTxListRequest
 from quarkchain.cluster.tests.test_utils import (
     create_transfer_transaction,
     ClusterContext,
@@ -48,6 +55,38 @@ class TestCluster(unittest.TestCase):
         with ClusterContext(3) as clusters:
             self.assertEqual(len(clusters), 3)
 
+    def test_shard_init_progress(self):
+        with ClusterContext(1, chain_size=2, shard_size=2) as clusters:
+            master = clusters[0].master
+            for slave in master.slave_pool:
+                pong = call_async(slave.send_ping())
+                self.assertEqual(pong.pending_shard_count, 0)
+                self.assertEqual(pong.shard_count, 2)
+
+    def test_unix_socket(self):
+        acc1 = Address.create_random_account(0)
+        with tempfile.TemporaryDirectory() as tmp:
+            with ClusterContext(1, acc1, unix_socket_dir=tmp) as clusters:
+                master = clusters[0].master
+                slaves = clusters[0].slave_list
+                conns = list(master.slave_pool)
+                for slave in slaves:
+                    conns.extend(slave.slave_connection_manager.slave_connections)
+                self.assertEqual(len(conns), 4)
+                for conn in conns:
+                    sock = conn.writer.get_extra_info("socket")
+                    self.assertEqual(sock.family, socket.AF_UNIX)
+
+                root = call_async(
+                    master.get_next_block_to_mine(address=acc1, branch_value=None)
+                )
+                call_async(master.add_root_block(root))
+                self.assertEqual(master.root_state.tip.height, 1)
+                for slave in slaves:
+                    for shard in slave.shards.values():
+                        self.assertEqual(shard.state.root_tip.height, 1)
+            self.assertEqual(os.listdir(os.path.join(tmp, "cluster0")), [])
+
     def test_create_shard_at_different_height(self):
         acc1 = Address.create_random_account(0)
         id1 = 0 << 16 | 1 | 0
@@ -232,6 +271,110 @@ class TestCluster(unittest.TestCase):
             assert_true_with_timeout(lambda: len(tx_queue) == 1)
             self.assertEqual(tx_queue.pop_transaction(), tx2.tx.to_evm_tx())
 
+    def test_compact_block_relay(self):
+        id1 = Identity.create_random_identity()
+        acc1 = Address.create_from_identity(id1, full_shard_key=0)
+
+        with ClusterContext(2, acc1, compact_block_relay=True) as clusters:
+            shard0 = clusters[0].get_shard(0b10)
+            shard1 = clusters[1].get_shard(0b10)
+            # the first block is sent in full, the peers announcing with its tip
+            b1 = _tip_gen(shard0.state)
+            call_async(shard0.handle_new_block(b1))
+            assert_true_with_timeout(lambda: shard1.state.header_tip == b1.header)
+            for shard in (shard0, shard1):
+                assert_true_with_timeout(
+                    lambda: shard.peers
+                    and all(p.compact_block_enabled for p in shard.peers.values())
+                )
+
+            # tx1 is gossiped to the other cluster
+            tx1 = create_transfer_transaction(
+                shard_state=shard0.state,
+                key=id1.get_key(),
+                from_address=acc1,
+                to_address=acc1,
+                value=12345,
+            )
+            self.assertTrue(call_async(clusters[0].master.add_transaction(tx1)))
+            assert_true_with_timeout(lambda: len(shard1.state.tx_queue) == 1)
+            b2 = shard0.state.create_block_to_mine(address=acc1)
+            self.assertEqual(b2.tx_list, [tx1])
+            call_async(shard0.handle_new_block(b2))
+            assert_true_with_timeout(lambda: shard1.state.header_tip == b2.header)
+            self.assertEqual(shard1.compact_block_stats, {"received": 1})
+
+            # tx2 is not, the other cluster downloads it
+            tx2 = create_transfer_transaction(
+                shard_state=shard0.state,
+                key=id1.get_key(),
+                from_address=acc1,
+                to_address=acc1,
+                value=12345,
+            )
+            self.assertTrue(shard0.add_tx(tx2))
+            self.assertEqual(len(shard1.state.tx_queue), 0)
+            b3 = shard0.state.create_block_to_mine(address=acc1)
+            self.assertEqual(b3.tx_list, [tx2])
+            call_async(shard0.handle_new_block(b3))
+            assert_true_with_timeout(lambda: shard1.state.header_tip == b3.header)
+            self.assertEqual(shard1.state.get_transaction_count(acc1.recipient), 2)
+            self.assertEqual(
+                shard1.compact_block_stats, {"received": 2, "txs_downloaded": 1}
+            )
+
+    def test_tx_announcement(self):
+        id1 = Identity.create_random_identity()
+        acc1 = Address.create_from_identity(id1, full_shard_key=0)
+
+        with ClusterContext(2, acc1, tx_announcement=True) as clusters:
+            shard0 = clusters[0].get_shard(0b10)
+            shard1 = clusters[1].get_shard(0b10)
+            # the peers announce with the tip of the first block
+            b1 = _tip_gen(shard0.state)
+            call_async(shard0.handle_new_block(b1))
+            for shard in (shard0, shard1):
+                assert_true_with_timeout(
+                    lambda: shard.peers
+                    and all(p.tx_announcement_enabled for p in shard.peers.values())
+                )
+
+            tx = create_transfer_transaction(
+                shard_state=shard0.state,
+                key=id1.get_key(),
+                from_address=acc1,
+                to_address=acc1,
+                value=12345,
+            )
+            # sent after the broadcast window
+            shard0.tx_broadcast_window = 0.05
+            self.assertTrue(call_async(clusters[0].master.add_transaction(tx)))
+            self.assertEqual([p.pending_tx_list for p in shard0.peers.values()], [[tx]])
+            assert_true_with_timeout(lambda: tx.get_hash() in shard1.state.tx_dict)
+
+            # the tx is announced by hash and pulled, and not sent back
+            peer = clusters[1].peer
+            stats = peer.get_bandwidth_stats()
+            self.assertIn("NEW_TRANSACTION_HASH_LIST", stats["received"])
+            self.assertIn("GET_TRANSACTION_LIST_RESPONSE", stats["received"])
+            self.assertIn("GET_TRANSACTION_LIST_REQUEST", stats["sent"])
+            self.assertNotIn("NEW_TRANSACTION_LIST", stats["received"])
+            self.assertNotIn("NEW_TRANSACTION_HASH_LIST", stats["sent"])
+
+            # the peer knows the tx already
+            announced = peer.bytes_received[CommandOp.NEW_TRANSACTION_HASH_LIST]
+            shard0.broadcast_tx_list([tx])
+            call_async(asyncio.sleep(0.1))
+            self.assertEqual(
+                peer.bytes_received[CommandOp.NEW_TRANSACTION_HASH_LIST], announced
+            )
+
+            master_stats = call_async(clusters[1].master.get_stats())
+            self.assertEqual(
+                list(master_stats["peerBandwidth"].values()),
+                [peer.get_bandwidth_stats()],
+            )
+
     def test_add_minor_block_request_list(self):
         id1 = Identity.create_random_identity()
         acc1 = Address.create_from_identity(id1, full_shard_key=0)
@@ -619,6 +762,68 @@ class TestCluster(unittest.TestCase):
                 else:
                     self.assertIsNone(xshard_tx_list)
 
+    def test_broadcast_cross_shard_transactions_in_compressed_batch(self):
+        """ Test the x-shard tx lists of several blocks are sent to other slaves
+        in one compressed batch """
+        acc1 = Address.create_random_account(full_shard_key=0)
+
+        with ClusterContext(1, acc1) as clusters:
+            master = clusters[0].master
+            slaves = clusters[0].slave_list
+
+            root_block = call_async(
+                master.get_next_block_to_mine(
+                    Address.create_empty_account(), branch_value=None
+                )
+            )
+            call_async(master.add_root_block(root_block))
+
+            for slave in slaves:
+                for conn in slave.slave_connection_manager.slave_connections:
+                    conn.xshard_batch_window = 0.1
+                    conn.xshard_compression_threshold = 1
+                    conn.peer_accept_compressed_xshard = True
+
+            # slave 0 runs chain 0 and is only connected to slave 1 running chain 1
+            conn = next(iter(slaves[0].slave_connection_manager.slave_connections))
+            ops = []
+            write_raw_rpc_request = conn.write_raw_rpc_request
+
+            def write_raw_rpc_request_and_record_op(op, cmd_data, metadata=None):
+                ops.append(op)
+                return write_raw_rpc_request(op, cmd_data, metadata)
+
+            conn.write_raw_rpc_request = write_raw_rpc_request_and_record_op
+
+            shard = clusters[0].get_shard(2 | 0)
+            b1 = shard.state.create_block_to_mine(address=acc1)
+            b2 = shard.state.create_block_to_mine(address=acc1)
+            b2.header.create_time += 1
+            self.assertEqual(
+                call_async(asyncio.gather(shard.add_block(b1), shard.add_block(b2))),
+                [True, True],
+            )
+            self.assertEqual(
+                ops, [ClusterOp.COMPRESSED_BATCH_ADD_XSHARD_TX_LIST_REQUEST]
+            )
+
+            for full_shard_id in slaves[1].shards:
+                for block in [b1, b2]:
+                    self.assertIsNotNone(
+                        clusters[0]
+                        .get_shard_state(full_shard_id.value)
+                        .db.get_minor_block_xshard_tx_list(block.header.get_hash())
+                    )
+
+            # the decompressed size is bounded
+            conn.command_size_limit = 1024
+            resp = call_async(
+                conn.handle_compressed_batch_add_xshard_tx_list_request(
+                    CompressedBatchAddXshardTxListRequest(zlib.compress(bytes(2048)))
+                )
+            )
+            self.assertEqual(resp.error_code, errno.E2BIG)
+
     def test_get_work_from_slave(self):
         genesis = Address.create_empty_account(full_shard_key=0)
 
@@ -40,3 +40,23 @@ class TestClusterConfig(unittest.TestCase):
         deserialized = ClusterConfig.create_from_args(args)
 
         self.assertTrue(cluster_config == deserialized)
+
+    def test_slave_per_chain(self):
+        parser = argparse.ArgumentParser()
+        ClusterConfig.attach_arguments(parser)
+        args = parser.parse_args(
+            ["--num_chains=3", "--slave_per_chain", "--genesis_dir="]
+        )
+        cluster_config = ClusterConfig.create_from_args(args)
+
+        self.assertEqual(len(cluster_config.SLAVE_LIST), 3)
+        full_shard_ids = cluster_config.QUARKCHAIN.get_full_shard_ids()
+        for chain_id, slave in enumerate(cluster_config.SLAVE_LIST):
+            self.assertEqual(
+                [
+                    i
+                    for i in full_shard_ids
+                    if slave.CHAIN_MASK_LIST[0].contain_full_shard_id(i)
+                ],
+                [i for i in full_shard_ids if i >> 16 == chain_id],
+            )
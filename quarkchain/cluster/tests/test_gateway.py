@@ -0,0 +1,136 @@
+import asyncio
+import unittest
+from contextlib import contextmanager
+
+import aiohttp
+from jsonrpcclient.aiohttp_client import aiohttpClient
+
+from quarkchain.cluster.gateway import GatewayServer
+from quarkchain.cluster.jsonrpc import balances_encoder
+from quarkchain.cluster.protocol import open_slave_connection
+from quarkchain.cluster.rpc import CLUSTER_OP_SERIALIZER_MAP, ClusterOp, Ping
+from quarkchain.cluster.tests.test_jsonrpc import jrpc_server_context
+from quarkchain.cluster.tests.test_utils import ClusterContext
+from quarkchain.core import Address, Identity
+from quarkchain.protocol import Connection
+from quarkchain.utils import assert_true_with_timeout, call_async
+
+GATEWAY_PORT = 38591
+
+
+@contextmanager
+def gateway_context(master):
+    gateway = GatewayServer(
+        master.env, "http://127.0.0.1:38391", GATEWAY_PORT, "127.0.0.1"
+    )
+    gateway.start()
+    try:
+        yield gateway
+    finally:
+        gateway.stop()
+
+
+def send_request(*args):
+    async def __send_request(*args):
+        async with aiohttp.ClientSession(loop=asyncio.get_event_loop()) as session:
+            client = aiohttpClient(session, "http://127.0.0.1:{}".format(GATEWAY_PORT))
+            response = await client.request(*args)
+            return response
+
+    return call_async(__send_request(*args))
+
+
+class TestGateway(unittest.TestCase):
+    def test_read_from_slaves(self):
+        id1 = Identity.create_random_identity()
+        acc1 = Address.create_from_identity(id1, full_shard_key=0)
+
+        with ClusterContext(
+            1, acc1, small_coinbase=True
+        ) as clusters, jrpc_server_context(
+            clusters[0].master
+        ) as server, gateway_context(
+            clusters[0].master
+        ) as gateway:
+            master = clusters[0].master
+            block = call_async(
+                master.get_next_block_to_mine(address=acc1, branch_value=0b10)
+            )
+            self.assertTrue(call_async(clusters[0].get_shard(2 | 0).add_block(block)))
+
+            response = send_request("getBalances", ["0x" + acc1.serialize().hex()])
+            self.assertEqual(response["fullShardId"], "0x2")
+            account_branch_data = call_async(master.get_primary_account_data(acc1))
+            self.assertEqual(
+                response["balances"],
+                balances_encoder(account_branch_data.token_balances),
+            )
+
+            # the latest block is looked up on the slave
+            response = send_request("getMinorBlockByHeight", ["0x0"])
+            self.assertEqual(response["hash"], "0x" + block.header.get_hash().hex())
+            self.assertEqual(response["height"], "0x1")
+
+            # served from the cache the second time
+            send_request("getMinorBlockByHeight", ["0x0"])
+            self.assertEqual(gateway.get_cache_stats()["hitCount"], 1)
+
+            # root chain queries go to master
+            response = send_request("getRootBlockByHeight", ["0x0"])
+            self.assertEqual(response["height"], "0x0")
+
+            self.assertNotIn("getBalances", server.counters)
+            self.assertNotIn("getMinorBlockByHeight", server.counters)
+            self.assertEqual(server.counters["getRootBlockByHeight"], 1)
+
+    def test_cache_size(self):
+        acc1 = Address.create_random_account(full_shard_key=0)
+
+        with ClusterContext(1, acc1) as clusters, jrpc_server_context(
+            clusters[0].master
+        ), gateway_context(clusters[0].master) as gateway:
+            gateway.cache_size = 2
+            for i in range(3):
+                send_request("echoQuantity", [hex(i)])
+            self.assertEqual(gateway.get_cache_stats()["size"], 2)
+            # the least recently used one is evicted
+            send_request("echoQuantity", ["0x0"])
+            self.assertEqual(gateway.get_cache_stats()["hitCount"], 0)
+            send_request("echoQuantity", ["0x2"])
+            self.assertEqual(gateway.get_cache_stats()["hitCount"], 1)
+
+    def test_connect_before_master(self):
+        acc1 = Address.create_random_account(full_shard_key=0)
+
+        with ClusterContext(1, acc1) as clusters:
+            slaves = clusters[0].slave_list
+            # as if master has not connected yet
+            masters = [slave.master for slave in slaves]
+            for slave in slaves:
+                slave.master = None
+            try:
+                with gateway_context(clusters[0].master):
+                    response = send_request(
+                        "getBalances", ["0x" + acc1.serialize().hex()]
+                    )
+                    self.assertEqual(response["fullShardId"], "0x2")
+                    # the connection from master is still to come
+                    for slave in slaves:
+                        self.assertIsNone(slave.master)
+            finally:
+                for slave, master in zip(slaves, masters):
+                    slave.master = master
+
+    def test_empty_shard_mask_list_without_read_only(self):
+        acc1 = Address.create_random_account(full_shard_key=0)
+
+        with ClusterContext(1, acc1) as clusters:
+            env = clusters[0].master.env
+            slave_info = env.cluster_config.get_slave_info_list()[0]
+            reader, writer = call_async(
+                open_slave_connection(env.cluster_config, slave_info)
+            )
+            conn = Connection(env, reader, writer, CLUSTER_OP_SERIALIZER_MAP, {}, {})
+            asyncio.ensure_future(conn.active_and_loop_forever())
+            conn.write_rpc_request(ClusterOp.PING, Ping("client", [], None))
+            assert_true_with_timeout(lambda: conn.is_closed())
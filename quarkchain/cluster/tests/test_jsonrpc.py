@@ -985,3 +985,58 @@ class TestJSONRPC(unittest.TestCase):
             call_async(master.add_root_block(block))
 
             send_request("createTransactions", {"numTxPerShard": 1, "xShardPercent": 0})
+
+    def test_response_cache(self):
+        id1 = Identity.create_random_identity()
+        acc1 = Address.create_from_identity(id1, full_shard_key=0)
+
+        with ClusterContext(
+            1, acc1, small_coinbase=True
+        ) as clusters, jrpc_server_context(clusters[0].master) as server:
+            master = clusters[0].master
+            server.cache_size = 4
+
+            # the same arguments with or without the defaults
+            resp = send_request("getMinorBlockByHeight", ["0x0"])
+            self.assertEqual(resp["height"], "0x0")
+            resp = send_request("getMinorBlockByHeight", ["0x0", None, False])
+            self.assertEqual(resp["height"], "0x0")
+            stats = send_request("getJrpcCacheStats")
+            self.assertEqual((stats["hitCount"], stats["missCount"]), (1, 1))
+
+            # a new block of the shard replaces the response
+            block1 = call_async(
+                master.get_next_block_to_mine(address=acc1, branch_value=0b10)
+            )
+            self.assertTrue(call_async(clusters[0].get_shard(2 | 0).add_block(block1)))
+            resp = send_request("getMinorBlockByHeight", ["0x0"])
+            self.assertEqual(resp["height"], "0x1")
+
+            # so does a new root tip
+            resp = send_request("getRootBlockByHeight")
+            self.assertEqual(resp["height"], "0x0")
+            root_block = call_async(
+                master.get_next_block_to_mine(address=acc1, branch_value=None)
+            )
+            call_async(master.add_root_block(root_block))
+            resp = send_request("getRootBlockByHeight")
+            self.assertEqual(resp["height"], "0x1")
+            resp = send_request("getRootBlockByHeight")
+            self.assertEqual(resp["height"], "0x1")
+
+            # the blocks not found are not cached
+            block_id = "0x" + block1.header.get_hash().hex() + "0" * 8
+            self.assertIsNone(send_request("getMinorBlockById", ["0x" + "ff" * 36]))
+            self.assertIsNone(send_request("getMinorBlockById", ["0x" + "ff" * 36]))
+            resp = send_request("getMinorBlockById", [block_id])
+            self.assertEqual(resp["height"], "0x1")
+            resp = send_request("getMinorBlockById", [block_id, False])
+            self.assertEqual(resp["height"], "0x1")
+
+            stats = send_request("getJrpcCacheStats")
+            self.assertEqual(stats["size"], 4)
+            self.assertEqual((stats["hitCount"], stats["missCount"]), (3, 7))
+            self.assertEqual(
+                stats["methods"]["getMinorBlockById"], {"hitCount": 1, "missCount": 3}
+            )
+            self.assertEqual(stats["hitRate"], 0.3)
@@ -4,7 +4,15 @@ import unittest
 from typing import Optional
 
 from quarkchain.cluster.guardian import Guardian
-from quarkchain.cluster.miner import DoubleSHA256, Miner, MiningWork, validate_seal
+from qkchash.qkchash import EPOCH_LENGTH
+from qkchash.qkcpow import QkchashMiner
+from quarkchain.cluster.miner import (
+    DoubleSHA256,
+    Miner,
+    MiningWork,
+    validate_seal,
+    validate_seal_batch,
+)
 from quarkchain.config import ConsensusType
 from quarkchain.core import RootBlock, RootBlockHeader
 from quarkchain.p2p import ecies
@@ -57,6 +65,45 @@ class TestMiner(unittest.TestCase):
             loop.run_until_complete(miner._mine_new_block_async())
             self.assertEqual(len(self.added_blocks), 5)
 
+    def test_mine_new_block_with_workers(self):
+        async def create(retry=True):
+            if len(self.added_blocks) >= 5:
+                return None  # stop the game
+            return RootBlock(
+                RootBlockHeader(create_time=int(time.time()), difficulty=1000),
+                tracking_data="{}".encode("utf-8"),
+            )
+
+        async def add(block):
+            validate_seal(block.header, ConsensusType.POW_DOUBLESHA256)
+            self.added_blocks.append(block)
+
+        miner = self.miner_gen(ConsensusType.POW_DOUBLESHA256, create, add, workers=2)
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(miner._mine_new_block_async())
+        # solutions found by both processes for the same work are added once
+        self.assertEqual(len(self.added_blocks), 5)
+        self.assertEqual(len(miner.processes), 2)
+        self.assertEqual(len(miner.get_hash_rates()), 2)
+
+    def test_mine_loop_nonce_partition(self):
+        miner = self.miner_gen(ConsensusType.POW_DOUBLESHA256, None, None, workers=2)
+        work = MiningWork(sha3_256(b""), 42, 5)
+        miner.input_qs[1].put((None, {}))
+        miner.mine_loop(
+            work,
+            {"consensus_type": ConsensusType.POW_DOUBLESHA256},
+            miner.input_qs[1],
+            miner.output_q,
+            worker=1,
+            workers=2,
+            hash_rates=miner.hash_rates,
+        )
+        mined_res = miner.output_q.get()
+        self.assertGreaterEqual(mined_res.nonce, 2 ** 63)
+        self.assertEqual(miner.hash_rates[0], 0)
+        self.assertGreater(miner.hash_rates[1], 0)
+
     def test_simulate_mine_handle_block_exception(self):
         i = 0
 
@@ -93,11 +140,11 @@ class TestMiner(unittest.TestCase):
         )
         work = MiningWork(block.header.get_hash_for_mining(), 42, 5)
         # only process one block, which is passed in. `None` means termination right after
-        miner.input_q.put((None, {}))
+        miner.input_qs[0].put((None, {}))
         miner.mine_loop(
             work,
             {"consensus_type": ConsensusType.POW_DOUBLESHA256},
-            miner.input_q,
+            miner.input_qs[0],
             miner.output_q,
         )
         mined_res = miner.output_q.get()
@@ -112,11 +159,11 @@ class TestMiner(unittest.TestCase):
         )
         work = MiningWork(block.header.get_hash_for_mining(), 42, 5)
         # only process one block, which is passed in. `None` means termination right after
-        miner.input_q.put((None, {}))
+        miner.input_qs[0].put((None, {}))
         miner.mine_loop(
             work,
             {"consensus_type": ConsensusType.POW_QKCHASH},
-            miner.input_q,
+            miner.input_qs[0],
             miner.output_q,
         )
         mined_res = miner.output_q.get()
@@ -305,3 +352,33 @@ class TestMiner(unittest.TestCase):
 
         # significantly lowering the diff should pass
         validate_seal(block.header, ConsensusType.POW_DOUBLESHA256, adjusted_diff=1)
+
+    def test_validate_seal_batch(self):
+        headers = []
+        for i in range(8):
+            # headers of two epochs
+            header = RootBlockHeader(
+                create_time=42, difficulty=5, height=i * EPOCH_LENGTH // 4
+            )
+            nonce, mixhash = QkchashMiner(
+                header.height, header.difficulty, header.get_hash_for_mining()
+            ).mine()
+            header.nonce = int.from_bytes(nonce, byteorder="big")
+            header.mixhash = mixhash
+            headers.append(header)
+        headers[5].mixhash = bytes(32)
+        expected = [True] * 8
+        expected[5] = False
+        self.assertEqual(
+            validate_seal_batch(headers, ConsensusType.POW_QKCHASH), expected
+        )
+        self.assertEqual(
+            validate_seal_batch(
+                headers, ConsensusType.POW_QKCHASH, adjusted_diffs=[2 ** 250] * 8
+            ),
+            [False] * 8,
+        )
+        # small batches are verified in place
+        self.assertEqual(
+            validate_seal_batch(headers[4:6], ConsensusType.POW_QKCHASH), [True, False]
+        )
@@ -1,7 +1,13 @@
+import asyncio
 import json
 import unittest
 import argparse
+
+from aiohttp import web
+
 from quarkchain.cluster.cluster_config import ClusterConfig
+from quarkchain.cluster.monitoring import KafkaExporter
+from quarkchain.utils import call_async
 
 
 class MonitoringTest(unittest.TestCase):
@@ -28,3 +34,68 @@ class MonitoringTest(unittest.TestCase):
         cluster_config = ClusterConfig.create_from_args(args)
         sample = dict(a=1, b=2, c=["x", "y"])
         cluster_config.kafka_logger.log_kafka_sample("dlltest", sample)
+
+
+class KafkaExporterTest(unittest.TestCase):
+    """ Posts to a local stand-in of the Kafka REST proxy """
+
+    def setUp(self):
+        self.posts = []
+        self.status = 200
+
+        async def handle(request):
+            self.posts.append((request.match_info["topic"], await request.json()))
+            return web.Response(status=self.status)
+
+        app = web.Application()
+        app.router.add_post("/topics/{topic}", handle)
+        self.runner = web.AppRunner(app)
+        call_async(self.runner.setup())
+        call_async(web.TCPSite(self.runner, "127.0.0.1", 38592).start())
+
+    def tearDown(self):
+        call_async(self.runner.cleanup())
+
+    def test_batch(self):
+        exporter = KafkaExporter("127.0.0.1:38592", batch_size=3, flush_interval=0.5)
+        for i in range(2):
+            exporter.add("a", dict(i=i))
+        call_async(asyncio.sleep(0.05))
+        self.assertEqual(self.posts, [])
+        # a full batch is posted right away
+        exporter.add("a", dict(i=2))
+        call_async(asyncio.sleep(0.05))
+        self.assertEqual(
+            self.posts, [("a", {"records": [{"value": dict(i=i)} for i in range(3)]})]
+        )
+        # the others after the interval, one post per topic
+        exporter.add("a", dict(i=3))
+        exporter.add("b", dict(i=4))
+        exporter.add("b", {"x"})
+        call_async(asyncio.sleep(0.7))
+        self.assertEqual(
+            self.posts[1:],
+            [
+                ("a", {"records": [{"value": dict(i=3)}]}),
+                ("b", {"records": [{"value": dict(i=4)}]}),
+            ],
+        )
+        self.assertEqual(
+            exporter.get_stats(), dict(added=5, invalid=1, posts=3, sent=5, buffered=0)
+        )
+        call_async(exporter.close())
+
+    def test_drop_and_failure(self):
+        exporter = KafkaExporter("127.0.0.1:38592", buffer_size=2, batch_size=10)
+        self.status = 500
+        for i in range(3):
+            exporter.add("a", dict(i=i))
+        call_async(exporter.close())
+        # the oldest sample is dropped
+        self.assertEqual(
+            self.posts, [("a", {"records": [{"value": dict(i=i)} for i in (1, 2)]})]
+        )
+        self.assertEqual(
+            exporter.get_stats(),
+            dict(added=3, dropped=1, failed_posts=1, failed=2, buffered=0),
+        )
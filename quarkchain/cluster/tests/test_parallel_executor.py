@@ -0,0 +1,134 @@
+import unittest
+
+import rlp
+
+from quarkchain.cluster.parallel_executor import ParallelTxExecutor
+from quarkchain.cluster.tests.test_shard_state import create_default_shard_state
+from quarkchain.cluster.tests.test_utils import (
+    create_contract_with_storage_transaction,
+    create_transfer_transaction,
+    get_test_env,
+)
+from quarkchain.core import Address, Identity
+from quarkchain.evm import opcodes
+from quarkchain.evm.messages import apply_transaction
+
+
+class TestParallelTxExecutor(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.id1 = Identity.create_random_identity()
+        self.acc1 = Address.create_from_identity(self.id1, full_shard_key=0)
+        self.env = get_test_env(
+            genesis_account=self.acc1, genesis_minor_quarkash=10 ** 20
+        )
+        self.state = create_default_shard_state(env=self.env)
+        # Add a root block to have all the shards initialized
+        root_block = self.state.root_tip.create_block_to_append().finalize()
+        self.state.add_root_block(root_block)
+
+    def create_senders(self, count):
+        senders = [Identity.create_random_identity() for _ in range(count)]
+        block = self.state.get_tip().create_block_to_append()
+        for i, identity in enumerate(senders):
+            block.add_tx(
+                create_transfer_transaction(
+                    shard_state=self.state,
+                    key=self.id1.get_key(),
+                    from_address=self.acc1,
+                    to_address=Address.create_from_identity(identity, 0),
+                    value=10 ** 18,
+                    nonce=i,
+                )
+            )
+        self.state.finalize_and_add_block(block)
+        return senders
+
+    def run_txs(self, block, speculation=None):
+        evm_state = self.state._get_evm_state_for_new_block(block)
+        if speculation is None:
+            speculation = ParallelTxExecutor(2).speculate(
+                evm_state, [(self.to_evm_tx(tx), tx.get_hash()) for tx in block.tx_list]
+            )
+        for idx, tx in enumerate(block.tx_list):
+            if speculation:
+                speculation.apply_transaction(idx, self.to_evm_tx(tx), tx.get_hash())
+            else:
+                apply_transaction(evm_state, self.to_evm_tx(tx), tx.get_hash())
+        evm_state.commit()
+        return evm_state, speculation
+
+    def to_evm_tx(self, tx):
+        evm_tx = tx.tx.to_evm_tx()
+        evm_tx.set_quark_chain_config(self.env.quark_chain_config)
+        return evm_tx
+
+    def test_same_result_as_serial_execution(self):
+        senders = self.create_senders(10)
+        accs = [Address.create_from_identity(i, full_shard_key=0) for i in senders]
+
+        def transfer(i, to_address, nonce=0, **kwargs):
+            return create_transfer_transaction(
+                shard_state=self.state,
+                key=senders[i].get_key(),
+                from_address=accs[i],
+                to_address=to_address,
+                value=12345,
+                nonce=nonce,
+                **kwargs
+            )
+
+        block = self.state.get_tip().create_block_to_append()
+        block.add_tx(transfer(0, Address.create_random_account(0)))
+        block.add_tx(transfer(1, accs[2]))
+        # reads the balance of 2 written by the tx before
+        block.add_tx(transfer(2, Address.create_random_account(0)))
+        for i in range(3, 8):
+            block.add_tx(transfer(i, Address.create_random_account(0)))
+        # nonce 1 is invalid against the state before the block
+        block.add_tx(transfer(0, Address.create_random_account(0), nonce=1))
+        block.add_tx(
+            transfer(
+                8,
+                Address.create_random_account(1),
+                gas=opcodes.GTXXSHARDCOST + opcodes.GTXCOST,
+            )
+        )
+        block.add_tx(
+            create_contract_with_storage_transaction(
+                shard_state=self.state,
+                key=senders[9].get_key(),
+                from_address=accs[9],
+                to_full_shard_key=0,
+            )
+        )
+
+        expected, _ = self.run_txs(block, speculation=False)
+        evm_state, speculation = self.run_txs(block)
+        self.assertEqual(speculation.replayed, 9)
+        self.assertEqual(speculation.executed, 2)
+        self.assertEqual(evm_state.trie.root_hash, expected.trie.root_hash)
+        self.assertEqual(rlp.encode(evm_state.receipts), rlp.encode(expected.receipts))
+        self.assertEqual(evm_state.gas_used, expected.gas_used)
+        self.assertEqual(evm_state.block_fee_tokens, expected.block_fee_tokens)
+        self.assertEqual(evm_state.xshard_list, expected.xshard_list)
+        self.assertEqual(len(evm_state.xshard_list), 1)
+
+    def test_add_block(self):
+        self.state.tx_executor = ParallelTxExecutor(2)
+        senders = self.create_senders(8)
+        for identity in senders:
+            self.state.add_tx(
+                create_transfer_transaction(
+                    shard_state=self.state,
+                    key=identity.get_key(),
+                    from_address=Address.create_from_identity(identity, 0),
+                    to_address=self.acc1,
+                    value=1,
+                )
+            )
+        # mined with serial execution, validated with parallel execution
+        block = self.state.create_block_to_mine()
+        self.assertEqual(len(block.tx_list), 8)
+        self.state.add_block(block)
+        self.assertEqual(self.state.header_tip, block.header)
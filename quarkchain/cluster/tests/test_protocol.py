@@ -1,11 +1,12 @@
 import asyncio
 import unittest
-from unittest.mock import call, MagicMock
+from unittest.mock import MagicMock
 
 from quarkchain.cluster.protocol import ClusterConnection, P2PConnection
 from quarkchain.cluster.protocol import ClusterMetadata, P2PMetadata
 from quarkchain.env import DEFAULT_ENV
 from quarkchain.core import uint32, Branch, Serializable
+from quarkchain.protocol import AbstractConnection, ConnectionState, RpcPriority
 
 FORWARD_BRANCH = Branch(123)
 EMPTY_BRANCH = Branch(456)
@@ -62,6 +63,34 @@ class DummyClusterConnection(ClusterConnection):
         return None
 
 
+USER_OP = 67
+CONSENSUS_OP = 68
+RESPONSE_OP = 69
+
+
+class FlowControlClusterConnection(ClusterConnection):
+    def __init__(self, env, reader, writer):
+        super().__init__(
+            env,
+            reader,
+            writer,
+            {
+                USER_OP: DummyPackage,
+                CONSENSUS_OP: DummyPackage,
+                RESPONSE_OP: DummyPackage,
+            },
+            {},
+            {},
+        )
+        self.set_rpc_flow_control(
+            {USER_OP: RpcPriority.USER, CONSENSUS_OP: RpcPriority.CONSENSUS}, [0, 0, 2]
+        )
+        self.state = ConnectionState.ACTIVE
+
+    def get_connection_to_forward(self, metadata):
+        return None
+
+
 class TestP2PConnection(unittest.TestCase):
     def test_forward(self):
         meta = P2PMetadata(FORWARD_BRANCH)
@@ -76,7 +105,7 @@ class TestP2PConnection(unittest.TestCase):
 
         reader = AsyncMock()
         writer = MagicMock()
-        reader.read.side_effect = [requestSizeBytes, metaBytes, rawData]
+        reader.readexactly.side_effect = [requestSizeBytes + metaBytes, rawData]
 
         conn = DummyP2PConnection(DEFAULT_ENV, reader, writer)
         asyncio.get_event_loop().run_until_complete(conn.loop_once())
@@ -98,15 +127,13 @@ class TestP2PConnection(unittest.TestCase):
 
         reader = AsyncMock()
         writer = MagicMock()
-        reader.read.side_effect = [requestSizeBytes, metaBytes, rawData]
+        reader.readexactly.side_effect = [requestSizeBytes + metaBytes, rawData]
 
         conn = DummyP2PConnection(DEFAULT_ENV, reader, writer)
         asyncio.get_event_loop().run_until_complete(conn.loop_once())
 
         conn.mockClusterConnection.write_raw_data.assert_not_called()
-        writer.write.assert_has_calls(
-            [call(requestSizeBytes), call(metaBytes), call(rawData)]
-        )
+        writer.write.assert_called_once_with(requestSizeBytes + metaBytes + rawData)
 
 
 class TestClusterConnection(unittest.TestCase):
@@ -123,7 +150,7 @@ class TestClusterConnection(unittest.TestCase):
 
         reader = AsyncMock()
         writer = MagicMock()
-        reader.read.side_effect = [requestSizeBytes, metaBytes, rawData]
+        reader.readexactly.side_effect = [requestSizeBytes + metaBytes, rawData]
 
         conn = DummyClusterConnection(DEFAULT_ENV, reader, writer)
         asyncio.get_event_loop().run_until_complete(conn.loop_once())
@@ -145,12 +172,107 @@ class TestClusterConnection(unittest.TestCase):
 
         reader = AsyncMock()
         writer = MagicMock()
-        reader.read.side_effect = [requestSizeBytes, metaBytes, rawData]
+        reader.readexactly.side_effect = [requestSizeBytes + metaBytes, rawData]
 
         conn = DummyClusterConnection(DEFAULT_ENV, reader, writer)
         asyncio.get_event_loop().run_until_complete(conn.loop_once())
 
         conn.mockP2PConnection.write_raw_data.assert_not_called()
-        writer.write.assert_has_calls(
-            [call(requestSizeBytes), call(metaBytes), call(rawData)]
+        writer.write.assert_called_once_with(requestSizeBytes + metaBytes + rawData)
+
+
+class TestConnectionFraming(unittest.TestCase):
+    def test_read_frames(self):
+        meta = ClusterMetadata(FORWARD_BRANCH, CLUSTER_PEER_ID)
+        request = DummyPackage(999)
+        requestsBytes = request.serialize()
+        rawData = bytes([OP]) + RPC_ID.to_bytes(8, byteorder="big") + requestsBytes
+        frame = (
+            len(requestsBytes).to_bytes(4, byteorder="big") + meta.serialize() + rawData
+        )
+
+        loop = asyncio.get_event_loop()
+        reader = asyncio.StreamReader(loop=loop)
+        conn = DummyClusterConnection(DEFAULT_ENV, reader, MagicMock())
+
+        # frames split at arbitrary boundaries
+        data = frame + frame + frame[:5]
+        for i in range(0, len(data), 3):
+            reader.feed_data(data[i : i + 3])
+        for _ in range(2):
+            metadata, raw_data = loop.run_until_complete(
+                conn.read_metadata_and_raw_data()
+            )
+            self.assertEqual(metadata, meta)
+            self.assertEqual(raw_data, rawData)
+
+        # truncated frame
+        reader.feed_eof()
+        with self.assertRaises(RuntimeError):
+            loop.run_until_complete(conn.read_metadata_and_raw_data())
+
+    def test_read_eof(self):
+        loop = asyncio.get_event_loop()
+        reader = asyncio.StreamReader(loop=loop)
+        conn = DummyClusterConnection(DEFAULT_ENV, reader, MagicMock())
+        reader.feed_eof()
+        self.assertEqual(
+            loop.run_until_complete(conn.read_metadata_and_raw_data()), (None, None)
         )
+
+
+class TestRpcFlowControl(unittest.TestCase):
+    def respond(self, conn, rpc_id):
+        raw_data = (
+            bytes([RESPONSE_OP])
+            + rpc_id.to_bytes(8, byteorder="big")
+            + DummyPackage(rpc_id).serialize()
+        )
+        asyncio.get_event_loop().run_until_complete(
+            conn.handle_metadata_and_raw_data(ClusterMetadata(), raw_data)
+        )
+
+    def test_user_lane_window(self):
+        writer = MagicMock()
+        conn = FlowControlClusterConnection(DEFAULT_ENV, MagicMock(), writer)
+
+        user_futures = [
+            conn.write_rpc_request(USER_OP, DummyPackage(i)) for i in range(4)
+        ]
+        self.assertEqual(writer.write.call_count, 2)
+
+        # consensus requests bypass the full user lane
+        consensus_future = conn.write_rpc_request(CONSENSUS_OP, DummyPackage(0))
+        self.assertEqual(writer.write.call_count, 3)
+        self.respond(conn, 3)
+        self.assertEqual(consensus_future.result()[2], 3)
+
+        # an abandoned request is never sent
+        user_futures[2].cancel()
+        self.respond(conn, 1)
+        self.assertEqual(writer.write.call_count, 4)
+        self.assertEqual(user_futures[0].result()[1], DummyPackage(1))
+        self.respond(conn, 2)
+        self.respond(conn, 4)
+        self.assertEqual(user_futures[1].result()[2], 2)
+        self.assertEqual(user_futures[3].result()[2], 4)
+
+        stats = conn.get_rpc_lane_stats()
+        self.assertEqual(stats["user"]["queueLength"], 0)
+        self.assertEqual(stats["user"]["inFlight"], 0)
+        self.assertEqual(stats["user"]["queuedCount"], 2)
+        self.assertEqual(stats["user"]["maxQueueLength"], 2)
+        self.assertEqual(stats["user"]["cancelledCount"], 1)
+        self.assertEqual(stats["consensus"]["queuedCount"], 0)
+
+    def test_abort_queued_requests(self):
+        aborted_rpc_count = AbstractConnection.aborted_rpc_count
+        conn = FlowControlClusterConnection(DEFAULT_ENV, MagicMock(), MagicMock())
+        futures = [conn.write_rpc_request(USER_OP, DummyPackage(i)) for i in range(3)]
+        conn.close()
+        asyncio.get_event_loop().run_until_complete(conn.active_and_loop_forever())
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result()
+        # cluster tests expect no aborted rpc
+        AbstractConnection.aborted_rpc_count = aborted_rpc_count
@@ -12,9 +12,12 @@ from quarkchain.cluster.tests.test_utils import (
 from quarkchain.config import ConsensusType
 from quarkchain.core import CrossShardTransactionDeposit, CrossShardTransactionList
 from quarkchain.core import Identity, Address, TokenBalanceMap
+from quarkchain.db import InMemoryDb
 from quarkchain.diff import EthDifficultyCalculator
 from quarkchain.evm import opcodes
+from quarkchain.evm.state import State as EvmState
 from quarkchain.genesis import GenesisManager
+from quarkchain.utils import token_id_encode
 
 
 def create_default_shard_state(
@@ -89,6 +92,46 @@ class TestShardState(unittest.TestCase):
         self.assertEqual(state.header_tip, new_genesis_block.header)
         self.assertEqual(new_genesis_block, state.db.get_minor_block_by_height(0))
 
+    def test_genesis_alloc(self):
+        env = get_test_env()
+        full_shard_id = 2
+        alloc = env.quark_chain_config.shards[full_shard_id].GENESIS.ALLOC
+        recipients = [Address.create_random_account().recipient for _ in range(50)]
+        for i, recipient in enumerate(recipients):
+            alloc[(recipient + (2 * i).to_bytes(4, "big")).hex()] = {
+                "QKC": i * 10 ** 18,
+                "QETC": i % 3,
+            }
+        # the same account allocated twice, keeping the first full shard key
+        alloc[(recipients[1] + bytes(4)).hex()] = {"QKC": 5}
+
+        evm_state = EvmState(env=env.evm_env, db=InMemoryDb())
+        for address_hex, alloc_amount in alloc.items():
+            address = Address.create_from(bytes.fromhex(address_hex))
+            evm_state.full_shard_key = address.full_shard_key
+            for k, v in alloc_amount.items():
+                evm_state.delta_token_balance(address.recipient, token_id_encode(k), v)
+        evm_state.commit()
+
+        genesis_manager = GenesisManager(env.quark_chain_config)
+        root_block = genesis_manager.create_root_block()
+        db = InMemoryDb()
+        block, _ = genesis_manager.create_minor_block(
+            root_block, full_shard_id, EvmState(env=env.evm_env, db=db)
+        )
+        self.assertEqual(block.meta.hash_evm_state_root, evm_state.trie.root_hash)
+        state = EvmState(env=env.evm_env, db=db)
+        state.trie.root_hash = block.meta.hash_evm_state_root
+        self.assertEqual(state.get_full_shard_key(recipients[1]), 2)
+        self.assertEqual(state.get_balance(recipients[1]), 10 ** 18 + 5)
+
+        # the state root built is read from the db for the same ALLOC
+        db.put_many = lambda items: self.fail("state rebuilt")
+        cached_block, _ = genesis_manager.create_minor_block(
+            root_block, full_shard_id, EvmState(env=env.evm_env, db=db)
+        )
+        self.assertEqual(cached_block, block)
+
     def test_blocks_with_incorrect_version(self):
         env = get_test_env()
         state = create_default_shard_state(env=env)
@@ -2348,6 +2391,29 @@ class TestShardState(unittest.TestCase):
                 state.validate_minor_block_seal(m)
             state.finalize_and_add_block(m)
 
+    def test_posw_stakes_cached_by_block(self):
+        acc = Address(b"\x01" * 20, full_shard_key=0)
+        env = get_test_env(genesis_account=acc, genesis_minor_quarkash=256)
+        state = create_default_shard_state(env=env, shard_id=0, posw_override=True)
+        state.shard_config.COINBASE_AMOUNT = 8
+
+        genesis_hash = state.header_tip.get_hash()
+        m = state.get_tip().create_block_to_append(address=acc)
+        state.finalize_and_add_block(m)
+        self.assertEqual(state._get_posw_stakes(genesis_hash, acc.recipient), 256)
+        # stakes include the coinbase of the block
+        stakes = state._get_posw_stakes(m.header.get_hash(), acc.recipient)
+        self.assertEqual(
+            stakes, state.get_token_balance(acc.recipient, self.genesis_token)
+        )
+        self.assertGreater(stakes, 256)
+        self.assertEqual(len(state.posw_stake_cache), 2)
+        self.assertEqual(state.posw_stake_cache[genesis_hash][1], {acc.recipient: 256})
+
+        m = state.get_tip().create_block_to_append(address=acc)
+        state.posw_diff_adjust(m)
+        self.assertEqual(len(state.posw_stake_cache), 2)
+
     def test_posw_window_edge_cases(self):
         acc = Address(b"\x01" * 20, full_shard_key=0)
         env = get_test_env(genesis_account=acc, genesis_minor_quarkash=500)
@@ -1,4 +1,5 @@
 import asyncio
+import os
 from contextlib import ContextDecorator
 
 from quarkchain.cluster.cluster_config import (
@@ -278,6 +279,9 @@ def create_test_clusters(
     small_coinbase=False,
     loadtest_accounts=None,
     connect=True,               # connect the bootstrap node by default
+    unix_socket_dir=None,
+    compact_block_relay=False,
+    tx_announcement=False,
 ):
     # so we can have lower minimum diff
     easy_diff_calc = EthDifficultyCalculator(
@@ -302,6 +306,12 @@ def create_test_clusters(
         env.cluster_config.PRIVATE_JSON_RPC_PORT = get_next_port()
         env.cluster_config.SIMPLE_NETWORK = SimpleNetworkConfig()
         env.cluster_config.SIMPLE_NETWORK.BOOTSTRAP_PORT = bootstrap_port
+        if unix_socket_dir:
+            env.cluster_config.UNIX_SOCKET_DIR = os.path.join(
+                unix_socket_dir, "cluster{}".format(i)
+            )
+        env.cluster_config.COMPACT_BLOCK_RELAY = compact_block_relay
+        env.cluster_config.TX_ANNOUNCEMENT = tx_announcement
         env.quark_chain_config.loadtest_accounts = loadtest_accounts or []
 
         if small_coinbase:
@@ -395,6 +405,9 @@ class ClusterContext(ContextDecorator):
         small_coinbase=False,
         loadtest_accounts=None,
         connect=True,
+        unix_socket_dir=None,
+        compact_block_relay=False,
+        tx_announcement=False,
     ):
         self.num_cluster = num_cluster
         self.genesis_account = genesis_account
@@ -406,6 +419,9 @@ class ClusterContext(ContextDecorator):
         self.small_coinbase = small_coinbase
         self.loadtest_accounts = loadtest_accounts
         self.connect = connect
+        self.unix_socket_dir = unix_socket_dir
+        self.compact_block_relay = compact_block_relay
+        self.tx_announcement = tx_announcement
 
         check(is_p2(self.num_slaves))
         check(is_p2(self.shard_size))
@@ -422,6 +438,9 @@ class ClusterContext(ContextDecorator):
             small_coinbase=self.small_coinbase,
             loadtest_accounts=self.loadtest_accounts,
             connect=self.connect,
+            unix_socket_dir=self.unix_socket_dir,
+            compact_block_relay=self.compact_block_relay,
+            tx_announcement=self.tx_announcement,
         )
         return self.cluster_list
 
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import unittest
+
+from quarkchain.cluster.cluster_config import ClusterConfig
+from quarkchain.cluster.miner import DoubleSHA256, MiningWork
+from quarkchain.cluster.tests.test_utils import ClusterContext
+from quarkchain.cluster.work_notifier import WorkNotifier
+from quarkchain.core import Address, Identity
+from quarkchain.env import DEFAULT_ENV
+from quarkchain.utils import call_async, sha3_256
+
+
+class TestWorkNotifier(unittest.TestCase):
+    def test_push_work(self):
+        id1 = Identity.create_random_identity()
+        acc1 = Address.create_from_identity(id1, full_shard_key=0)
+
+        with ClusterContext(
+            1, acc1, remote_mining=True, shard_size=1, small_coinbase=True
+        ) as clusters:
+            master = clusters[0].master
+            env = DEFAULT_ENV.copy()
+            env.cluster_config = ClusterConfig()
+            env.cluster_config.MINING_PUSH_PORT = 38591
+            env.cluster_config.PRIVATE_JSON_RPC_HOST = "127.0.0.1"
+            notifier = WorkNotifier.start_server(env, master)
+            self.assertIs(master.work_notifier, notifier)
+            reader, writer = call_async(asyncio.open_connection("127.0.0.1", 38591))
+
+            def read_work():
+                works = {}
+                for _ in range(2):
+                    msg = json.loads(
+                        call_async(asyncio.wait_for(reader.readline(), 10))
+                    )
+                    works[msg["fullShardKey"]] = msg
+                return works
+
+            try:
+                writer.write(b"not json\n")
+                writer.write(b'{"subscribe": ["0x0", null]}\n')
+                self.assertIn("error", json.loads(call_async(reader.readline())))
+
+                # the current work is sent right away
+                works = read_work()
+                self.assertEqual(
+                    [works[k]["height"] for k in ("0x0", None)], ["0x1", "0x1"]
+                )
+
+                # a new root tip changes the work of the root chain and the shard
+                work = MiningWork(bytes.fromhex(works[None]["headerHash"][2:]), 1, 10)
+                nonce = DoubleSHA256(work).mine(0, 10000).nonce
+                self.assertTrue(
+                    call_async(
+                        master.submit_work(None, work.hash, nonce, sha3_256(b""))
+                    )
+                )
+                new_works = read_work()
+                self.assertEqual(new_works[None]["height"], "0x2")
+                self.assertEqual(new_works["0x0"]["height"], "0x1")
+                self.assertNotEqual(
+                    new_works["0x0"]["headerHash"], works["0x0"]["headerHash"]
+                )
+            finally:
+                writer.close()
+                notifier.shutdown()
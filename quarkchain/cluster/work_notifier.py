@@ -0,0 +1,144 @@
+""" Pushes mining work to remote miners when the tips change
+
+Remote miners otherwise poll getWork and mine on a stale tip until their next
+poll.  A miner connects over TCP and sends JSON lines subscribing to chains by
+full shard key, as passed to getWork, null being the root chain:
+
+    {"subscribe": ["0x1", null]}
+
+The current work of each chain subscribed is sent right away, then again each
+time it changes after a new tip:
+
+    {"fullShardKey": "0x1", "headerHash": "0x..", "height": "0x..", "difficulty": "0x.."}
+
+Solutions are submitted with submitWork as usual.
+"""
+import asyncio
+import json
+from typing import Dict, Optional
+
+from quarkchain.cluster.jsonrpc import data_encoder, quantity_encoder
+from quarkchain.cluster.miner import MiningWork
+from quarkchain.core import Branch
+from quarkchain.utils import Logger
+
+# drop the miners not reading their notifications
+MAX_WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+class WorkNotifier:
+    @classmethod
+    def start_server(cls, env, master_server):
+        notifier = cls(
+            env,
+            master_server,
+            env.cluster_config.MINING_PUSH_PORT,
+            env.cluster_config.PRIVATE_JSON_RPC_HOST,
+        )
+        notifier.start()
+        master_server.work_notifier = notifier
+        return notifier
+
+    def __init__(self, env, master_server, port, host):
+        self.loop = asyncio.get_event_loop()
+        self.env = env
+        self.master = master_server
+        self.port = port
+        self.host = host
+        self.server = None
+        # full shard id (None for root) -> {subscribed writer: full shard key sent}
+        self.subscribers = dict()  # type: Dict[Optional[int], Dict]
+        # full shard id -> last work sent
+        self.work_map = dict()  # type: Dict[Optional[int], MiningWork]
+        # full shard id -> number of the latest update, to skip the older ones
+        self.update_count = dict()  # type: Dict[Optional[int], int]
+
+    def start(self):
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self.__handle_miner, self.host, self.port)
+        )
+
+    def shutdown(self):
+        self.server.close()
+        for writers in self.subscribers.values():
+            for writer in writers:
+                writer.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+
+    def notify(self, branch: Optional[Branch]):
+        """ Sends the new work of the chain to the miners subscribed if it changed """
+        full_shard_id = None if branch is None else branch.value
+        if self.subscribers.get(full_shard_id):
+            asyncio.ensure_future(self.__update(full_shard_id))
+
+    def notify_all(self):
+        for full_shard_id in list(self.subscribers):
+            self.notify(None if full_shard_id is None else Branch(full_shard_id))
+
+    async def __update(self, full_shard_id: Optional[int]):
+        count = self.update_count[full_shard_id] = (
+            self.update_count.get(full_shard_id, 0) + 1
+        )
+        try:
+            work = await self.master.get_work(
+                None if full_shard_id is None else Branch(full_shard_id)
+            )
+        except Exception as e:
+            Logger.warning("Failed to get work to push: {}".format(e))
+            return
+        # a later update is sending newer work
+        if work is None or count != self.update_count[full_shard_id]:
+            return
+        last_work = self.work_map.get(full_shard_id)
+        if last_work is not None and last_work.hash == work.hash:
+            return
+        self.work_map[full_shard_id] = work
+        for writer, key in list(self.subscribers.get(full_shard_id, {}).items()):
+            self.__send(writer, key, work)
+
+    def __send(self, writer, key, work: MiningWork):
+        if writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER_SIZE:
+            writer.close()
+            return
+        msg = {
+            "fullShardKey": key,
+            "headerHash": data_encoder(work.hash),
+            "height": quantity_encoder(work.height),
+            "difficulty": quantity_encoder(work.difficulty),
+        }
+        writer.write(json.dumps(msg).encode() + b"\n")
+
+    def __get_full_shard_id(self, key: Optional[str]) -> Optional[int]:
+        if key is None:
+            return None
+        config = self.master.env.quark_chain_config
+        full_shard_id = config.get_full_shard_id_by_full_shard_key(int(key, 16))
+        if full_shard_id not in config.get_full_shard_ids():
+            raise ValueError("Unknown full shard key {}".format(key))
+        return full_shard_id
+
+    async def __handle_miner(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    keys = json.loads(line)["subscribe"]
+                    full_shard_ids = [self.__get_full_shard_id(key) for key in keys]
+                except Exception as e:
+                    writer.write(json.dumps({"error": str(e)}).encode() + b"\n")
+                    continue
+                for key, full_shard_id in zip(keys, full_shard_ids):
+                    self.subscribers.setdefault(full_shard_id, dict())[writer] = key
+                    # the miner gets the current work, the others only new work
+                    work = self.work_map.get(full_shard_id)
+                    if work is not None:
+                        self.__send(writer, key, work)
+                    asyncio.ensure_future(self.__update(full_shard_id))
+        except ConnectionError:
+            pass
+        finally:
+            for writers in self.subscribers.values():
+                writers.pop(writer, None)
+            writer.close()
@@ -17,6 +17,17 @@ MINOR_BLOCK_HEADER_LIST_LIMIT = 100
 # max number of transactions from NEW_TRANSACTION_LIST command
 NEW_TRANSACTION_LIST_LIMIT = 1000
 
+# number of minor blocks recently relayed kept to serve the transactions missing from their compact blocks
+COMPACT_BLOCK_CACHE_SIZE = 32
+
+# hashes of the transactions a peer is known to have, to not send them to it again
+KNOWN_TX_LIMIT = 32768
+KNOWN_TX_TTL_SEC = 600
+
+# transactions requested from a peer announcing them are requested again from
+# another peer announcing them after this long
+TX_REQUEST_TIMEOUT_SEC = 10
+
 ROOT_BLOCK_BATCH_SIZE = 100
 
 ROOT_BLOCK_HEADER_LIST_LIMIT = 500
@@ -47,12 +47,12 @@ class ByteBuffer:
     If there is no enough space during deserialization, throw exception
     """
 
-    def __init__(self, data):
+    def __init__(self, data, position=0):
         # We don't want deserialized object to have bytearray
         # which isn't hashable
         self.bytes = bytes(data)
-        self.position = 0
-        self.marked_position = 0
+        self.position = position
+        self.marked_position = position
 
     def __check_space(self, space):
         if space > len(self.bytes) - self.position:
@@ -274,6 +274,38 @@ class Serializable:
         return d
 
 
+class HashCachedSerializable(Serializable):
+    """ Serializable whose get_hash() and get_hash_for_mining() are memoized.
+    Assigning any attribute drops the cached hash, while assigning a field in
+    MINING_EXCLUDE_FIELDS (e.g., nonce) keeps the cached mining hash.
+    Nested field objects (e.g., coinbase_amount_map) must be replaced rather
+    than mutated in place.
+    """
+
+    MINING_EXCLUDE_FIELDS = []
+
+    def __setattr__(self, name, value):
+        d = self.__dict__
+        d[name] = value
+        d["_cached_hash"] = None
+        if name not in self.MINING_EXCLUDE_FIELDS:
+            d["_cached_hash_for_mining"] = None
+
+    def get_hash(self):
+        h = self.__dict__.get("_cached_hash")
+        if h is None:
+            h = sha3_256(self.serialize())
+            self.__dict__["_cached_hash"] = h
+        return h
+
+    def get_hash_for_mining(self):
+        h = self.__dict__.get("_cached_hash_for_mining")
+        if h is None:
+            h = sha3_256(self.serialize_without(self.MINING_EXCLUDE_FIELDS))
+            self.__dict__["_cached_hash_for_mining"] = h
+        return h
+
+
 class Optional:
     def __init__(self, serializer):
         self.serializer = serializer
@@ -614,10 +646,15 @@ def calculate_merkle_root(item_list):
 
 
 def mk_receipt_sha(receipts, db):
-    t = trie.Trie(db)
-    for i, receipt in enumerate(receipts):
-        t.update(rlp.encode(i), rlp.encode(receipt))
-    return t.root_hash
+    # sorted keys rlp.encode(i): single bytes below 0x80 for 1 to 127, 0x80
+    # for 0, then the longer keys of 128 and above in order
+    order = list(range(1, min(len(receipts), 128)))
+    if receipts:
+        order.append(0)
+    order.extend(range(128, len(receipts)))
+    return trie.Trie.from_sorted_items(
+        db, ((rlp.encode(i), rlp.encode(receipts[i])) for i in order)
+    ).root_hash
 
 
 class XshardTxCursorInfo(Serializable):
@@ -670,7 +707,7 @@ class MinorBlockMeta(Serializable):
         return sha3_256(self.serialize())
 
 
-class MinorBlockHeader(Serializable):
+class MinorBlockHeader(HashCachedSerializable):
     """ Header fields that are included in root block so that the root chain could quickly verify
     - Verify minor block headers included are valid appends on existing shards
     - Verify minor block headers reach sufficient difficulty
@@ -695,6 +732,7 @@ class MinorBlockHeader(Serializable):
         ("extra_data", PrependedSizeBytesSerializer(2)),
         ("mixhash", hash256),
     ]
+    MINING_EXCLUDE_FIELDS = ["nonce", "mixhash"]
 
     def __init__(
         self,
@@ -730,12 +768,6 @@ class MinorBlockHeader(Serializable):
         self.extra_data = extra_data
         self.mixhash = mixhash
 
-    def get_hash(self):
-        return sha3_256(self.serialize())
-
-    def get_hash_for_mining(self):
-        return sha3_256(self.serialize_without(["nonce", "mixhash"]))
-
 
 class MinorBlock(Serializable):
     FIELDS = [
@@ -868,7 +900,7 @@ class MinorBlock(Serializable):
         return isinstance(other, MinorBlock) and hash(other) == hash(self)
 
 
-class RootBlockHeader(Serializable):
+class RootBlockHeader(HashCachedSerializable):
     FIELDS = [
         ("version", uint32),
         ("height", uint32),
@@ -885,6 +917,7 @@ class RootBlockHeader(Serializable):
         ("mixhash", hash256),
         ("signature", FixedSizeBytesSerializer(65)),
     ]
+    MINING_EXCLUDE_FIELDS = ["nonce", "mixhash", "signature"]
 
     def __init__(
         self,
@@ -918,12 +951,6 @@ class RootBlockHeader(Serializable):
         self.mixhash = mixhash
         self.signature = signature
 
-    def get_hash(self):
-        return sha3_256(self.serialize())
-
-    def get_hash_for_mining(self):
-        return sha3_256(self.serialize_without(["nonce", "mixhash", "signature"]))
-
     def sign_with_private_key(self, private_key: KeyAPI.PrivateKey):
         self.signature = private_key.sign_msg_hash(
             self.get_hash_for_mining()
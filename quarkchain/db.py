@@ -13,6 +13,10 @@ class Db:
             raise KeyError("cannot find {}".format(key))
         return value
 
+    def put_many(self, items):
+        for key, value in items:
+            self.put(key, value)
+
     def close(self):
         pass
 
@@ -46,9 +50,16 @@ class InMemoryDb(Db):
     def get(self, key, default=None):
         return self.kv.get(key, default)
 
+    def multi_get(self, keys):
+        return {k: self.kv.get(k) for k in keys}
+
     def put(self, key, value):
         self.kv[key] = bytes(value)
 
+    def put_many(self, items):
+        for key, value in items:
+            self.kv[key] = bytes(value)
+
     def remove(self, key):
         del self.kv[key]
 
@@ -90,6 +101,15 @@ class PersistentDb(Db):
         value = bytes(value) if isinstance(value, bytearray) else value
         return self._db.put(key, value)
 
+    def put_many(self, items):
+        """ Writes the (key, value) pairs of items in one batch """
+        batch = rocksdb.WriteBatch()
+        for key, value in items:
+            key = key.encode() if not isinstance(key, bytes) else key
+            value = bytes(value) if isinstance(value, bytearray) else value
+            batch.put(key, value)
+        self._db.write(batch)
+
     def delete(self, key):
         key = key.encode() if not isinstance(key, bytes) else key
         return self._db.delete(key)
@@ -154,9 +174,19 @@ class OverlayDb(Db):
             return self.overlay[key]
         return self._db.get(key)
 
+    def multi_get(self, keys):
+        result = {k: self.overlay[k] for k in keys if k in self.overlay}
+        missing = [k for k in keys if k not in self.overlay]
+        if missing:
+            result.update(self._db.multi_get(missing))
+        return result
+
     def put(self, key, value):
         self.overlay[key] = value
 
+    def put_many(self, items):
+        self.overlay.update(items)
+
     def delete(self, key):
         self.overlay[key] = None
 
@@ -6,7 +6,7 @@ import rlp
 # to bypass circular imports
 import quarkchain.core
 
-from quarkchain.evm.utils import int256, safe_ord, bytearray_to_bytestr, add_dict
+from quarkchain.evm.utils import int256, bytearray_to_bytestr, add_dict
 from rlp.sedes import big_endian_int, binary, CountableList, BigEndianInt
 from rlp.sedes.binary import Binary
 from quarkchain.rlp.utils import decode_hex, encode_hex
@@ -236,7 +236,7 @@ def apply_transaction(state, tx: transactions.Transaction, tx_wrapper_hash):
     )
     state.delta_token_balance(tx.sender, tx.gas_token_id, -tx.startgas * tx.gasprice)
 
-    message_data = vm.CallData([safe_ord(x) for x in tx.data], 0, len(tx.data))
+    message_data = vm.CallData(tx.data)
     message = vm.Message(
         tx.sender,
         tx.to,
@@ -350,6 +350,7 @@ class VMExt:
             self.specials[k] = v
         self._state = state
         self.get_code = state.get_code
+        self.get_code_hash = state.get_code_hash
         self.set_code = state.set_code
         self.get_balances = state.get_balances  # gets token balances dict
         self.get_balance = (
@@ -378,7 +379,7 @@ class VMExt:
         self.block_gas_limit = state.gas_limit
         self.log = lambda addr, topics, data: state.add_log(Log(addr, topics, data))
         self.create = lambda msg: create_contract(self, msg)
-        self.msg = lambda msg: _apply_msg(self, msg, self.get_code(msg.code_address))
+        self.msg = lambda msg: apply_msg(self, msg)
         self.account_exists = state.account_exists
         self.blockhash_store = 0x20
         self.snapshot = state.snapshot
@@ -396,10 +397,12 @@ class VMExt:
 
 
 def apply_msg(ext, msg):
-    return _apply_msg(ext, msg, ext.get_code(msg.code_address))
+    return _apply_msg(
+        ext, msg, ext.get_code(msg.code_address), ext.get_code_hash(msg.code_address)
+    )
 
 
-def _apply_msg(ext, msg, code):
+def _apply_msg(ext, msg, code, code_hash=None):
     trace_msg = log_msg.is_active("trace")
     if trace_msg:
         log_msg.debug(
@@ -468,7 +471,7 @@ def _apply_msg(ext, msg, code):
     if msg.code_address in ext.specials:
         res, gas, dat = ext.specials[msg.code_address](ext, msg)
     else:
-        res, gas, dat = vm.vm_execute(ext, msg, code)
+        res, gas, dat = vm.vm_execute(ext, msg, code, code_hash)
 
     if trace_msg:
         log_msg.debug(
@@ -528,7 +531,7 @@ def create_contract(ext, msg):
 
     msg.is_create = True
     # assert not ext.get_code(msg.to)
-    msg.data = vm.CallData([], 0, 0)
+    msg.data = vm.CallData(b"")
     snapshot = ext.snapshot()
 
     ext.set_nonce(msg.to, 1)
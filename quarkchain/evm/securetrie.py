@@ -15,6 +15,10 @@ class SecureTrie(object):
     def get(self, k):
         return self.trie.get(utils.sha3_256(k))
 
+    def get_many(self, keys):
+        hashes = {utils.sha3_256(k): k for k in keys}
+        return {hashes[h]: v for h, v in self.trie.get_many(hashes).items()}
+
     def delete(self, k):
         self.trie.delete(utils.sha3_256(k))
 
@@ -1,10 +1,9 @@
 # -*- coding: utf8 -*-
 from py_ecc.secp256k1 import privtopub, ecdsa_raw_recover, N as secp256k1n
 import hashlib
-from quarkchain.rlp.utils import ascii_chr
 
 from quarkchain.evm import utils, opcodes
-from quarkchain.evm.utils import safe_ord, decode_hex, encode_int32
+from quarkchain.evm.utils import decode_hex, encode_int32
 
 
 ZERO_PRIVKEY_ADDR = decode_hex("3f17f1962b36e491b30a40b2405849e597ba5fb5")
@@ -17,9 +16,8 @@ def proc_ecrecover(ext, msg):
     if msg.gas < gas_cost:
         return 0, 0, []
 
-    message_hash_bytes = [0] * 32
-    msg.data.extract_copy(message_hash_bytes, 0, 0, 32)
-    message_hash = b"".join(map(ascii_chr, message_hash_bytes))
+    message_hash = bytearray(32)
+    msg.data.extract_copy(message_hash, 0, 0, 32)
 
     # TODO: This conversion isn't really necessary.
     # TODO: Invesitage if the check below is really needed.
@@ -30,10 +28,10 @@ def proc_ecrecover(ext, msg):
     if r >= secp256k1n or s >= secp256k1n or v < 27 or v > 28:
         return 1, msg.gas - opcodes.GECRECOVER, []
     try:
-        pub = utils.ecrecover_to_pub(message_hash, v, r, s)
+        pub = utils.ecrecover_to_pub(bytes(message_hash), v, r, s)
     except Exception as e:
         return 1, msg.gas - gas_cost, []
-    o = [0] * 12 + [safe_ord(x) for x in utils.sha3(pub)[-20:]]
+    o = bytes(12) + utils.sha3(pub)[-20:]
     return 1, msg.gas - gas_cost, o
 
 
@@ -46,7 +44,7 @@ def proc_sha256(ext, msg):
     if msg.gas < gas_cost:
         return 0, 0, []
     d = msg.data.extract_all()
-    o = [safe_ord(x) for x in hashlib.sha256(d).digest()]
+    o = hashlib.sha256(d).digest()
     return 1, msg.gas - gas_cost, o
 
 
@@ -60,7 +58,7 @@ def proc_ripemd160(ext, msg):
     if msg.gas < gas_cost:
         return 0, 0, []
     d = msg.data.extract_all()
-    o = [0] * 12 + [safe_ord(x) for x in hashlib.new("ripemd160", d).digest()]
+    o = bytes(12) + hashlib.new("ripemd160", d).digest()
     return 1, msg.gas - gas_cost, o
 
 
@@ -72,8 +70,7 @@ def proc_identity(ext, msg):
     gas_cost = OP_GAS
     if msg.gas < gas_cost:
         return 0, 0, []
-    o = [0] * msg.data.size
-    msg.data.extract_copy(o, 0, 0, len(o))
+    o = msg.data.extract_all()
     return 1, msg.gas - gas_cost, o
 
 
@@ -104,7 +101,7 @@ def proc_modexp(ext, msg):
     if msg.gas < gas_cost:
         return 0, 0, []
     if baselen == 0:
-        return 1, msg.gas - gas_cost, [0] * modlen
+        return 1, msg.gas - gas_cost, bytes(modlen)
     if modlen == 0:
         return 1, msg.gas - gas_cost, []
     base = bytearray(baselen)
@@ -114,17 +111,13 @@ def proc_modexp(ext, msg):
     mod = bytearray(modlen)
     msg.data.extract_copy(mod, 0, 96 + baselen + explen, modlen)
     if utils.big_endian_to_int(mod) == 0:
-        return 1, msg.gas - gas_cost, [0] * modlen
+        return 1, msg.gas - gas_cost, bytes(modlen)
     o = pow(
         utils.big_endian_to_int(base),
         utils.big_endian_to_int(exp),
         utils.big_endian_to_int(mod),
     )
-    return (
-        1,
-        msg.gas - gas_cost,
-        [safe_ord(x) for x in utils.zpad(utils.int_to_big_endian(o), modlen)],
-    )
+    return 1, msg.gas - gas_cost, utils.zpad(utils.int_to_big_endian(o), modlen)
 
 
 def validate_point(x, y):
@@ -158,11 +151,7 @@ def proc_ecadd(ext, msg):
     if p1 is False or p2 is False:
         return 0, 0, []
     o = bn128.normalize(bn128.add(p1, p2))
-    return (
-        1,
-        msg.gas - opcodes.GECADD,
-        [safe_ord(x) for x in (encode_int32(o[0].n) + encode_int32(o[1].n))],
-    )
+    return 1, msg.gas - opcodes.GECADD, encode_int32(o[0].n) + encode_int32(o[1].n)
 
 
 def proc_ecmul(ext, msg):
@@ -179,11 +168,7 @@ def proc_ecmul(ext, msg):
     if p is False:
         return 0, 0, []
     o = bn128.normalize(bn128.multiply(p, m))
-    return (
-        1,
-        msg.gas - opcodes.GECMUL,
-        [safe_ord(c) for c in (encode_int32(o[0].n) + encode_int32(o[1].n))],
-    )
+    return 1, msg.gas - opcodes.GECMUL, encode_int32(o[0].n) + encode_int32(o[1].n)
 
 
 def proc_ecpairing(ext, msg):
@@ -224,7 +209,7 @@ def proc_ecpairing(ext, msg):
             return 0, 0, []
         exponent *= bn128.pairing(p2, p1, final_exponentiate=False)
     result = bn128.final_exponentiate(exponent) == bn128.FQ12.one()
-    return 1, msg.gas - gascost, [0] * 31 + [1 if result else 0]
+    return 1, msg.gas - gascost, encode_int32(1 if result else 0)
 
 
 specials = {
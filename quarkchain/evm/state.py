@@ -301,17 +301,7 @@ class State:
         else:
             rlpdata = self.trie.get(address)
         if rlpdata != trie.BLANK_NODE:
-            o = rlp.decode(rlpdata, _Account)
-            o = Account(
-                nonce=o.nonce,
-                token_balances=o.token_balances,
-                storage=o.storage,
-                code_hash=o.code_hash,
-                full_shard_key=o.full_shard_key,
-                env=self.env,
-                address=address,
-                db=self.db,
-            )
+            o = self.decode_account(address, rlpdata)
         else:
             o = Account.blank_account(
                 self.env,
@@ -325,6 +315,28 @@ class State:
         o._cached_rlp = None
         return o
 
+    def decode_account(self, address, rlpdata):
+        o = rlp.decode(rlpdata, _Account)
+        return Account(
+            nonce=o.nonce,
+            token_balances=o.token_balances,
+            storage=o.storage,
+            code_hash=o.code_hash,
+            full_shard_key=o.full_shard_key,
+            env=self.env,
+            address=address,
+            db=self.db,
+        )
+
+    def cache_accounts(self, accounts):
+        """ Caches {address: Account} read from the trie before they are accessed,
+        accounts already cached are kept """
+        for address, o in accounts.items():
+            if address not in self.cache:
+                self.cache[address] = o
+                o._mutable = True
+                o._cached_rlp = None
+
     def get_balances(self, address) -> dict:
         return self.get_and_cache_account(
             utils.normalize_address(address)
@@ -340,6 +352,9 @@ class State:
     def get_code(self, address):
         return self.get_and_cache_account(utils.normalize_address(address)).code
 
+    def get_code_hash(self, address):
+        return self.get_and_cache_account(utils.normalize_address(address)).code_hash
+
     def get_nonce(self, address):
         return self.get_and_cache_account(utils.normalize_address(address)).nonce
 
@@ -649,6 +664,12 @@ class State:
         state.changed = {}
         return state
 
+    def use_overlay_db(self):
+        """ Keeps the db writes of this state in memory, e.g. in a forked process """
+        self.__db = OverlayDb(self.__db)
+        for acct in self.cache.values():
+            acct.db = self.__db
+
     def ephemeral_clone(self):
         snapshot = self.to_snapshot(root_only=True, no_prevblocks=True)
         env2 = Env(OverlayDb(self.db), self.env.config)
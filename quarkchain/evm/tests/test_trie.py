@@ -6,6 +6,8 @@ import itertools
 from quarkchain.utils import Logger
 import unittest
 
+import pytest
+
 # customize VM log output to your needs
 # hint: use 'py.test' with the '-s' option to dump logs to the console
 # configure_logging(':trace')
@@ -75,6 +77,42 @@ def run_test(name, pairs):
                 name, pairs['root'], '0x' + t.root_hash.hex(), (i, list(permut) + deletes)))
 
 
+
+def test_get_many():
+    db = InMemoryDb()
+    t = trie.Trie(db)
+    # short values are embedded in their parent node
+    items = {bytes([i, i * 7 % 256]): bytes([i]) * (i % 40 + 1) for i in range(200)}
+    items[b'\x01'] = b'prefix of other keys'
+    for k, v in items.items():
+        t.update(k, v)
+    keys = list(items) + [b'\x01\x02\x03', b'\xff', b'']
+    t = trie.Trie(db, t.root_hash)
+    assert t.get_many(keys) == {k: t.get(k) for k in keys}
+    assert t.get_many(keys)[b'\x01'] == b'prefix of other keys'
+    assert t.get_many([b'\xff']) == {b'\xff': trie.BLANK_NODE}
+    assert trie.Trie(db).get_many([b'\x01']) == {b'\x01': trie.BLANK_NODE}
+
+
+def test_from_sorted_items():
+    # keys sharing prefixes, prefixes of other keys and short values
+    # embedded in their parent node
+    items = {bytes([i % 7, i % 5, i]): bytes([i]) * (i % 40 + 1) for i in range(200)}
+    items.update({b'\x01': b'prefix of other keys', b'\x01\x01': b'x', b'': b'y'})
+    t = trie.Trie(InMemoryDb())
+    for k, v in items.items():
+        t.update(k, v)
+    db = InMemoryDb()
+    built = trie.Trie.from_sorted_items(db, sorted(items.items()), batch_size=7)
+    assert built.root_hash == t.root_hash
+    assert set(db.kv) <= set(t.db.kv)
+    assert trie.Trie(db, built.root_hash).to_dict() == items
+    assert trie.Trie.from_sorted_items(db, []).root_hash == trie.BLANK_ROOT
+    builder = trie.TrieBuilder(db)
+    builder.add(b'\x02', b'x')
+    with pytest.raises(Exception):
+        builder.add(b'\x01', b'x')
+
 if __name__ == '__main__':
     for name, pairs in load_tests_dict().items():
         run_test(name, pairs)
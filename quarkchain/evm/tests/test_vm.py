@@ -0,0 +1,102 @@
+import pytest
+
+from quarkchain.evm.vm import (
+    CallData,
+    CodeCache,
+    Message,
+    VmExtBase,
+    preprocess_code,
+    vm_execute,
+)
+
+
+def execute(code, gas=100000):
+    return vm_execute(VmExtBase(), Message(b"", b"", gas=gas), bytes.fromhex(code))
+
+
+def test_block_gas():
+    # PUSH1 1 PUSH1 2 ADD STOP
+    code = "6001600201" + "00"
+    assert execute(code, gas=9) == (1, 0, [])
+    assert execute(code, gas=8) == (0, 0, [])
+
+
+def test_gas_left_after_own_fee():
+    # PUSH1 0 POP GAS PUSH1 0 MSTORE PUSH1 32 PUSH1 0 RETURN
+    result, gas, data = execute("600050" + "5a" + "600052" + "60206000f3")
+    assert result == 1
+    assert int.from_bytes(data, byteorder="big") == 100000 - 3 - 2 - 2
+
+
+def test_loop():
+    # PUSH1 10 JUMPDEST PUSH1 1 SWAP1 SUB DUP1 PUSH1 2 JUMPI STOP
+    result, gas, _ = execute("600a" + "5b" + "60019003" + "80600257" + "00")
+    assert result == 1
+    # PUSH1, then 10 times JUMPDEST ... JUMPI
+    assert gas == 100000 - 3 - 10 * (1 + 3 + 3 + 3 + 3 + 3 + 10)
+
+
+@pytest.mark.parametrize(
+    "code",
+    (
+        # JUMP into pushdata
+        "6003566002" + "5b",
+        # JUMP out of code
+        "61ffff56",
+        # stack underflow after a valid instruction
+        "600101",
+        # invalid opcode after a valid instruction
+        "6001fe",
+    ),
+)
+def test_exception(code):
+    assert execute(code) == (0, 0, [])
+
+
+def test_truncated_push():
+    # PUSH2 with one byte of data left
+    assert execute("6101") == (1, 100000 - 3, [])
+
+
+def test_preprocess_code():
+    # PUSH2 JUMPDEST JUMPDEST, JUMPDEST, PUSH32 with a JUMPDEST cut off
+    code = bytes.fromhex("615b5b" + "5b" + "7f5b")
+    jumpdests, blocks = preprocess_code(code)
+    assert jumpdests == bytes([0b1000])
+    assert blocks == {}
+
+
+def test_code_cache():
+    cache = CodeCache(max_code_size=10)
+    code1, code2 = b"\x5b" * 4, b"\x5b" * 5
+    jumpdests, _ = cache.get(b"1", code1)
+    assert jumpdests == bytes([0b1111])
+    assert cache.get(b"1", code1)[0] is jumpdests
+    cache.get(b"2", code2)
+    assert cache.get_stats()["hitCount"] == 1
+    assert cache.get_stats()["codeSize"] == 9
+
+    # the least recently used one is evicted
+    cache.get(b"1", code1)
+    cache.get(b"3", code1)
+    assert list(cache.cache) == [b"1", b"3"]
+    assert cache.get_stats()["codeSize"] == 8
+    assert cache.get_stats()["missCount"] == 3
+
+
+def test_call_data():
+    data = CallData(b"\x00\x01\x02\x03", offset=1, size=4)
+    assert data.extract_all() == b"\x01\x02\x03\x00"
+    assert data.extract32(2) == 3 << 8 * 31
+    assert data.extract32(4) == 0
+    mem = bytearray(b"\xff" * 6)
+    data.extract_copy(mem, 1, 1, 4)
+    assert mem == b"\xff\x02\x03\x00\x00\xff"
+
+
+def test_codecopy():
+    # PUSH1 40 PUSH1 0 PUSH1 0 CODECOPY PUSH1 40 PUSH1 0 RETURN
+    code = "6028600060003960286000f3"
+    result, _, data = execute(code)
+    assert result == 1
+    assert data == bytes.fromhex(code) + bytes(40 - 12)
@@ -899,6 +899,63 @@ class Trie(object):
             raise Exception("Key must be bytes")
         return self._get(self.root_node, bin_to_nibbles(to_bytes(key)))
 
+    def _get_many_step(self, node, key):
+        """ follow key down node and its embedded nodes
+
+        :return: (value, None) once the value is found, BLANK_NODE if it
+            does not exist, or (None, (hash, key)) for the node to read next
+        """
+        while True:
+            node_type = self._get_node_type(node)
+            if node_type == NODE_TYPE_BLANK:
+                return BLANK_NODE, None
+            if node_type == NODE_TYPE_BRANCH:
+                if not key:
+                    return node[-1], None
+                node, key = node[key[0]], key[1:]
+            else:
+                curr_key = without_terminator(unpack_to_nibbles(node[0]))
+                if node_type == NODE_TYPE_LEAF:
+                    return (node[1] if key == curr_key else BLANK_NODE), None
+                if not starts_with(key, curr_key):
+                    return BLANK_NODE, None
+                node, key = node[1], key[len(curr_key):]
+            if not isinstance(node, list) and node != BLANK_NODE:
+                return None, (node, key)
+
+    def get_many(self, keys):
+        """ get the values of keys, reading the nodes at each depth of the
+        trie together with one multi_get of the db when it has one
+
+        :return: dict of key to value or BLANK_NODE
+        """
+        multi_get = getattr(self.db, "multi_get", None)
+        if multi_get is None:
+            def multi_get(hashes):
+                return {h: self.db.get(h) for h in hashes}
+
+        result = {}
+        pending = []
+        for key in keys:
+            value, next_node = self._get_many_step(
+                self.root_node, bin_to_nibbles(to_bytes(key)))
+            if next_node is None:
+                result[key] = value
+            else:
+                pending.append((key, next_node))
+        while pending:
+            nodes = multi_get(list({h for _, (h, _) in pending}))
+            next_pending = []
+            for key, (h, nibbles) in pending:
+                value, next_node = self._get_many_step(
+                    rlp.decode(nodes[h]), nibbles)
+                if next_node is None:
+                    result[key] = value
+                else:
+                    next_pending.append((key, next_node))
+            pending = next_pending
+        return result
+
     def __len__(self):
         return self._get_size(self.root_node)
 
@@ -939,12 +996,126 @@ class Trie(object):
             value)
         self._update_root_hash()
 
+    @classmethod
+    def from_sorted_items(cls, db, items, batch_size=10000):
+        """ build the trie of items bottom-up in one pass instead of updating
+        the keys one by one, writing the nodes to db in batches of batch_size
+
+        :param items: iterable of (key, value) sorted by key, with unique keys
+            and non-empty values
+        """
+        builder = TrieBuilder(db, batch_size)
+        for key, value in items:
+            builder.add(key, value)
+        return cls(db, builder.finish())
+
     def root_hash_valid(self):
         if self.root_hash == BLANK_ROOT:
             return True
         return self.root_hash in self.db
 
 
+class TrieBuilder(object):
+    """ build a trie from (key, value) added in the order of the keys
+
+    Only the path of the last key is kept: the branch nodes along it are
+    open, and the nodes left of it are encoded once, when no more keys can
+    be added under them, and written to the db in batches.
+    """
+
+    def __init__(self, db, batch_size=10000):
+        self.db = db
+        self.batch_size = batch_size
+        self.nodes = []
+        # open branch nodes as (depth, nibbles of a key under it, node)
+        self.stack = []
+        # the last key added, not yet in a node, as (None, nibbles, value)
+        self.pending = None
+        self.last_key = None
+
+    def _put_nodes(self):
+        put_many = getattr(self.db, "put_many", None)
+        if put_many is None:
+            for key, value in self.nodes:
+                self.db.put(key, value)
+        else:
+            put_many(self.nodes)
+        self.nodes = []
+
+    def _encode_node(self, node):
+        rlpnode = rlp_encode(node)
+        if len(rlpnode) < 32:
+            return node
+        hashkey = utils.sha3_256(rlpnode)
+        self.nodes.append((hashkey, rlpnode))
+        if len(self.nodes) >= self.batch_size:
+            self._put_nodes()
+        return hashkey
+
+    def _node_below(self, subtree, depth):
+        """ node of subtree, the pending key or a closed branch, under the
+        first depth nibbles of its keys
+        """
+        subtree_depth, nibbles, node = subtree
+        if subtree_depth is None:
+            return [pack_nibbles(with_terminator(nibbles[depth:])), node]
+        if subtree_depth == depth:
+            return node
+        return [pack_nibbles(nibbles[depth:subtree_depth]),
+                self._encode_node(node)]
+
+    def _close(self, subtree, branch):
+        depth, _, node = branch
+        nibbles = subtree[1]
+        if len(nibbles) == depth:
+            node[16] = subtree[2]
+        else:
+            node[nibbles[depth]] = self._encode_node(
+                self._node_below(subtree, depth + 1))
+
+    def add(self, key, value):
+        if not isinstance(key, bytes) or not isinstance(value, bytes):
+            raise Exception("Key and value must be bytes")
+        if self.last_key is not None and key <= self.last_key:
+            raise Exception("Keys must be added in increasing order")
+        self.last_key = key
+        nibbles = bin_to_nibbles(key)
+        if self.pending is None:
+            self.pending = (None, nibbles, value)
+            return
+        prev = self.pending[1]
+        common = 0
+        while (common < len(prev) and common < len(nibbles)
+               and prev[common] == nibbles[common]):
+            common += 1
+        # the subtree of the previous key gets no more keys below common
+        subtree = self.pending
+        while self.stack and self.stack[-1][0] > common:
+            branch = self.stack.pop()
+            self._close(subtree, branch)
+            subtree = branch
+        if not self.stack or self.stack[-1][0] < common:
+            self.stack.append((common, prev, [BLANK_NODE] * 17))
+        self._close(subtree, self.stack[-1])
+        self.pending = (None, nibbles, value)
+
+    def finish(self):
+        """ write the remaining nodes and return the root hash """
+        if self.pending is None:
+            return BLANK_ROOT
+        subtree = self.pending
+        while self.stack:
+            branch = self.stack.pop()
+            self._close(subtree, branch)
+            subtree = branch
+        root = rlp_encode(self._node_below(subtree, 0))
+        root_hash = utils.sha3_256(root)
+        self.nodes.append((root_hash, root))
+        self._put_nodes()
+        self.pending = None
+        return root_hash
+
+
 if __name__ == "__main__":
     import sys
     from quarkchain.db import PersistentDb
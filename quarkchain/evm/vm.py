@@ -1,12 +1,13 @@
 # Modified based on pyethereum under MIT license
+import re
 import sys
 import copy
+from collections import OrderedDict
 from quarkchain.rlp.utils import encode_hex, ascii_chr
 from quarkchain.evm import utils
 from quarkchain.evm import opcodes
 from quarkchain.evm.slogging import get_logger
 from quarkchain.evm.utils import to_string, bytearray_to_bytestr, safe_ord
-from functools import lru_cache
 
 # ###### dev hack flags ###############
 
@@ -37,6 +38,7 @@ MAX_DEPTH = 1024
 # slice plus the start and end of the slice
 class CallData(object):
     def __init__(self, parent_memory, offset=0, size=None):
+        # bytes for transaction data, or the bytearray memory of the caller
         self.data = parent_memory
         self.offset = offset
         self.size = len(self.data) if size is None else size
@@ -44,25 +46,29 @@ class CallData(object):
 
     # Convert calldata to bytes
     def extract_all(self):
-        d = self.data[self.offset : self.offset + self.size]
-        d.extend(bytearray(self.size - len(d)))
-        return bytes(bytearray(d))
+        d = bytes(self.data[self.offset : self.rlimit])
+        return d + bytes(self.size - len(d))
 
     # Extract 32 bytes as integer
     def extract32(self, i):
         if i >= self.size:
             return 0
         o = self.data[self.offset + i : min(self.offset + i + 32, self.rlimit)]
-        o.extend(bytearray(32 - len(o)))
-        return utils.bytearray_to_int(o)
+        return int.from_bytes(o, byteorder="big") << (8 * (32 - len(o)))
 
     # Extract a slice and copy it to memory
     def extract_copy(self, mem, memstart, datastart, size):
-        for i in range(size):
-            if datastart + i < self.size:
-                mem[memstart + i] = self.data[self.offset + datastart + i]
-            else:
-                mem[memstart + i] = 0
+        copy_padded(
+            mem, memstart, self.data, self.offset + datastart, self.rlimit, size
+        )
+
+
+def copy_padded(mem, memstart, data, start, end, size):
+    """ Copies size bytes of data[start:end] to mem at memstart, zero padded """
+    chunk = data[start : min(start + size, end)] if start < end else b""
+    mem[memstart : memstart + len(chunk)] = chunk
+    if len(chunk) < size:
+        mem[memstart + len(chunk) : memstart + size] = bytes(size - len(chunk))
 
 
 # Stores a message object, including context data like sender,
@@ -92,9 +98,7 @@ class Message(object):
         self.value = value
         self.gas = gas
         self.data = (
-            CallData(list(map(utils.safe_ord, data)))
-            if isinstance(data, (str, bytes))
-            else data
+            CallData(to_string(data)) if isinstance(data, (str, bytes)) else data
         )
         self.depth = depth
         self.logs = []
@@ -141,26 +145,6 @@ class Compustate:
         self.prev_gas = self.gas
 
 
-# Preprocesses code, and determines which locations are in the middle
-# of pushdata and thus invalid
-@lru_cache(128)
-def preprocess_code(code):
-    o = 0
-    i = 0
-    pushcache = {}
-    code = code + b"\x00" * 32
-    while i < len(code) - 32:
-        codebyte = safe_ord(code[i])
-        if codebyte == 0x5B:
-            o |= 1 << i
-        if 0x60 <= codebyte <= 0x7F:
-            pushcache[i] = utils.big_endian_to_int(code[i + 1 : i + codebyte - 0x5E])
-            i += codebyte - 0x5E
-        else:
-            i += 1
-    return o, pushcache
-
-
 # Extends memory, and pays gas for it
 def mem_extend(mem, compustate, op, start, sz):
     if sz and start + sz > len(mem):
@@ -272,20 +256,903 @@ def vm_trace(ext, msg, compustate, opcode, pushcache, tracer=log_vm_op):
     compustate.prev_prev_op = op
 
 
+# Opcode handlers
+#
+# A handler takes the compustate, its stack and the static argument of the
+# instruction, e.g. the n of DUPn. It returns None to continue with the next
+# instruction, or the result of the VM when the execution stops. The static
+# gas and the stack bounds are checked by vm_execute before the handler runs.
+
+
+def op_noop(compustate, stk, arg):
+    pass
+
+
+def op_invalid(compustate, stk, arg):
+    return vm_exception("INVALID OP", opcode=arg)
+
+
+# Arithmetic
+def op_stop(compustate, stk, arg):
+    return peaceful_exit("STOP", compustate.gas, [])
+
+
+def op_add(compustate, stk, arg):
+    stk.append((stk.pop() + stk.pop()) & TT256M1)
+
+
+def op_sub(compustate, stk, arg):
+    stk.append((stk.pop() - stk.pop()) & TT256M1)
+
+
+def op_mul(compustate, stk, arg):
+    stk.append((stk.pop() * stk.pop()) & TT256M1)
+
+
+def op_div(compustate, stk, arg):
+    s0, s1 = stk.pop(), stk.pop()
+    stk.append(0 if s1 == 0 else s0 // s1)
+
+
+def op_mod(compustate, stk, arg):
+    s0, s1 = stk.pop(), stk.pop()
+    stk.append(0 if s1 == 0 else s0 % s1)
+
+
+def op_sdiv(compustate, stk, arg):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(
+        0 if s1 == 0 else (abs(s0) // abs(s1) * (-1 if s0 * s1 < 0 else 1)) & TT256M1
+    )
+
+
+def op_smod(compustate, stk, arg):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(0 if s1 == 0 else (abs(s0) % abs(s1) * (-1 if s0 < 0 else 1)) & TT256M1)
+
+
+def op_addmod(compustate, stk, arg):
+    s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
+    stk.append((s0 + s1) % s2 if s2 else 0)
+
+
+def op_mulmod(compustate, stk, arg):
+    s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
+    stk.append((s0 * s1) % s2 if s2 else 0)
+
+
+def op_exp(compustate, stk, arg):
+    base, exponent = stk.pop(), stk.pop()
+    # fee for exponent is dependent on its bytes
+    # calc n bytes to represent exponent
+    nbytes = len(utils.encode_int(exponent))
+    expfee = nbytes * opcodes.GEXPONENTBYTE
+    expfee += opcodes.EXP_SUPPLEMENTAL_GAS * nbytes
+    if compustate.gas < expfee:
+        compustate.gas = 0
+        return vm_exception("OOG EXPONENT")
+    compustate.gas -= expfee
+    stk.append(pow(base, exponent, TT256))
+
+
+def op_signextend(compustate, stk, arg):
+    s0, s1 = stk.pop(), stk.pop()
+    if s0 <= 31:
+        testbit = s0 * 8 + 7
+        if s1 & (1 << testbit):
+            stk.append(s1 | (TT256 - (1 << testbit)))
+        else:
+            stk.append(s1 & ((1 << testbit) - 1))
+    else:
+        stk.append(s1)
+
+
+# Comparisons
+def op_lt(compustate, stk, arg):
+    stk.append(1 if stk.pop() < stk.pop() else 0)
+
+
+def op_gt(compustate, stk, arg):
+    stk.append(1 if stk.pop() > stk.pop() else 0)
+
+
+def op_slt(compustate, stk, arg):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(1 if s0 < s1 else 0)
+
+
+def op_sgt(compustate, stk, arg):
+    s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
+    stk.append(1 if s0 > s1 else 0)
+
+
+def op_eq(compustate, stk, arg):
+    stk.append(1 if stk.pop() == stk.pop() else 0)
+
+
+def op_iszero(compustate, stk, arg):
+    stk.append(0 if stk.pop() else 1)
+
+
+def op_and(compustate, stk, arg):
+    stk.append(stk.pop() & stk.pop())
+
+
+def op_or(compustate, stk, arg):
+    stk.append(stk.pop() | stk.pop())
+
+
+def op_xor(compustate, stk, arg):
+    stk.append(stk.pop() ^ stk.pop())
+
+
+def op_not(compustate, stk, arg):
+    stk.append(TT256M1 - stk.pop())
+
+
+def op_byte(compustate, stk, arg):
+    s0, s1 = stk.pop(), stk.pop()
+    if s0 >= 32:
+        stk.append(0)
+    else:
+        stk.append((s1 // 256 ** (31 - s0)) % 256)
+
+
+# SHA3 and environment info
+def op_sha3(compustate, stk, arg):
+    mem = compustate.memory
+    s0, s1 = stk.pop(), stk.pop()
+    compustate.gas -= opcodes.GSHA3WORD * (utils.ceil32(s1) // 32)
+    if compustate.gas < 0:
+        return vm_exception("OOG PAYING FOR SHA3")
+    if not mem_extend(mem, compustate, "SHA3", s0, s1):
+        return vm_exception("OOG EXTENDING MEMORY")
+    data = bytearray_to_bytestr(mem[s0 : s0 + s1])
+    stk.append(utils.big_endian_to_int(utils.sha3(data)))
+
+
+def op_address(compustate, stk, arg):
+    stk.append(utils.coerce_to_int(compustate.msg.to))
+
+
+def op_balance(compustate, stk, arg):
+    if not eat_gas(compustate, opcodes.BALANCE_SUPPLEMENTAL_GAS):
+        return vm_exception("OUT OF GAS")
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2 ** 160)
+    stk.append(compustate.ext.get_balance(addr))
+
+
+def op_origin(compustate, stk, arg):
+    stk.append(utils.coerce_to_int(compustate.ext.tx_origin))
+
+
+def op_caller(compustate, stk, arg):
+    stk.append(utils.coerce_to_int(compustate.msg.sender))
+
+
+def op_callvalue(compustate, stk, arg):
+    stk.append(compustate.msg.value)
+
+
+def op_calldataload(compustate, stk, arg):
+    stk.append(compustate.msg.data.extract32(stk.pop()))
+
+
+def op_calldatasize(compustate, stk, arg):
+    stk.append(compustate.msg.data.size)
+
+
+def op_calldatacopy(compustate, stk, arg):
+    mem = compustate.memory
+    mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, "CALLDATACOPY", mstart, size):
+        return vm_exception("OOG EXTENDING MEMORY")
+    if not data_copy(compustate, size):
+        return vm_exception("OOG COPY DATA")
+    compustate.msg.data.extract_copy(mem, mstart, dstart, size)
+
+
+def op_codecopy(compustate, stk, arg):
+    mem = compustate.memory
+    code = compustate.code
+    codelen = len(code)
+    mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, "CODECOPY", mstart, size):
+        return vm_exception("OOG EXTENDING MEMORY")
+    if not data_copy(compustate, size):
+        return vm_exception("OOG COPY DATA")
+    copy_padded(mem, mstart, code, dstart, codelen, size)
+
+
+def op_returndatacopy(compustate, stk, arg):
+    mem = compustate.memory
+    mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, "RETURNDATACOPY", mstart, size):
+        return vm_exception("OOG EXTENDING MEMORY")
+    if not data_copy(compustate, size):
+        return vm_exception("OOG COPY DATA")
+    if dstart + size > len(compustate.last_returned):
+        return vm_exception("RETURNDATACOPY out of range")
+    mem[mstart : mstart + size] = compustate.last_returned[dstart : dstart + size]
+
+
+def op_returndatasize(compustate, stk, arg):
+    stk.append(len(compustate.last_returned))
+
+
+def op_gasprice(compustate, stk, arg):
+    stk.append(compustate.ext.tx_gasprice)
+
+
+def op_extcodesize(compustate, stk, arg):
+    if not eat_gas(compustate, opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS):
+        return vm_exception("OUT OF GAS")
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2 ** 160)
+    stk.append(len(compustate.ext.get_code(addr) or b""))
+
+
+def op_extcodecopy(compustate, stk, arg):
+    mem = compustate.memory
+    if not eat_gas(compustate, opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS):
+        return vm_exception("OUT OF GAS")
+    addr = utils.coerce_addr_to_hex(stk.pop() % 2 ** 160)
+    start, s2, size = stk.pop(), stk.pop(), stk.pop()
+    extcode = compustate.ext.get_code(addr) or b""
+    assert utils.is_string(extcode)
+    if not mem_extend(mem, compustate, "EXTCODECOPY", start, size):
+        return vm_exception("OOG EXTENDING MEMORY")
+    if not data_copy(compustate, size):
+        return vm_exception("OOG COPY DATA")
+    copy_padded(mem, start, extcode, s2, len(extcode), size)
+
+
+# Block info
+def op_blockhash(compustate, stk, arg):
+    stk.append(utils.big_endian_to_int(compustate.ext.block_hash(stk.pop())))
+
+
+def op_coinbase(compustate, stk, arg):
+    stk.append(utils.big_endian_to_int(compustate.ext.block_coinbase))
+
+
+def op_timestamp(compustate, stk, arg):
+    stk.append(compustate.ext.block_timestamp)
+
+
+def op_number(compustate, stk, arg):
+    stk.append(compustate.ext.block_number)
+
+
+def op_difficulty(compustate, stk, arg):
+    stk.append(compustate.ext.block_difficulty)
+
+
+def op_gaslimit(compustate, stk, arg):
+    stk.append(compustate.ext.block_gas_limit)
+
+
+# VM state manipulations
+def op_pop(compustate, stk, arg):
+    stk.pop()
+
+
+def op_mload(compustate, stk, arg):
+    mem = compustate.memory
+    s0 = stk.pop()
+    if not mem_extend(mem, compustate, "MLOAD", s0, 32):
+        return vm_exception("OOG EXTENDING MEMORY")
+    stk.append(utils.bytes_to_int(mem[s0 : s0 + 32]))
+
+
+def op_mstore(compustate, stk, arg):
+    mem = compustate.memory
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, "MSTORE", s0, 32):
+        return vm_exception("OOG EXTENDING MEMORY")
+    mem[s0 : s0 + 32] = utils.encode_int32(s1)
+
+
+def op_mstore8(compustate, stk, arg):
+    mem = compustate.memory
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, "MSTORE8", s0, 1):
+        return vm_exception("OOG EXTENDING MEMORY")
+    mem[s0] = s1 % 256
+
+
+def op_sload(compustate, stk, arg):
+    if not eat_gas(compustate, opcodes.SLOAD_SUPPLEMENTAL_GAS):
+        return vm_exception("OUT OF GAS")
+    stk.append(compustate.ext.get_storage_data(compustate.msg.to, stk.pop()))
+
+
+def op_sstore(compustate, stk, arg):
+    ext, msg = compustate.ext, compustate.msg
+    s0, s1 = stk.pop(), stk.pop()
+    if msg.static:
+        return vm_exception("Cannot SSTORE inside a static context")
+    if ext.get_storage_data(msg.to, s0):
+        gascost = opcodes.GSTORAGEMOD if s1 else opcodes.GSTORAGEKILL
+        refund = 0 if s1 else opcodes.GSTORAGEREFUND
+    else:
+        gascost = opcodes.GSTORAGEADD if s1 else opcodes.GSTORAGEMOD
+        refund = 0
+    if compustate.gas < gascost:
+        return vm_exception("OUT OF GAS")
+    compustate.gas -= gascost
+    # adds neg gascost as a refund if below zero
+    ext.add_refund(refund)
+    ext.set_storage_data(msg.to, s0, s1)
+
+
+def is_jumpdest(compustate, pc):
+    return pc < len(compustate.code) and (
+        compustate.jumpdests[pc >> 3] & (1 << (pc & 7))
+    )
+
+
+def op_jump(compustate, stk, arg):
+    compustate.pc = stk.pop()
+    if not is_jumpdest(compustate, compustate.pc):
+        return vm_exception("BAD JUMPDEST")
+
+
+def op_jumpi(compustate, stk, arg):
+    s0, s1 = stk.pop(), stk.pop()
+    if s1:
+        compustate.pc = s0
+        if not is_jumpdest(compustate, compustate.pc):
+            return vm_exception("BAD JUMPDEST")
+
+
+def op_msize(compustate, stk, arg):
+    stk.append(len(compustate.memory))
+
+
+def op_gas(compustate, stk, arg):
+    stk.append(compustate.gas)  # AFTER subtracting cost 1
+
+
+# DUPn (eg. DUP1: a b c -> a b c c, DUP3: a b c -> a b c a)
+def op_dup(compustate, stk, arg):
+    stk.append(stk[arg])
+
+
+# SWAPn (eg. SWAP1: a b c d -> a b d c, SWAP3: a b c d -> d b c a)
+def op_swap(compustate, stk, arg):
+    temp = stk[arg]
+    stk[arg] = stk[-1]
+    stk[-1] = temp
+
+
+# Logs (aka "events")
+def op_log(compustate, stk, arg):
+    """
+    0xa0 ... 0xa4, 32/64/96/128/160 + len(data) gas
+    a. Opcodes LOG0...LOG4 are added, takes 2-6 stack arguments
+            MEMSTART MEMSZ (TOPIC1) (TOPIC2) (TOPIC3) (TOPIC4)
+    b. Logs are kept track of during tx execution exactly the same way as suicides
+       (except as an ordered list, not a set).
+       Each log is in the form [address, [topic1, ... ], data] where:
+       * address is what the ADDRESS opcode would output
+       * data is mem[MEMSTART: MEMSTART + MEMSZ]
+       * topics are as provided by the opcode
+    c. The ordered list of logs in the transaction are expressed as [log0, log1, ..., logN].
+    """
+    msg, mem = compustate.msg, compustate.memory
+    mstart, msz = stk.pop(), stk.pop()
+    topics = [stk.pop() for x in range(arg)]
+    compustate.gas -= msz * opcodes.GLOGBYTE
+    if msg.static:
+        return vm_exception("Cannot LOG inside a static context")
+    if not mem_extend(mem, compustate, "LOG", mstart, msz):
+        return vm_exception("OOG EXTENDING MEMORY")
+    data = bytearray_to_bytestr(mem[mstart : mstart + msz])
+    compustate.ext.log(msg.to, topics, data)
+    log_log.trace("LOG", to=msg.to, topics=topics, data=list(map(utils.safe_ord, data)))
+
+
+# Create a new contract
+def op_create(compustate, stk, arg):
+    ext, msg, mem = compustate.ext, compustate.msg, compustate.memory
+    value, mstart, msz = stk.pop(), stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, "CREATE", mstart, msz):
+        return vm_exception("OOG EXTENDING MEMORY")
+    if msg.static:
+        return vm_exception("Cannot CREATE inside a static context")
+    if ext.get_balance(msg.to) >= value and msg.depth < MAX_DEPTH:
+        cd = CallData(mem, mstart, msz)
+        ingas = compustate.gas
+        ingas = all_but_1n(ingas, opcodes.CALL_CHILD_LIMIT_DENOM)
+        create_msg = Message(
+            msg.to,
+            b"",
+            value,
+            ingas,
+            cd,
+            msg.depth + 1,
+            to_full_shard_key=msg.from_full_shard_key,
+        )
+        o, gas, data = ext.create(create_msg)
+        if o:
+            stk.append(utils.coerce_to_int(data))
+            compustate.last_returned = bytearray(b"")
+        else:
+            stk.append(0)
+            compustate.last_returned = bytearray(data)
+        compustate.gas = compustate.gas - ingas + gas
+    else:
+        stk.append(0)
+        compustate.last_returned = bytearray(b"")
+
+
+# Calls, the argument is the opcode
+def op_call(compustate, stk, arg):
+    ext, msg, mem = compustate.ext, compustate.msg, compustate.memory
+    # Pull arguments from the stack
+    if arg in (OP_CALL, OP_CALLCODE):
+        gas, to, value, meminstart, meminsz, memoutstart, memoutsz = (
+            stk.pop(),
+            stk.pop(),
+            stk.pop(),
+            stk.pop(),
+            stk.pop(),
+            stk.pop(),
+            stk.pop(),
+        )
+    else:
+        gas, to, meminstart, meminsz, memoutstart, memoutsz = (
+            stk.pop(),
+            stk.pop(),
+            stk.pop(),
+            stk.pop(),
+            stk.pop(),
+            stk.pop(),
+        )
+        value = 0
+    # Static context prohibition
+    if msg.static and value > 0 and arg == OP_CALL:
+        return vm_exception("Cannot make a non-zero-value call inside a static context")
+    # Expand memory
+    if not mem_extend(mem, compustate, "CALL", meminstart, meminsz) or not mem_extend(
+        mem, compustate, "CALL", memoutstart, memoutsz
+    ):
+        return vm_exception("OOG EXTENDING MEMORY")
+    to = utils.int_to_addr(to)
+    # Extra gas costs based on various factors
+    extra_gas = 0
+    # Creating a new account
+    if arg == OP_CALL and not ext.account_exists(to) and (value > 0):
+        extra_gas += opcodes.GCALLNEWACCOUNT
+    # Value transfer
+    if value > 0:
+        extra_gas += opcodes.GCALLVALUETRANSFER
+    # Cost increased from 40 to 700 in Tangerine Whistle
+    extra_gas += opcodes.CALL_SUPPLEMENTAL_GAS
+    # Compute child gas limit
+    if compustate.gas < extra_gas:
+        return vm_exception("OUT OF GAS", needed=extra_gas)
+    gas = min(
+        gas, all_but_1n(compustate.gas - extra_gas, opcodes.CALL_CHILD_LIMIT_DENOM)
+    )
+    submsg_gas = gas + opcodes.GSTIPEND * (value > 0)
+    # Verify that there is sufficient balance and depth
+    if ext.get_balance(msg.to) < value or msg.depth >= MAX_DEPTH:
+        compustate.gas -= gas + extra_gas - submsg_gas
+        stk.append(0)
+        compustate.last_returned = bytearray(b"")
+        return
+    # Subtract gas from parent
+    compustate.gas -= gas + extra_gas
+    assert compustate.gas >= 0
+    cd = CallData(mem, meminstart, meminsz)
+    # Generate the message
+    if arg == OP_CALL:
+        call_msg = Message(
+            msg.to,
+            to,
+            value,
+            submsg_gas,
+            cd,
+            msg.depth + 1,
+            code_address=to,
+            static=msg.static,
+        )
+    elif arg == OP_DELEGATECALL:
+        call_msg = Message(
+            msg.sender,
+            msg.to,
+            msg.value,
+            submsg_gas,
+            cd,
+            msg.depth + 1,
+            code_address=to,
+            transfers_value=False,
+            static=msg.static,
+        )
+    elif arg == OP_STATICCALL:
+        call_msg = Message(
+            msg.to,
+            to,
+            value,
+            submsg_gas,
+            cd,
+            msg.depth + 1,
+            code_address=to,
+            static=True,
+        )
+    elif arg in (OP_DELEGATECALL, OP_STATICCALL):
+        return vm_exception("OPCODE %s INACTIVE" % opcodes.opcodes[arg][0])
+    elif arg == OP_CALLCODE:
+        call_msg = Message(
+            msg.to,
+            msg.to,
+            value,
+            submsg_gas,
+            cd,
+            msg.depth + 1,
+            code_address=to,
+            static=msg.static,
+        )
+    else:
+        raise Exception("Lolwut")
+    # Get result
+    result, gas, data = ext.msg(call_msg)
+    if result == 0:
+        stk.append(0)
+    else:
+        stk.append(1)
+    # Set output memory
+    size = min(len(data), memoutsz)
+    mem[memoutstart : memoutstart + size] = data[:size]
+    compustate.gas += gas
+    compustate.last_returned = bytearray(data)
+
+
+# Return opcode
+def op_return(compustate, stk, arg):
+    mem = compustate.memory
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, "RETURN", s0, s1):
+        return vm_exception("OOG EXTENDING MEMORY")
+    return peaceful_exit("RETURN", compustate.gas, mem[s0 : s0 + s1])
+
+
+# Revert opcode (Metropolis)
+def op_revert(compustate, stk, arg):
+    mem = compustate.memory
+    s0, s1 = stk.pop(), stk.pop()
+    if not mem_extend(mem, compustate, "REVERT", s0, s1):
+        return vm_exception("OOG EXTENDING MEMORY")
+    return revert(compustate.gas, mem[s0 : s0 + s1])
+
+
+# SUICIDE opcode (also called SELFDESTRUCT)
+def op_suicide(compustate, stk, arg):
+    ext, msg = compustate.ext, compustate.msg
+    if msg.static:
+        return vm_exception("Cannot SUICIDE inside a static context")
+    to = utils.encode_int(stk.pop())
+    to = ((b"\x00" * (32 - len(to))) + to)[12:]
+    xfer = ext.get_balance(msg.to)
+    extra_gas = (
+        opcodes.SUICIDE_SUPPLEMENTAL_GAS
+        + (not ext.account_exists(to)) * (xfer > 0) * opcodes.GCALLNEWACCOUNT
+    )
+    if not eat_gas(compustate, extra_gas):
+        return vm_exception("OUT OF GAS")
+    ext.set_balance(to, ext.get_balance(to) + xfer)
+    ext.set_balance(msg.to, 0)
+    ext.add_suicide(msg.to)
+    log_msg.debug(
+        "SUICIDING",
+        addr=utils.checksum_encode(msg.to),
+        to=utils.checksum_encode(to),
+        xferring=xfer,
+    )
+    return peaceful_exit("SUICIDED", compustate.gas, [])
+
+
+OP_CODESIZE = 0x38
+OP_PC = 0x58
+OP_JUMPDEST = 0x5B
+OP_CALL = 0xF1
+OP_CALLCODE = 0xF2
+OP_DELEGATECALL = 0xF4
+OP_CALLBLACKBOX = 0xF5
+OP_STATICCALL = 0xFA
+
+# (handler, argument) of each opcode, indexed by opcode. PUSHn, PC and
+# CODESIZE are pushes of values known when analyzing the code
+OPCODE_HANDLERS = [(op_invalid, opcode) for opcode in range(256)]
+for opcode, handler in [
+    (0x00, op_stop),
+    (0x01, op_add),
+    (0x02, op_mul),
+    (0x03, op_sub),
+    (0x04, op_div),
+    (0x05, op_sdiv),
+    (0x06, op_mod),
+    (0x07, op_smod),
+    (0x08, op_addmod),
+    (0x09, op_mulmod),
+    (0x0A, op_exp),
+    (0x0B, op_signextend),
+    (0x10, op_lt),
+    (0x11, op_gt),
+    (0x12, op_slt),
+    (0x13, op_sgt),
+    (0x14, op_eq),
+    (0x15, op_iszero),
+    (0x16, op_and),
+    (0x17, op_or),
+    (0x18, op_xor),
+    (0x19, op_not),
+    (0x1A, op_byte),
+    (0x20, op_sha3),
+    (0x30, op_address),
+    (0x31, op_balance),
+    (0x32, op_origin),
+    (0x33, op_caller),
+    (0x34, op_callvalue),
+    (0x35, op_calldataload),
+    (0x36, op_calldatasize),
+    (0x37, op_calldatacopy),
+    (0x39, op_codecopy),
+    (0x3A, op_gasprice),
+    (0x3B, op_extcodesize),
+    (0x3C, op_extcodecopy),
+    (0x3D, op_returndatasize),
+    (0x3E, op_returndatacopy),
+    (0x40, op_blockhash),
+    (0x41, op_coinbase),
+    (0x42, op_timestamp),
+    (0x43, op_number),
+    (0x44, op_difficulty),
+    (0x45, op_gaslimit),
+    (0x50, op_pop),
+    (0x51, op_mload),
+    (0x52, op_mstore),
+    (0x53, op_mstore8),
+    (0x54, op_sload),
+    (0x55, op_sstore),
+    (0x56, op_jump),
+    (0x57, op_jumpi),
+    (0x59, op_msize),
+    (0x5A, op_gas),
+    (OP_JUMPDEST, op_noop),
+    (0xF0, op_create),
+    (0xF3, op_return),
+    (0xFD, op_revert),
+    (0xFF, op_suicide),
+    # no behavior defined yet
+    (OP_CALLBLACKBOX, op_noop),
+]:
+    OPCODE_HANDLERS[opcode] = (handler, None)
+for opcode in range(0x80, 0x90):
+    # 0x7f - opcode is a negative number, -1 for 0x80 ... -16 for 0x8f
+    OPCODE_HANDLERS[opcode] = (op_dup, 0x7F - opcode)
+for opcode in range(0x90, 0xA0):
+    # 0x8e - opcode is a negative number, -2 for 0x90 ... -17 for 0x9f
+    OPCODE_HANDLERS[opcode] = (op_swap, 0x8E - opcode)
+for opcode in range(0xA0, 0xA5):
+    OPCODE_HANDLERS[opcode] = (op_log, opcode - 0xA0)
+for opcode in (OP_CALL, OP_CALLCODE, OP_DELEGATECALL, OP_STATICCALL):
+    OPCODE_HANDLERS[opcode] = (op_call, opcode)
+
+# Opcodes ending a basic block: the ones changing the control flow or halting,
+# the ones reading the remaining gas (GAS, CREATE and CALLs), LOGs as they do
+# not check their data fee, and CALLBLACKBOX as it does not touch the stack
+BLOCK_END_OPCODES = {
+    0x00,
+    0x56,
+    0x57,
+    0x5A,
+    0xA0,
+    0xA1,
+    0xA2,
+    0xA3,
+    0xA4,
+    0xF0,
+    OP_CALL,
+    OP_CALLCODE,
+    0xF3,
+    OP_DELEGATECALL,
+    OP_CALLBLACKBOX,
+    OP_STATICCALL,
+    0xFD,
+    0xFF,
+}
+
+
+# JUMPDESTs and the first bytes of PUSHn, so that pushdata is skipped over
+JUMPDEST_OR_PUSH = re.compile(rb"[\x5b\x60-\x7f]")
+
+
+# Preprocesses code, and determines which locations are in the middle
+# of pushdata and thus invalid. Returns a bitset of the valid JUMPDESTs and a
+# pc -> basic block dict filled by get_block as the execution reaches blocks
+def preprocess_code(code):
+    jumpdests = bytearray((len(code) + 7) // 8)
+    i = 0
+    for match in JUMPDEST_OR_PUSH.finditer(code):
+        pos = match.start()
+        if pos < i:
+            # in pushdata
+            continue
+        codebyte = code[pos]
+        if codebyte == 0x5B:
+            jumpdests[pos >> 3] |= 1 << (pos & 7)
+            i = pos + 1
+        else:
+            i = pos + codebyte - 0x5E
+    return bytes(jumpdests), {}
+
+
+# Preprocessed code keyed by code hash, least recently used first. It is shared
+# by all the states of the process, and bounded by the total size of the code
+class CodeCache:
+    def __init__(self, max_code_size):
+        self.max_code_size = max_code_size
+        self.code_size = 0
+        # code hash -> (jumpdests, blocks, code size)
+        self.cache = OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def get(self, code_hash, code):
+        entry = self.cache.get(code_hash, None)
+        if entry is not None:
+            self.hit_count += 1
+            self.cache.move_to_end(code_hash)
+            return entry[0], entry[1]
+
+        self.miss_count += 1
+        jumpdests, blocks = preprocess_code(code)
+        self.cache[code_hash] = (jumpdests, blocks, len(code))
+        self.code_size += len(code)
+        while self.code_size > self.max_code_size:
+            _, (_, _, size) = self.cache.popitem(last=False)
+            self.code_size -= size
+        return jumpdests, blocks
+
+    def clear(self):
+        self.cache.clear()
+        self.code_size = 0
+
+    def get_stats(self):
+        return {
+            "size": len(self.cache),
+            "codeSize": self.code_size,
+            "maxCodeSize": self.max_code_size,
+            "hitCount": self.hit_count,
+            "missCount": self.miss_count,
+        }
+
+
+# Bytes of code whose analysis is kept, the basic blocks of a code take a few
+# hundred times its size once all of them are run
+CODE_CACHE_SIZE = 1024 * 1024
+code_cache = CodeCache(CODE_CACHE_SIZE)
+
+
+# Returns the basic block starting at pc, which is 0, a JUMPDEST or right
+# after the end of another block.
+#
+# A block is (static gas, stack items needed, max stack growth, instructions,
+# (pc, handler, argument) of every instruction, pc of the next block), where
+# instructions are (handler, argument) with None as the handler of pushes.
+# The static gas and the stack bounds are checked once for a whole block: an
+# exception halts the VM with the same result no matter which instruction of
+# the block raises it, and no instruction before the end of a block can
+# observe the gas left or halt without an exception.
+def get_block(code, blocks, pc):
+    block = blocks.get(pc, None)
+    if block is not None:
+        return block
+
+    start = pc
+    codelen = len(code)
+    fee = needed = growth = height = 0
+    instructions = []
+    trace_instructions = []
+    while pc < codelen:
+        opcode = safe_ord(code[pc])
+        if opcode == OP_JUMPDEST and pc != start:
+            break
+        handler, arg = OPCODE_HANDLERS[opcode]
+        if 0x60 <= opcode <= 0x7F:
+            data = code[pc + 1 : pc + opcode - 0x5E]
+            data += b"\x00" * (opcode - 0x5F - len(data))
+            handler, arg = None, utils.big_endian_to_int(data)
+        elif opcode == OP_PC:
+            handler, arg = None, pc
+        elif opcode == OP_CODESIZE:
+            handler, arg = None, codelen
+        trace_instructions.append((pc, handler, arg))
+        if handler is not op_noop:
+            instructions.append((handler, arg))
+        # Move 1 byte forward for 0x60, up to 32 bytes for 0x7f
+        pc += opcode - 0x5E if 0x60 <= opcode <= 0x7F else 1
+        if opcode not in opcodes.opcodes:
+            break
+        in_args, out_args, op_fee = opcodes.opcodes[opcode][1:]
+        fee += op_fee
+        needed = max(needed, in_args - height)
+        height += out_args - in_args
+        growth = max(growth, height)
+        if opcode in BLOCK_END_OPCODES:
+            break
+
+    block = (fee, needed, growth, tuple(instructions), tuple(trace_instructions), pc)
+    blocks[start] = block
+    return block
+
+
 # Main function
-def vm_execute(ext, msg, code):
+def vm_execute(ext, msg, code, code_hash=None):
 
     # precompute trace flag
     # if we trace vm, we're in slow mode anyway
     trace_vm = log_vm_op.is_active("trace")
 
+    # Compute, code without a hash (e.g. init code) is run once
+    if code_hash is None:
+        jumpdests, blocks = preprocess_code(code)
+    else:
+        jumpdests, blocks = code_cache.get(code_hash, code)
+    codelen = len(code)
+
     # Initialize stack, memory, program counter, etc
-    compustate = Compustate(gas=msg.gas)
+    compustate = Compustate(
+        gas=msg.gas, ext=ext, msg=msg, code=code, jumpdests=jumpdests
+    )
     stk = compustate.stack
-    mem = compustate.memory
 
-    # Compute
-    jumpdest_mask, pushcache = preprocess_code(code)
+    if trace_vm:
+        return vm_execute_traced(compustate, blocks)
+
+    while compustate.pc < codelen:
+        fee, needed, growth, instructions, _, compustate.pc = get_block(
+            code, blocks, compustate.pc
+        )
+        compustate.gas -= fee
+
+        # out of gas error
+        if compustate.gas < 0:
+            return vm_exception("OUT OF GAS")
+
+        # empty stack error
+        if needed > len(stk):
+            return vm_exception(
+                "INSUFFICIENT STACK",
+                needed=to_string(needed),
+                available=to_string(len(stk)),
+            )
+
+        # overfull stack error
+        if len(stk) + growth > 1024:
+            return vm_exception(
+                "STACK SIZE LIMIT EXCEEDED", pre_height=to_string(len(stk))
+            )
+
+        for handler, arg in instructions:
+            # Pushes first because they are very frequent
+            if handler is None:
+                stk.append(arg)
+                continue
+            result = handler(compustate, stk, arg)
+            if result is not None:
+                return result
+
+    return peaceful_exit("CODE OUT OF RANGE", compustate.gas, [])
+
+
+# Executes the code one instruction after another, checking the gas and the
+# stack of each instruction and tracing it
+def vm_execute_traced(compustate, blocks):
+    ext, msg, code = compustate.ext, compustate.msg, compustate.code
+    stk = compustate.stack
     codelen = len(code)
 
     # For tracing purposes
@@ -293,23 +1160,26 @@ def vm_execute(ext, msg, code):
     _prevop = None
     steps = 0
     while compustate.pc < codelen:
+        trace_instructions, next_pc = get_block(code, blocks, compustate.pc)[4:]
+        for i, (pc, handler, arg) in enumerate(trace_instructions):
+            opcode = safe_ord(code[pc])
 
-        opcode = safe_ord(code[compustate.pc])
-
-        # Invalid operation
-        if opcode not in opcodes.opcodes:
-            return vm_exception("INVALID OP", opcode=opcode)
+            # Invalid operation
+            if opcode not in opcodes.opcodes:
+                return vm_exception("INVALID OP", opcode=opcode)
 
-        op, in_args, out_args, fee = opcodes.opcodes[opcode]
+            op, in_args, out_args, fee = opcodes.opcodes[opcode]
 
-        # Apply operation
-        if trace_vm:
+            # Apply operation
+            compustate.pc = pc
             compustate.reset_prev()
-        compustate.gas -= fee
-        compustate.pc += 1
+            compustate.gas -= fee
+            if i + 1 < len(trace_instructions):
+                compustate.pc = trace_instructions[i + 1][0]
+            else:
+                compustate.pc = next_pc
 
-        # Tracing
-        if trace_vm:
+            # Tracing
             """
             This diverges from normal logging, as we use the logging namespace
             only to decide which features get logged in 'eth.vm.op'
@@ -342,524 +1212,50 @@ def vm_execute(ext, msg, code):
                 trace_data["storage"] = ext.log_storage(msg.to)
             trace_data["gas"] = to_string(compustate.gas + fee)
             trace_data["inst"] = opcode
-            trace_data["pc"] = to_string(compustate.pc - 1)
+            trace_data["pc"] = to_string(pc)
             if steps == 0:
                 trace_data["depth"] = msg.depth
                 trace_data["address"] = msg.to
             trace_data["steps"] = steps
             trace_data["depth"] = msg.depth
             if op[:4] == "PUSH":
-                trace_data["pushvalue"] = pushcache[compustate.pc - 1]
+                trace_data["pushvalue"] = arg
             log_vm_op.trace("vm", op=op, **trace_data)
             steps += 1
             _prevop = op
 
-        # out of gas error
-        if compustate.gas < 0:
-            return vm_exception("OUT OF GAS")
-
-        # empty stack error
-        if in_args > len(compustate.stack):
-            return vm_exception(
-                "INSUFFICIENT STACK",
-                op=op,
-                needed=to_string(in_args),
-                available=to_string(len(compustate.stack)),
-            )
-
-        # overfull stack error
-        if len(compustate.stack) - in_args + out_args > 1024:
-            return vm_exception(
-                "STACK SIZE LIMIT EXCEEDED",
-                op=op,
-                pre_height=to_string(len(compustate.stack)),
-            )
+            # out of gas error
+            if compustate.gas < 0:
+                return vm_exception("OUT OF GAS")
 
-        # Valid operations
-        # Pushes first because they are very frequent
-        if 0x60 <= opcode <= 0x7F:
-            stk.append(pushcache[compustate.pc - 1])
-            # Move 1 byte forward for 0x60, up to 32 bytes for 0x7f
-            compustate.pc += opcode - 0x5F
-        # Arithmetic
-        elif opcode < 0x10:
-            if op == "STOP":
-                return peaceful_exit("STOP", compustate.gas, [])
-            elif op == "ADD":
-                stk.append((stk.pop() + stk.pop()) & TT256M1)
-            elif op == "SUB":
-                stk.append((stk.pop() - stk.pop()) & TT256M1)
-            elif op == "MUL":
-                stk.append((stk.pop() * stk.pop()) & TT256M1)
-            elif op == "DIV":
-                s0, s1 = stk.pop(), stk.pop()
-                stk.append(0 if s1 == 0 else s0 // s1)
-            elif op == "MOD":
-                s0, s1 = stk.pop(), stk.pop()
-                stk.append(0 if s1 == 0 else s0 % s1)
-            elif op == "SDIV":
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(
-                    0
-                    if s1 == 0
-                    else (abs(s0) // abs(s1) * (-1 if s0 * s1 < 0 else 1)) & TT256M1
-                )
-            elif op == "SMOD":
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(
-                    0
-                    if s1 == 0
-                    else (abs(s0) % abs(s1) * (-1 if s0 < 0 else 1)) & TT256M1
-                )
-            elif op == "ADDMOD":
-                s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
-                stk.append((s0 + s1) % s2 if s2 else 0)
-            elif op == "MULMOD":
-                s0, s1, s2 = stk.pop(), stk.pop(), stk.pop()
-                stk.append((s0 * s1) % s2 if s2 else 0)
-            elif op == "EXP":
-                base, exponent = stk.pop(), stk.pop()
-                # fee for exponent is dependent on its bytes
-                # calc n bytes to represent exponent
-                nbytes = len(utils.encode_int(exponent))
-                expfee = nbytes * opcodes.GEXPONENTBYTE
-                expfee += opcodes.EXP_SUPPLEMENTAL_GAS * nbytes
-                if compustate.gas < expfee:
-                    compustate.gas = 0
-                    return vm_exception("OOG EXPONENT")
-                compustate.gas -= expfee
-                stk.append(pow(base, exponent, TT256))
-            elif op == "SIGNEXTEND":
-                s0, s1 = stk.pop(), stk.pop()
-                if s0 <= 31:
-                    testbit = s0 * 8 + 7
-                    if s1 & (1 << testbit):
-                        stk.append(s1 | (TT256 - (1 << testbit)))
-                    else:
-                        stk.append(s1 & ((1 << testbit) - 1))
-                else:
-                    stk.append(s1)
-        # Comparisons
-        elif opcode < 0x20:
-            if op == "LT":
-                stk.append(1 if stk.pop() < stk.pop() else 0)
-            elif op == "GT":
-                stk.append(1 if stk.pop() > stk.pop() else 0)
-            elif op == "SLT":
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(1 if s0 < s1 else 0)
-            elif op == "SGT":
-                s0, s1 = utils.to_signed(stk.pop()), utils.to_signed(stk.pop())
-                stk.append(1 if s0 > s1 else 0)
-            elif op == "EQ":
-                stk.append(1 if stk.pop() == stk.pop() else 0)
-            elif op == "ISZERO":
-                stk.append(0 if stk.pop() else 1)
-            elif op == "AND":
-                stk.append(stk.pop() & stk.pop())
-            elif op == "OR":
-                stk.append(stk.pop() | stk.pop())
-            elif op == "XOR":
-                stk.append(stk.pop() ^ stk.pop())
-            elif op == "NOT":
-                stk.append(TT256M1 - stk.pop())
-            elif op == "BYTE":
-                s0, s1 = stk.pop(), stk.pop()
-                if s0 >= 32:
-                    stk.append(0)
-                else:
-                    stk.append((s1 // 256 ** (31 - s0)) % 256)
-        # SHA3 and environment info
-        elif opcode < 0x40:
-            if op == "SHA3":
-                s0, s1 = stk.pop(), stk.pop()
-                compustate.gas -= opcodes.GSHA3WORD * (utils.ceil32(s1) // 32)
-                if compustate.gas < 0:
-                    return vm_exception("OOG PAYING FOR SHA3")
-                if not mem_extend(mem, compustate, op, s0, s1):
-                    return vm_exception("OOG EXTENDING MEMORY")
-                data = bytearray_to_bytestr(mem[s0 : s0 + s1])
-                stk.append(utils.big_endian_to_int(utils.sha3(data)))
-            elif op == "ADDRESS":
-                stk.append(utils.coerce_to_int(msg.to))
-            elif op == "BALANCE":
-                if not eat_gas(compustate, opcodes.BALANCE_SUPPLEMENTAL_GAS):
-                    return vm_exception("OUT OF GAS")
-                addr = utils.coerce_addr_to_hex(stk.pop() % 2 ** 160)
-                stk.append(ext.get_balance(addr))
-            elif op == "ORIGIN":
-                stk.append(utils.coerce_to_int(ext.tx_origin))
-            elif op == "CALLER":
-                stk.append(utils.coerce_to_int(msg.sender))
-            elif op == "CALLVALUE":
-                stk.append(msg.value)
-            elif op == "CALLDATALOAD":
-                stk.append(msg.data.extract32(stk.pop()))
-            elif op == "CALLDATASIZE":
-                stk.append(msg.data.size)
-            elif op == "CALLDATACOPY":
-                mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, mstart, size):
-                    return vm_exception("OOG EXTENDING MEMORY")
-                if not data_copy(compustate, size):
-                    return vm_exception("OOG COPY DATA")
-                msg.data.extract_copy(mem, mstart, dstart, size)
-            elif op == "CODESIZE":
-                stk.append(codelen)
-            elif op == "CODECOPY":
-                mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, mstart, size):
-                    return vm_exception("OOG EXTENDING MEMORY")
-                if not data_copy(compustate, size):
-                    return vm_exception("OOG COPY DATA")
-                for i in range(size):
-                    if dstart + i < codelen:
-                        mem[mstart + i] = safe_ord(code[dstart + i])
-                    else:
-                        mem[mstart + i] = 0
-            elif op == "RETURNDATACOPY":
-                mstart, dstart, size = stk.pop(), stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, mstart, size):
-                    return vm_exception("OOG EXTENDING MEMORY")
-                if not data_copy(compustate, size):
-                    return vm_exception("OOG COPY DATA")
-                if dstart + size > len(compustate.last_returned):
-                    return vm_exception("RETURNDATACOPY out of range")
-                mem[mstart : mstart + size] = compustate.last_returned[
-                    dstart : dstart + size
-                ]
-            elif op == "RETURNDATASIZE":
-                stk.append(len(compustate.last_returned))
-            elif op == "GASPRICE":
-                stk.append(ext.tx_gasprice)
-            elif op == "EXTCODESIZE":
-                if not eat_gas(compustate, opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS):
-                    return vm_exception("OUT OF GAS")
-                addr = utils.coerce_addr_to_hex(stk.pop() % 2 ** 160)
-                stk.append(len(ext.get_code(addr) or b""))
-            elif op == "EXTCODECOPY":
-                if not eat_gas(compustate, opcodes.EXTCODELOAD_SUPPLEMENTAL_GAS):
-                    return vm_exception("OUT OF GAS")
-                addr = utils.coerce_addr_to_hex(stk.pop() % 2 ** 160)
-                start, s2, size = stk.pop(), stk.pop(), stk.pop()
-                extcode = ext.get_code(addr) or b""
-                assert utils.is_string(extcode)
-                if not mem_extend(mem, compustate, op, start, size):
-                    return vm_exception("OOG EXTENDING MEMORY")
-                if not data_copy(compustate, size):
-                    return vm_exception("OOG COPY DATA")
-                for i in range(size):
-                    if s2 + i < len(extcode):
-                        mem[start + i] = safe_ord(extcode[s2 + i])
-                    else:
-                        mem[start + i] = 0
-        # Block info
-        elif opcode < 0x50:
-            if op == "BLOCKHASH":
-                stk.append(utils.big_endian_to_int(ext.block_hash(stk.pop())))
-            elif op == "COINBASE":
-                stk.append(utils.big_endian_to_int(ext.block_coinbase))
-            elif op == "TIMESTAMP":
-                stk.append(ext.block_timestamp)
-            elif op == "NUMBER":
-                stk.append(ext.block_number)
-            elif op == "DIFFICULTY":
-                stk.append(ext.block_difficulty)
-            elif op == "GASLIMIT":
-                stk.append(ext.block_gas_limit)
-        # VM state manipulations
-        elif opcode < 0x60:
-            if op == "POP":
-                stk.pop()
-            elif op == "MLOAD":
-                s0 = stk.pop()
-                if not mem_extend(mem, compustate, op, s0, 32):
-                    return vm_exception("OOG EXTENDING MEMORY")
-                stk.append(utils.bytes_to_int(mem[s0 : s0 + 32]))
-            elif op == "MSTORE":
-                s0, s1 = stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, s0, 32):
-                    return vm_exception("OOG EXTENDING MEMORY")
-                mem[s0 : s0 + 32] = utils.encode_int32(s1)
-            elif op == "MSTORE8":
-                s0, s1 = stk.pop(), stk.pop()
-                if not mem_extend(mem, compustate, op, s0, 1):
-                    return vm_exception("OOG EXTENDING MEMORY")
-                mem[s0] = s1 % 256
-            elif op == "SLOAD":
-                if not eat_gas(compustate, opcodes.SLOAD_SUPPLEMENTAL_GAS):
-                    return vm_exception("OUT OF GAS")
-                stk.append(ext.get_storage_data(msg.to, stk.pop()))
-            elif op == "SSTORE":
-                s0, s1 = stk.pop(), stk.pop()
-                if msg.static:
-                    return vm_exception("Cannot SSTORE inside a static context")
-                if ext.get_storage_data(msg.to, s0):
-                    gascost = opcodes.GSTORAGEMOD if s1 else opcodes.GSTORAGEKILL
-                    refund = 0 if s1 else opcodes.GSTORAGEREFUND
-                else:
-                    gascost = opcodes.GSTORAGEADD if s1 else opcodes.GSTORAGEMOD
-                    refund = 0
-                if compustate.gas < gascost:
-                    return vm_exception("OUT OF GAS")
-                compustate.gas -= gascost
-                # adds neg gascost as a refund if below zero
-                ext.add_refund(refund)
-                ext.set_storage_data(msg.to, s0, s1)
-            elif op == "JUMP":
-                compustate.pc = stk.pop()
-                if compustate.pc >= codelen or not (
-                    (1 << compustate.pc) & jumpdest_mask
-                ):
-                    return vm_exception("BAD JUMPDEST")
-            elif op == "JUMPI":
-                s0, s1 = stk.pop(), stk.pop()
-                if s1:
-                    compustate.pc = s0
-                    if compustate.pc >= codelen or not (
-                        (1 << compustate.pc) & jumpdest_mask
-                    ):
-                        return vm_exception("BAD JUMPDEST")
-            elif op == "PC":
-                stk.append(compustate.pc - 1)
-            elif op == "MSIZE":
-                stk.append(len(mem))
-            elif op == "GAS":
-                stk.append(compustate.gas)  # AFTER subtracting cost 1
-        # DUPn (eg. DUP1: a b c -> a b c c, DUP3: a b c -> a b c a)
-        elif op[:3] == "DUP":
-            # 0x7f - opcode is a negative number, -1 for 0x80 ... -16 for 0x8f
-            stk.append(stk[0x7F - opcode])
-        # SWAPn (eg. SWAP1: a b c d -> a b d c, SWAP3: a b c d -> d b c a)
-        elif op[:4] == "SWAP":
-            # 0x8e - opcode is a negative number, -2 for 0x90 ... -17 for 0x9f
-            temp = stk[0x8E - opcode]
-            stk[0x8E - opcode] = stk[-1]
-            stk[-1] = temp
-        # Logs (aka "events")
-        elif op[:3] == "LOG":
-            """
-            0xa0 ... 0xa4, 32/64/96/128/160 + len(data) gas
-            a. Opcodes LOG0...LOG4 are added, takes 2-6 stack arguments
-                    MEMSTART MEMSZ (TOPIC1) (TOPIC2) (TOPIC3) (TOPIC4)
-            b. Logs are kept track of during tx execution exactly the same way as suicides
-               (except as an ordered list, not a set).
-               Each log is in the form [address, [topic1, ... ], data] where:
-               * address is what the ADDRESS opcode would output
-               * data is mem[MEMSTART: MEMSTART + MEMSZ]
-               * topics are as provided by the opcode
-            c. The ordered list of logs in the transaction are expressed as [log0, log1, ..., logN].
-            """
-            depth = int(op[3:])
-            mstart, msz = stk.pop(), stk.pop()
-            topics = [stk.pop() for x in range(depth)]
-            compustate.gas -= msz * opcodes.GLOGBYTE
-            if msg.static:
-                return vm_exception("Cannot LOG inside a static context")
-            if not mem_extend(mem, compustate, op, mstart, msz):
-                return vm_exception("OOG EXTENDING MEMORY")
-            data = bytearray_to_bytestr(mem[mstart : mstart + msz])
-            ext.log(msg.to, topics, data)
-            log_log.trace(
-                "LOG", to=msg.to, topics=topics, data=list(map(utils.safe_ord, data))
-            )
-            # print('LOG', msg.to, topics, list(map(ord, data)))
-        # Create a new contract
-        elif op == "CREATE":
-            value, mstart, msz = stk.pop(), stk.pop(), stk.pop()
-            if not mem_extend(mem, compustate, op, mstart, msz):
-                return vm_exception("OOG EXTENDING MEMORY")
-            if msg.static:
-                return vm_exception("Cannot CREATE inside a static context")
-            if ext.get_balance(msg.to) >= value and msg.depth < MAX_DEPTH:
-                cd = CallData(mem, mstart, msz)
-                ingas = compustate.gas
-                ingas = all_but_1n(ingas, opcodes.CALL_CHILD_LIMIT_DENOM)
-                create_msg = Message(
-                    msg.to,
-                    b"",
-                    value,
-                    ingas,
-                    cd,
-                    msg.depth + 1,
-                    to_full_shard_key=msg.from_full_shard_key,
-                )
-                o, gas, data = ext.create(create_msg)
-                if o:
-                    stk.append(utils.coerce_to_int(data))
-                    compustate.last_returned = bytearray(b"")
-                else:
-                    stk.append(0)
-                    compustate.last_returned = bytearray(data)
-                compustate.gas = compustate.gas - ingas + gas
-            else:
-                stk.append(0)
-                compustate.last_returned = bytearray(b"")
-        # Calls
-        elif op in ("CALL", "CALLCODE", "DELEGATECALL", "STATICCALL"):
-            # Pull arguments from the stack
-            if op in ("CALL", "CALLCODE"):
-                gas, to, value, meminstart, meminsz, memoutstart, memoutsz = (
-                    stk.pop(),
-                    stk.pop(),
-                    stk.pop(),
-                    stk.pop(),
-                    stk.pop(),
-                    stk.pop(),
-                    stk.pop(),
-                )
-            else:
-                gas, to, meminstart, meminsz, memoutstart, memoutsz = (
-                    stk.pop(),
-                    stk.pop(),
-                    stk.pop(),
-                    stk.pop(),
-                    stk.pop(),
-                    stk.pop(),
+            # empty stack error
+            if in_args > len(compustate.stack):
+                return vm_exception(
+                    "INSUFFICIENT STACK",
+                    op=op,
+                    needed=to_string(in_args),
+                    available=to_string(len(compustate.stack)),
                 )
-                value = 0
-            # Static context prohibition
-            if msg.static and value > 0 and op == "CALL":
+
+            # overfull stack error
+            if len(compustate.stack) - in_args + out_args > 1024:
                 return vm_exception(
-                    "Cannot make a non-zero-value call inside a static context"
+                    "STACK SIZE LIMIT EXCEEDED",
+                    op=op,
+                    pre_height=to_string(len(compustate.stack)),
                 )
-            # Expand memory
-            if not mem_extend(
-                mem, compustate, op, meminstart, meminsz
-            ) or not mem_extend(mem, compustate, op, memoutstart, memoutsz):
-                return vm_exception("OOG EXTENDING MEMORY")
-            to = utils.int_to_addr(to)
-            # Extra gas costs based on various factors
-            extra_gas = 0
-            # Creating a new account
-            if op == "CALL" and not ext.account_exists(to) and (value > 0):
-                extra_gas += opcodes.GCALLNEWACCOUNT
-            # Value transfer
-            if value > 0:
-                extra_gas += opcodes.GCALLVALUETRANSFER
-            # Cost increased from 40 to 700 in Tangerine Whistle
-            extra_gas += opcodes.CALL_SUPPLEMENTAL_GAS
-            # Compute child gas limit
-            if compustate.gas < extra_gas:
-                return vm_exception("OUT OF GAS", needed=extra_gas)
-            gas = min(
-                gas,
-                all_but_1n(compustate.gas - extra_gas, opcodes.CALL_CHILD_LIMIT_DENOM),
-            )
-            submsg_gas = gas + opcodes.GSTIPEND * (value > 0)
-            # Verify that there is sufficient balance and depth
-            if ext.get_balance(msg.to) < value or msg.depth >= MAX_DEPTH:
-                compustate.gas -= gas + extra_gas - submsg_gas
-                stk.append(0)
-                compustate.last_returned = bytearray(b"")
+
+            if handler is None:
+                stk.append(arg)
             else:
-                # Subtract gas from parent
-                compustate.gas -= gas + extra_gas
-                assert compustate.gas >= 0
-                cd = CallData(mem, meminstart, meminsz)
-                # Generate the message
-                if op == "CALL":
-                    call_msg = Message(
-                        msg.to,
-                        to,
-                        value,
-                        submsg_gas,
-                        cd,
-                        msg.depth + 1,
-                        code_address=to,
-                        static=msg.static,
-                    )
-                elif op == "DELEGATECALL":
-                    call_msg = Message(
-                        msg.sender,
-                        msg.to,
-                        msg.value,
-                        submsg_gas,
-                        cd,
-                        msg.depth + 1,
-                        code_address=to,
-                        transfers_value=False,
-                        static=msg.static,
-                    )
-                elif op == "STATICCALL":
-                    call_msg = Message(
-                        msg.to,
-                        to,
-                        value,
-                        submsg_gas,
-                        cd,
-                        msg.depth + 1,
-                        code_address=to,
-                        static=True,
-                    )
-                elif op in ("DELEGATECALL", "STATICCALL"):
-                    return vm_exception("OPCODE %s INACTIVE" % op)
-                elif op == "CALLCODE":
-                    call_msg = Message(
-                        msg.to,
-                        msg.to,
-                        value,
-                        submsg_gas,
-                        cd,
-                        msg.depth + 1,
-                        code_address=to,
-                        static=msg.static,
-                    )
-                else:
-                    raise Exception("Lolwut")
-                # Get result
-                result, gas, data = ext.msg(call_msg)
-                if result == 0:
-                    stk.append(0)
-                else:
-                    stk.append(1)
-                # Set output memory
-                for i in range(min(len(data), memoutsz)):
-                    mem[memoutstart + i] = data[i]
-                compustate.gas += gas
-                compustate.last_returned = bytearray(data)
-        # Return opcode
-        elif op == "RETURN":
-            s0, s1 = stk.pop(), stk.pop()
-            if not mem_extend(mem, compustate, op, s0, s1):
-                return vm_exception("OOG EXTENDING MEMORY")
-            return peaceful_exit("RETURN", compustate.gas, mem[s0 : s0 + s1])
-        # Revert opcode (Metropolis)
-        elif op == "REVERT":
-            s0, s1 = stk.pop(), stk.pop()
-            if not mem_extend(mem, compustate, op, s0, s1):
-                return vm_exception("OOG EXTENDING MEMORY")
-            return revert(compustate.gas, mem[s0 : s0 + s1])
-        # SUICIDE opcode (also called SELFDESTRUCT)
-        elif op == "SUICIDE":
-            if msg.static:
-                return vm_exception("Cannot SUICIDE inside a static context")
-            to = utils.encode_int(stk.pop())
-            to = ((b"\x00" * (32 - len(to))) + to)[12:]
-            xfer = ext.get_balance(msg.to)
-            extra_gas = (
-                opcodes.SUICIDE_SUPPLEMENTAL_GAS
-                + (not ext.account_exists(to)) * (xfer > 0) * opcodes.GCALLNEWACCOUNT
-            )
-            if not eat_gas(compustate, extra_gas):
-                return vm_exception("OUT OF GAS")
-            ext.set_balance(to, ext.get_balance(to) + xfer)
-            ext.set_balance(msg.to, 0)
-            ext.add_suicide(msg.to)
-            log_msg.debug(
-                "SUICIDING",
-                addr=utils.checksum_encode(msg.to),
-                to=utils.checksum_encode(to),
-                xferring=xfer,
-            )
-            return peaceful_exit("SUICIDED", compustate.gas, [])
+                result = handler(compustate, stk, arg)
+                if result is not None:
+                    return result
 
-        if trace_vm:
-            vm_trace(ext, msg, compustate, opcode, pushcache)
+            vm_trace(ext, msg, compustate, opcode, {pc: arg})
 
-    if trace_vm:
-        compustate.reset_prev()
-        vm_trace(ext, msg, compustate, 0, None)
+    compustate.reset_prev()
+    vm_trace(ext, msg, compustate, 0, None)
     return peaceful_exit("CODE OUT OF RANGE", compustate.gas, [])
 
 
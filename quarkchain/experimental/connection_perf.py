@@ -0,0 +1,185 @@
+# Throughput of cluster connections over loopback TCP
+#
+# Measures RPC round trips and payload bandwidth of the framing layer in
+# quarkchain.protocol.Connection with the payloads that dominate
+# intra-cluster traffic:
+# - master -> slave: AddRootBlockRequest carrying minor block headers
+# - slave -> slave: AddXshardTxListRequest carrying x-shard deposits
+
+import argparse
+import asyncio
+import profile
+import time
+
+from quarkchain.cluster.protocol import ClusterConnection, ClusterMetadata
+from quarkchain.cluster.rpc import (
+    AddRootBlockRequest,
+    AddRootBlockResponse,
+    AddXshardTxListRequest,
+    AddXshardTxListResponse,
+    ClusterOp,
+    CLUSTER_OP_SERIALIZER_MAP,
+)
+from quarkchain.core import (
+    Address,
+    Branch,
+    CrossShardTransactionDeposit,
+    CrossShardTransactionList,
+    MinorBlockHeader,
+    RootBlock,
+    RootBlockHeader,
+)
+from quarkchain.env import DEFAULT_ENV
+from quarkchain.protocol import Connection
+
+
+async def handle_add_root_block_request(conn, req):
+    return AddRootBlockResponse(error_code=0, switched=False)
+
+
+async def handle_add_xshard_tx_list_request(conn, req):
+    return AddXshardTxListResponse(error_code=0)
+
+
+OP_RPC_MAP = {
+    ClusterOp.ADD_ROOT_BLOCK_REQUEST: (
+        ClusterOp.ADD_ROOT_BLOCK_RESPONSE,
+        handle_add_root_block_request,
+    ),
+    ClusterOp.ADD_XSHARD_TX_LIST_REQUEST: (
+        ClusterOp.ADD_XSHARD_TX_LIST_RESPONSE,
+        handle_add_xshard_tx_list_request,
+    ),
+}
+
+
+class MasterSlaveConnection(ClusterConnection):
+    def __init__(self, reader, writer):
+        super().__init__(
+            DEFAULT_ENV, reader, writer, CLUSTER_OP_SERIALIZER_MAP, {}, OP_RPC_MAP
+        )
+
+    def get_connection_to_forward(self, metadata):
+        return None
+
+
+class SlaveSlaveConnection(Connection):
+    def __init__(self, reader, writer):
+        super().__init__(
+            DEFAULT_ENV,
+            reader,
+            writer,
+            CLUSTER_OP_SERIALIZER_MAP,
+            {},
+            OP_RPC_MAP,
+            metadata_class=ClusterMetadata,
+        )
+
+
+def create_root_block_request(header_count):
+    root_block = RootBlock(RootBlockHeader())
+    for i in range(header_count):
+        root_block.add_minor_block_header(MinorBlockHeader(height=i))
+    return AddRootBlockRequest(root_block, False)
+
+
+def create_xshard_tx_list_request(deposit_count):
+    from_address = Address.create_random_account(0)
+    to_address = Address.create_random_account(1)
+    tx_list = [
+        CrossShardTransactionDeposit(
+            tx_hash=i.to_bytes(32, byteorder="big"),
+            from_address=from_address,
+            to_address=to_address,
+            value=i,
+            gas_price=1,
+            gas_token_id=1,
+            transfer_token_id=1,
+        )
+        for i in range(deposit_count)
+    ]
+    return AddXshardTxListRequest(
+        Branch(2), bytes(32), CrossShardTransactionList(tx_list)
+    )
+
+
+async def run_link(name, conn_class, op, request, rounds):
+    server_conns = []
+
+    def on_connect(reader, writer):
+        conn = conn_class(reader, writer)
+        server_conns.append(conn)
+        asyncio.ensure_future(conn.active_and_loop_forever())
+
+    server = await asyncio.start_server(on_connect, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    conn = conn_class(reader, writer)
+    asyncio.ensure_future(conn.active_and_loop_forever())
+    await conn.wait_until_active()
+
+    payload_size = len(request.serialize())
+    start_time = time.time()
+    for _ in range(rounds):
+        await conn.write_rpc_request(op, request, ClusterMetadata())
+    duration = time.time() - start_time
+
+    print(
+        "%s: payload %d bytes, %.2f RPC/s, %.2f MB/s"
+        % (
+            name,
+            payload_size,
+            rounds / duration,
+            payload_size * rounds / duration / 1024 / 1024,
+        )
+    )
+
+    conn.close()
+    for c in server_conns:
+        c.close()
+    server.close()
+    await server.wait_closed()
+
+
+def test_perf(rounds=200, header_count=1000, deposit_count=5000):
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(
+        run_link(
+            "master<->slave",
+            MasterSlaveConnection,
+            ClusterOp.ADD_ROOT_BLOCK_REQUEST,
+            create_root_block_request(header_count),
+            rounds,
+        )
+    )
+    loop.run_until_complete(
+        run_link(
+            "slave<->slave",
+            SlaveSlaveConnection,
+            ClusterOp.ADD_XSHARD_TX_LIST_REQUEST,
+            create_xshard_tx_list_request(deposit_count),
+            rounds,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", default=200, type=int)
+    parser.add_argument("--header_count", default=1000, type=int)
+    parser.add_argument("--deposit_count", default=5000, type=int)
+    parser.add_argument("--profile", default=False)
+    args = parser.parse_args()
+
+    if args.profile:
+        profile.run(
+            "test_perf({}, {}, {})".format(
+                args.rounds, args.header_count, args.deposit_count
+            )
+        )
+    else:
+        test_perf(args.rounds, args.header_count, args.deposit_count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# Performance of the EVM interpreter
+#
+# Runs loops of a few opcode mixes through quarkchain.evm.vm.vm_execute with a
+# stub external environment, so that only the interpreter is measured:
+# - arithmetic: stack, arithmetic and comparison opcodes
+# - memory: MSTORE / MLOAD
+# - sha3: SHA3 over one word of memory
+# - codecopy: CODECOPY of 1KB, mostly zero padding, to memory
+# and short calls into a large contract, with the code analysis cached by code
+# hash as for contracts in the state, and without the cache as for init code
+
+import argparse
+import profile
+import time
+
+from quarkchain.evm import opcodes, utils
+from quarkchain.evm.vm import code_cache, Message, VmExtBase, vm_execute
+
+
+def assemble(*items):
+    """ Opcode names and push values (PUSH1 / PUSH2 prefixed) to bytecode """
+    code = b""
+    for item in items:
+        if isinstance(item, int):
+            size = 1 if item < 256 else 2
+            code += bytes([0x5F + size]) + item.to_bytes(size, byteorder="big")
+        else:
+            code += bytes([opcodes.reverse_opcodes[item]])
+    return code
+
+
+def loop(count, *body):
+    """ Runs body count times, body must leave the stack as it was """
+    # the counter is pushed with PUSH2 so the loop starts at 3
+    return assemble(
+        count, "JUMPDEST", *body, 1, "SWAP1", "SUB", "DUP1", 3, "JUMPI", "STOP"
+    )
+
+
+def create_programs(count):
+    return [
+        (
+            "arithmetic",
+            loop(
+                count,
+                "DUP1",
+                "DUP1",
+                "MUL",
+                7,
+                "AND",
+                "DUP2",
+                "ADD",
+                "DUP1",
+                "ISZERO",
+                "SWAP1",
+                5,
+                "LT",
+                "OR",
+                "POP",
+            ),
+        ),
+        ("memory", loop(count, "DUP1", 0, "MSTORE", 0, "MLOAD", "POP")),
+        ("sha3", loop(count, "DUP1", 0, "MSTORE", 32, 0, "SHA3", "POP")),
+        ("codecopy", loop(count, 1024, 0, 0, "CODECOPY")),
+    ]
+
+
+def run_calls(ext, code, code_hash, calls):
+    start_time = time.time()
+    for _ in range(calls):
+        result, _, _ = vm_execute(ext, Message(b"", b"", gas=10 ** 6), code, code_hash)
+        assert result == 1
+    duration = time.time() - start_time
+    print(
+        "short calls %s cache: %d bytes of code, %.2f calls/s"
+        % ("with" if code_hash else "without", len(code), calls / duration)
+    )
+
+
+def test_perf(count=10000, rounds=10, calls=2000):
+    ext = VmExtBase()
+    for name, code in create_programs(count):
+        gas = 10 ** 9
+        start_time = time.time()
+        for _ in range(rounds):
+            result, gas_left, _ = vm_execute(
+                ext, Message(b"", b"", gas=gas), code, utils.sha3(code)
+            )
+            assert result == 1
+        duration = time.time() - start_time
+        print(
+            "%s: %d bytes of code, %.2f loops/s, %.2f Mgas/s"
+            % (
+                name,
+                len(code),
+                count * rounds / duration,
+                (gas - gas_left) * rounds / duration / 10 ** 6,
+            )
+        )
+
+    # An ERC20 sized contract returning right away
+    code = assemble(1, 0, "MSTORE", 32, 0, "RETURN") + assemble(
+        *(["JUMPDEST", 2 ** 15, "DUP1", "ADD", "POP"] * 1000)
+    )
+    run_calls(ext, code, None, calls)
+    run_calls(ext, code, utils.sha3(code), calls)
+    print("code cache", code_cache.get_stats())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", default=10000, type=int)
+    parser.add_argument("--rounds", default=10, type=int)
+    parser.add_argument("--calls", default=2000, type=int)
+    parser.add_argument("--profile", default=False)
+    args = parser.parse_args()
+
+    if args.profile:
+        profile.run("test_perf({}, {}, {})".format(args.count, args.rounds, args.calls))
+    else:
+        test_perf(args.count, args.rounds, args.calls)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
+import json
 from fractions import Fraction
 
+import rlp
+
 from quarkchain.config import QuarkChainConfig
 from quarkchain.core import (
     Address,
@@ -12,7 +15,14 @@ from quarkchain.core import (
     TokenBalanceMap,
     XshardTxCursorInfo,
 )
-from quarkchain.evm.state import State as EvmState
+from quarkchain.evm.state import (
+    BLANK_HASH,
+    BLANK_ROOT,
+    State as EvmState,
+    TokenBalances,
+    _Account,
+)
+from quarkchain.evm.trie import Trie
 from quarkchain.utils import sha3_256, check, token_id_encode
 
 
@@ -49,19 +59,7 @@ class GenesisManager:
         shard_config = self._qkc_config.shards[full_shard_id]
         genesis = shard_config.GENESIS
 
-        for address_hex, alloc_amount in genesis.ALLOC.items():
-            address = Address.create_from(bytes.fromhex(address_hex))
-            check(
-                self._qkc_config.get_full_shard_id_by_full_shard_key(
-                    address.full_shard_key
-                )
-                == full_shard_id
-            )
-            evm_state.full_shard_key = address.full_shard_key
-            for k, v in alloc_amount.items():
-                evm_state.delta_token_balance(address.recipient, token_id_encode(k), v)
-
-        evm_state.commit()
+        evm_state.trie.root_hash = self._get_alloc_state_root(full_shard_id, evm_state)
 
         meta = MinorBlockMeta(
             hash_merkle_root=bytes.fromhex(genesis.HASH_MERKLE_ROOT),
@@ -96,3 +94,62 @@ class GenesisManager:
             MinorBlock(header=header, meta=meta, tx_list=[]),
             TokenBalanceMap(coinbase_tokens),
         )
+
+    def _get_alloc_state_root(self, full_shard_id: int, evm_state: EvmState) -> bytes:
+        """ Builds the state trie of ALLOC in the db of evm_state, unless it was
+        built already for the same ALLOC, and returns its root.
+        """
+        check(evm_state.trie.root_hash == BLANK_ROOT)
+        genesis = self._qkc_config.shards[full_shard_id].GENESIS
+        db = evm_state.db
+        cache_key = b"genesis_state_root:" + sha3_256(
+            full_shard_id.to_bytes(4, "big")
+            + json.dumps(genesis.ALLOC, sort_keys=True).encode()
+        )
+        root = db.get(cache_key)
+        if root is not None and (root == BLANK_ROOT or root in db):
+            return root
+
+        # the accounts are created by their first allocation
+        accounts = dict()  # recipient -> (full shard key, token balances)
+        for address_hex, alloc_amount in genesis.ALLOC.items():
+            address = Address.create_from(bytes.fromhex(address_hex))
+            check(
+                self._qkc_config.get_full_shard_id_by_full_shard_key(
+                    address.full_shard_key
+                )
+                == full_shard_id
+            )
+            if address.recipient not in accounts:
+                accounts[address.recipient] = (
+                    address.full_shard_key,
+                    TokenBalances(b"", db),
+                )
+            balances = accounts[address.recipient][1].balances
+            for k, v in alloc_amount.items():
+                token_id = token_id_encode(k)
+                balances[token_id] = balances.get(token_id, 0) + v
+
+        items = []
+        for recipient, (full_shard_key, token_balances) in accounts.items():
+            if token_balances.is_empty():
+                continue
+            account = _Account(
+                evm_state.config["ACCOUNT_INITIAL_NONCE"],
+                token_balances.serialize(),
+                BLANK_ROOT,
+                BLANK_HASH,
+                full_shard_key,
+                b"",
+            )
+            items.append((sha3_256(recipient), recipient, rlp.encode(account)))
+        items.sort()
+        if items:
+            db.put(BLANK_HASH, b"")
+        # the preimages of the secure trie keys
+        db.put_many([(h, recipient) for h, recipient, _ in items])
+        root = Trie.from_sorted_items(
+            db, [(h, account) for h, _, account in items]
+        ).root_hash
+        db.put(cache_key, root)
+        return root
@@ -169,7 +169,6 @@ class SecurePeer(Peer):
     Peer.handle_new_minor_block_header_list
     Peer.handle_new_transaction_list
     Peer.send_hello
-    Peer.send_transaction
     Peer.send_updated_tip
     AbstractConnection.__handle_request
     AbstractConnection.__handle_rpc_request
@@ -280,6 +279,7 @@ class SecurePeer(Peer):
     def write_raw_data(self, metadata, raw_data):
         """ Override Connection.write_raw_data()
         """
+        self.bytes_sent[raw_data[0]] += len(raw_data)
         # NOTE QuarkChain serialization returns bytearray
         self.quark_peer.send_raw_bytes(bytes(metadata.serialize() + raw_data))
 
@@ -1,7 +1,9 @@
 import asyncio
-from enum import Enum
+import time
+from collections import deque
+from enum import Enum, IntEnum
 
-from quarkchain.core import Serializable
+from quarkchain.core import ByteBuffer, Serializable
 from quarkchain.utils import Logger
 
 ROOT_SHARD_ID = 0
@@ -13,6 +15,32 @@ class ConnectionState(Enum):
     CLOSED = 2  # the peer connection is closed
 
 
+class RpcPriority(IntEnum):
+    """ Lanes of outgoing RPC requests, each bounded by its own in-flight window """
+
+    CONSENSUS = 0  # block and header propagation
+    SYNC = 1  # catching up with the peer
+    USER = 2  # queries on behalf of users
+
+
+class RpcLaneStats:
+    def __init__(self):
+        self.queued_count = 0  # requests ever queued because the lane was full
+        self.max_queue_length = 0
+        self.total_wait_time = 0.0  # seconds spent in the queue by sent requests
+        self.cancelled_count = 0  # requests abandoned by the caller while queued
+
+    def to_dict(self, queue_length, in_flight_count):
+        return {
+            "queueLength": queue_length,
+            "inFlight": in_flight_count,
+            "queuedCount": self.queued_count,
+            "maxQueueLength": self.max_queue_length,
+            "totalWaitTime": self.total_wait_time,
+            "cancelledCount": self.cancelled_count,
+        }
+
+
 class Metadata(Serializable):
     """ Metadata contains the extra info that needs to be encoded in the RPC layer"""
 
@@ -53,6 +81,14 @@ class AbstractConnection:
         self.peer_rpc_id = -1
         self.rpc_id = 0  # 0 is for non-rpc (fire-and-forget)
         self.rpc_future_map = dict()
+        # Outgoing RPC flow control, see set_rpc_flow_control()
+        self.op_priority_map = dict()
+        self.rpc_window_list = [0] * len(RpcPriority)
+        self.rpc_in_flight_list = [0] * len(RpcPriority)
+        self.rpc_queue_list = [deque() for _ in RpcPriority]
+        self.rpc_lane_stats_list = [RpcLaneStats() for _ in RpcPriority]
+        # rpc_id -> lane of the in-flight requests that count against a window
+        self.rpc_lane_map = dict()
         loop = loop if loop else asyncio.get_event_loop()
         self.active_future = loop.create_future()
         self.close_future = loop.create_future()
@@ -71,7 +107,8 @@ class AbstractConnection:
         op = raw_data[0]
         rpc_id = int.from_bytes(raw_data[1:9], byteorder="big")
         ser = self.op_ser_map[op]
-        cmd = ser.deserialize(raw_data[9:])
+        # deserialize in place instead of copying the command body out
+        cmd = ser.deserialize(ByteBuffer(raw_data, position=9))
         return op, cmd, rpc_id
 
     async def read_command(self):
@@ -101,18 +138,75 @@ class AbstractConnection:
         self.write_raw_command(op, data, rpc_id, metadata)
 
     def write_rpc_request(self, op, cmd, metadata=None):
+        return self.write_raw_rpc_request(op, cmd.serialize(), metadata)
+
+    def write_raw_rpc_request(self, op, cmd_data, metadata=None):
         rpc_future = asyncio.Future()
 
         if self.state != ConnectionState.ACTIVE:
             rpc_future.set_exception(RuntimeError("Peer connection is not active"))
             return rpc_future
 
+        lane = self.op_priority_map.get(op, None)
+        window = self.rpc_window_list[lane] if lane is not None else 0
+        if window > 0 and (
+            self.rpc_queue_list[lane] or self.rpc_in_flight_list[lane] >= window
+        ):
+            queue = self.rpc_queue_list[lane]
+            queue.append((op, cmd_data, metadata, rpc_future, time.time()))
+            stats = self.rpc_lane_stats_list[lane]
+            stats.queued_count += 1
+            stats.max_queue_length = max(stats.max_queue_length, len(queue))
+            return rpc_future
+
+        self.__send_rpc_request(op, cmd_data, metadata, rpc_future, lane)
+        return rpc_future
+
+    def __send_rpc_request(self, op, cmd_data, metadata, rpc_future, lane):
         self.rpc_id += 1
         rpc_id = self.rpc_id
         self.rpc_future_map[rpc_id] = rpc_future
+        if lane is not None:
+            self.rpc_in_flight_list[lane] += 1
+            self.rpc_lane_map[rpc_id] = lane
 
-        self.write_command(op, cmd, rpc_id, metadata)
-        return rpc_future
+        self.write_raw_command(op, cmd_data, rpc_id, metadata)
+
+    def __release_rpc_lane(self, rpc_id):
+        lane = self.rpc_lane_map.pop(rpc_id, None)
+        if lane is None:
+            return
+        self.rpc_in_flight_list[lane] -= 1
+
+        # Refill the freed slot, dropping requests whose caller has given up
+        queue = self.rpc_queue_list[lane]
+        stats = self.rpc_lane_stats_list[lane]
+        window = self.rpc_window_list[lane]
+        while queue and (window <= 0 or self.rpc_in_flight_list[lane] < window):
+            op, cmd_data, metadata, rpc_future, queued_time = queue.popleft()
+            if rpc_future.done():
+                stats.cancelled_count += 1
+                continue
+            stats.total_wait_time += time.time() - queued_time
+            self.__send_rpc_request(op, cmd_data, metadata, rpc_future, lane)
+
+    def set_rpc_flow_control(self, op_priority_map, window_list):
+        """ Bound the number of in-flight RPC requests per priority lane.
+        op_priority_map maps request ops to RpcPriority lanes, and window_list holds
+        the max in-flight requests of each lane (0 for unbounded).
+        Requests beyond the window are queued and sent as responses come back,
+        so a busy low priority lane cannot crowd out the higher ones on the peer.
+        """
+        self.op_priority_map = op_priority_map
+        self.rpc_window_list = list(window_list)
+
+    def get_rpc_lane_stats(self):
+        return {
+            lane.name.lower(): self.rpc_lane_stats_list[lane].to_dict(
+                len(self.rpc_queue_list[lane]), self.rpc_in_flight_list[lane]
+            )
+            for lane in RpcPriority
+        }
 
     def __write_rpc_response(self, op, cmd, rpc_id, metadata):
         self.write_command(op, cmd, rpc_id, metadata)
@@ -158,6 +252,7 @@ class AbstractConnection:
                 )
             future = self.rpc_future_map[rpc_id]
             del self.rpc_future_map[rpc_id]
+            self.__release_rpc_lane(rpc_id)
             if not future.cancelled():
                 future.set_result((op, cmd, rpc_id))
 
@@ -200,6 +295,16 @@ class AbstractConnection:
             future.set_exception(RuntimeError("{}: connection abort".format(self.name)))
         AbstractConnection.aborted_rpc_count += len(self.rpc_future_map)
         self.rpc_future_map.clear()
+        self.rpc_lane_map.clear()
+
+        # and the ones still waiting for a window slot
+        for queue in self.rpc_queue_list:
+            for _, _, _, future, _ in queue:
+                if not future.done():
+                    future.set_exception(
+                        RuntimeError("{}: connection abort".format(self.name))
+                    )
+            queue.clear()
 
     async def wait_until_active(self):
         await self.active_future
@@ -250,32 +355,27 @@ class Connection(AbstractConnection):
         self.command_size_limit = command_size_limit
 
     async def __read_fully(self, n, allow_eof=False):
-        ba = bytearray()
-        bs = await self.reader.read(n)
-        if allow_eof and len(bs) == 0 and self.reader.at_eof():
-            return None
-
-        ba.extend(bs)
-        while len(ba) < n:
-            bs = await self.reader.read(n - len(ba))
-            if len(bs) == 0 and self.reader.at_eof():
-                raise RuntimeError("{}: read unexpected EOF".format(self.name))
-            ba.extend(bs)
-        return ba
+        try:
+            return await self.reader.readexactly(n)
+        except asyncio.IncompleteReadError as e:
+            if allow_eof and len(e.partial) == 0:
+                return None
+            raise RuntimeError("{}: read unexpected EOF".format(self.name))
 
     async def read_metadata_and_raw_data(self):
         """ Override AbstractConnection.read_metadata_and_raw_data()
         """
-        size_bytes = await self.__read_fully(4, allow_eof=True)
-        if size_bytes is None:
+        # size and metadata have fixed length, read them in one go
+        metadata_size = self.metadata_class.get_byte_size()
+        header_bytes = await self.__read_fully(4 + metadata_size, allow_eof=True)
+        if header_bytes is None:
             return None, None
-        size = int.from_bytes(size_bytes, byteorder="big")
+        size = int.from_bytes(header_bytes[:4], byteorder="big")
 
         if self.command_size_limit is not None and size > self.command_size_limit:
             raise RuntimeError("{}: command package exceed limit".format(self.name))
 
-        metadata_bytes = await self.__read_fully(self.metadata_class.get_byte_size())
-        metadata = self.metadata_class.deserialize(metadata_bytes)
+        metadata = self.metadata_class.deserialize(ByteBuffer(header_bytes, position=4))
 
         raw_data_without_size = await self.__read_fully(1 + 8 + size)
         return metadata, raw_data_without_size
@@ -284,9 +384,8 @@ class Connection(AbstractConnection):
         """ Override AbstractConnection.write_raw_data()
         """
         cmd_length_bytes = (len(raw_data) - 8 - 1).to_bytes(4, byteorder="big")
-        self.writer.write(cmd_length_bytes)
-        self.writer.write(metadata.serialize())
-        self.writer.write(raw_data)
+        # a single write lets the transport send the frame with one syscall
+        self.writer.write(b"".join((cmd_length_bytes, metadata.serialize(), raw_data)))
 
     def close(self):
         """ Override AbstractConnection.close()
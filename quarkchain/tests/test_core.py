@@ -2,6 +2,7 @@ import unittest
 
 from typing import Dict
 
+import rlp
 from eth_keys import KeyAPI
 
 from quarkchain.core import (
@@ -25,6 +26,7 @@ from quarkchain.core import (
     TypedTransaction,
     SerializedEvmTransaction,
     calculate_merkle_root,
+    mk_receipt_sha,
     sha3_256,
 )
 from quarkchain.cluster.tests.test_utils import (
@@ -32,7 +34,9 @@ from quarkchain.cluster.tests.test_utils import (
     get_test_env,
 )
 
+from quarkchain.db import InMemoryDb
 from quarkchain.utils import check, p2_roundup, SHARD_KEY_MAX, TOKEN_ID_MAX
+from quarkchain.evm import trie
 from quarkchain.evm.transactions import Transaction as EvmTransaction
 from quarkchain.evm.utils import TT256
 
@@ -183,6 +187,48 @@ class TestRootBlockHeaderSignature(unittest.TestCase):
         self.assertTrue(header.verify_signature(private_key.public_key))
 
 
+class TestHeaderHashCache(unittest.TestCase):
+    def test_minor_block_header(self):
+        header = MinorBlockHeader(height=1)
+        h = header.get_hash()
+        mh = header.get_hash_for_mining()
+        self.assertEqual(h, sha3_256(header.serialize()))
+
+        # nonce and mixhash are not part of the mining hash
+        header.nonce = 123
+        header.mixhash = bytes([1] * 32)
+        self.assertNotEqual(header.get_hash(), h)
+        self.assertEqual(header.get_hash(), sha3_256(header.serialize()))
+        self.assertEqual(header.get_hash_for_mining(), mh)
+
+        header.height = 2
+        self.assertNotEqual(header.get_hash_for_mining(), mh)
+        self.assertEqual(
+            header.get_hash_for_mining(),
+            sha3_256(header.serialize_without(["nonce", "mixhash"])),
+        )
+
+        header1 = MinorBlockHeader.deserialize(header.serialize())
+        self.assertEqual(header1.get_hash(), header.get_hash())
+        self.assertEqual(header1.get_hash_for_mining(), header.get_hash_for_mining())
+
+    def test_root_block_header(self):
+        header = RootBlockHeader(height=1)
+        h = header.get_hash()
+        mh = header.get_hash_for_mining()
+
+        private_key = KeyAPI.PrivateKey(Identity.create_random_identity().get_key())
+        header.sign_with_private_key(private_key)
+        self.assertNotEqual(header.get_hash(), h)
+        self.assertEqual(header.get_hash(), sha3_256(header.serialize()))
+        self.assertEqual(header.get_hash_for_mining(), mh)
+        self.assertTrue(header.verify_signature(private_key.public_key))
+
+        header.coinbase_amount_map = TokenBalanceMap({1: 2})
+        self.assertNotEqual(header.get_hash_for_mining(), mh)
+        self.assertFalse(header.verify_signature(private_key.public_key))
+
+
 class SimpleHeaderV0(Serializable):
     FIELDS = [("version", uint32), ("value", uint32)]
 
@@ -376,3 +422,13 @@ class TestCalculateMerkleTree(unittest.TestCase):
             hash0 = calculate_merkle_root(item_list)
             hash1 = calculate_merkle_root1(item_list)
             self.assertEqual(hash0, hash1)
+
+
+class TestReceiptSha(unittest.TestCase):
+    def test_receipt_sha(self):
+        for n in [0, 1, 2, 127, 128, 129, 300]:
+            receipts = [b"receipt %d" % i for i in range(n)]
+            t = trie.Trie(InMemoryDb())
+            for i, receipt in enumerate(receipts):
+                t.update(rlp.encode(i), rlp.encode(receipt))
+            self.assertEqual(mk_receipt_sha(receipts, InMemoryDb()), t.root_hash)
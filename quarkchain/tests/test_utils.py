@@ -1,7 +1,9 @@
 import pytest
 import random
+import time
 
 from quarkchain.utils import token_id_encode, token_id_decode, TOKEN_MAX, TOKEN_ID_MAX
+from quarkchain.utils import RecentHashSet
 
 
 ENCODED_VALUES = [
@@ -47,3 +49,29 @@ def test_token_id_exceptions():
         token_id_decode(-1)
     with pytest.raises(AssertionError):
         token_id_decode(TOKEN_ID_MAX + 1)
+
+
+def test_recent_hash_set(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    hashes = RecentHashSet(limit=3, ttl=10)
+    for h in (b"a", b"b", b"c"):
+        hashes.add(h)
+    assert b"a" in hashes and len(hashes) == 3
+
+    # the oldest hash is dropped beyond the limit, adding again refreshes one
+    hashes.add(b"a")
+    hashes.add(b"d")
+    assert b"b" not in hashes
+    assert [h in hashes for h in (b"a", b"c", b"d")] == [True, True, True]
+
+    now[0] += 5
+    hashes.add(b"e")
+    hashes.discard(b"d")
+    assert len(hashes) == 2
+
+    # expired hashes are not found, and dropped when adding
+    now[0] += 5
+    assert b"e" in hashes and b"c" not in hashes
+    hashes.add(b"f")
+    assert list(hashes.hashes) == [b"e", b"f"]
@@ -1,13 +1,15 @@
 import argparse
 import copy
 import functools
+import json
 import logging
 import random
 import signal
+import socket
 import threading
 import time
 from itertools import cycle
-from typing import Dict, Optional, List, Tuple
+from typing import Dict, Iterator, Optional, List, Tuple
 
 import jsonrpcclient
 from queue import LifoQueue
@@ -71,6 +73,45 @@ def submit_work_rpc(
     return success
 
 
+def subscribe_work(
+    full_shard_ids: List[Optional[int]], stopper: threading.Event, host: str, port: int
+) -> Iterator[Tuple[Optional[int], MiningWork]]:
+    """Yields the work pushed by the cluster for the shards (None for root)
+    until stopper is set, reconnecting on errors"""
+    request = json.dumps(
+        {"subscribe": [None if i is None else hex(i) for i in full_shard_ids]}
+    )
+    while not stopper.is_set():
+        try:
+            with socket.create_connection((host, port), timeout=TIMEOUT) as sock:
+                sock.sendall(request.encode() + b"\n")
+                # wake up to check the stopper
+                sock.settimeout(1)
+                buf = b""
+                while not stopper.is_set():
+                    try:
+                        data = sock.recv(4096)
+                    except socket.timeout:
+                        continue
+                    if not data:
+                        raise ConnectionError("connection closed by the cluster")
+                    *lines, buf = (buf + data).split(b"\n")
+                    for line in lines:
+                        msg = json.loads(line)
+                        if "error" in msg:
+                            print("Failed to subscribe to work", msg["error"])
+                            continue
+                        key = msg["fullShardKey"]
+                        yield None if key is None else int(key, 16), MiningWork(
+                            bytes.fromhex(msg["headerHash"][2:]),
+                            int(msg["height"], 16),
+                            int(msg["difficulty"], 16),
+                        )
+        except (OSError, ValueError) as e:
+            print("Failed to receive work, reconnecting...", e)
+            stopper.wait(1)
+
+
 def repr_shard(full_shard_id: Optional[int]):
     if full_shard_id is None:
         return "ROOT"
@@ -83,10 +124,12 @@ def repr_shard(full_shard_id: Optional[int]):
 class ExternalMiner(threading.Thread):
     """One external miner could handles multiple shards."""
 
-    def __init__(self, configs, stopper: threading.Event):
+    def __init__(self, configs, stopper: threading.Event, push_port: int = 0):
         super().__init__()
         self.configs = configs
         self.stopper = stopper
+        # receive the work pushed by the cluster instead of polling if set
+        self.push_port = push_port
         self.input_q = LifoQueue()
         self.output_q = LifoQueue()
 
@@ -102,7 +145,50 @@ class ExternalMiner(threading.Thread):
             # shard -> work
             existing_work = {}  # type: Dict[int, MiningWork]
             mining_thread = None
-            while not stopper.is_set():
+
+            def add_work(config, work):
+                nonlocal mining_thread
+                full_shard_id = config["full_shard_id"]
+                # skip duplicate work
+                if (
+                    full_shard_id in existing_work
+                    and existing_work[full_shard_id].hash == work.hash
+                ):
+                    return
+                # bookkeeping
+                existing_work[full_shard_id] = work
+                work_map[work.hash] = (work, full_shard_id)
+
+                mining_params = {
+                    "consensus_type": config["consensus_type"],
+                    "shard": full_shard_id,
+                    "target_time": config["target_block_time"] + time.time(),
+                    "rounds": 100,
+                }
+                if mining_thread:
+                    input_q.put((work, mining_params))
+                    print(
+                        "Added work to queue of %s height %d"
+                        % (repr_shard(full_shard_id), work.height)
+                    )
+                else:
+                    # start the thread to mine
+                    mining_thread = threading.Thread(
+                        target=Miner.mine_loop,
+                        args=(work, mining_params, input_q, output_q),
+                    )
+                    mining_thread.start()
+                    print("Started mining thread on %s" % repr_shard(full_shard_id))
+
+            if self.push_port:
+                config_map = {config["full_shard_id"]: config for config in configs}
+                for full_shard_id, work in subscribe_work(
+                    list(config_map), stopper, host=cluster_host, port=self.push_port
+                ):
+                    if full_shard_id in config_map:
+                        add_work(config_map[full_shard_id], work)
+
+            while not self.push_port and not stopper.is_set():
                 total_wait_time = random.uniform(2.0, 3.0)
                 random.shuffle(configs)
                 for config in configs:
@@ -120,36 +206,7 @@ class ExternalMiner(threading.Thread):
                             e,
                         )
                         continue
-                    # skip duplicate work
-                    if (
-                        full_shard_id in existing_work
-                        and existing_work[full_shard_id].hash == work.hash
-                    ):
-                        continue
-                    # bookkeeping
-                    existing_work[full_shard_id] = work
-                    work_map[work.hash] = (work, full_shard_id)
-
-                    mining_params = {
-                        "consensus_type": config["consensus_type"],
-                        "shard": full_shard_id,
-                        "target_time": config["target_block_time"] + time.time(),
-                        "rounds": 100,
-                    }
-                    if mining_thread:
-                        input_q.put((work, mining_params))
-                        print(
-                            "Added work to queue of %s height %d"
-                            % (repr_shard(full_shard_id), work.height)
-                        )
-                    else:
-                        # start the thread to mine
-                        mining_thread = threading.Thread(
-                            target=Miner.mine_loop,
-                            args=(work, mining_params, input_q, output_q),
-                        )
-                        mining_thread.start()
-                        print("Started mining thread on %s" % repr_shard(full_shard_id))
+                    add_work(config, work)
 
             # loop stopped, notify the mining thread
             if mining_thread:
@@ -226,6 +283,12 @@ def main():
     parser.add_argument(
         "--host", type=str, help="host address of the cluster", default="localhost"
     )
+    parser.add_argument(
+        "--push_port",
+        type=int,
+        help="receive work pushed by the cluster on its mining push port instead of polling",
+        default=0,
+    )
     args = parser.parse_args()
 
     with open(args.config) as f:
@@ -262,7 +325,7 @@ def main():
     miners = []
     stopper = threading.Event()
     for config_list in worker_configs:
-        ext_miner = ExternalMiner(config_list, stopper)
+        ext_miner = ExternalMiner(config_list, stopper, args.push_port)
         ext_miner.start()
         miners.append(ext_miner)
 
@@ -8,6 +8,7 @@ import re
 import sys
 import time
 import traceback
+from collections import OrderedDict
 
 from eth_utils import keccak
 
@@ -354,10 +355,8 @@ class Logger:
                 "level": level_str,
                 "message": msg,
             }
-            asyncio.ensure_future(
-                cls._kafka_logger.log_kafka_sample_async(
-                    cls._kafka_logger.cluster_config.MONITORING.ERRORS, sample
-                )
+            cls._kafka_logger.add_kafka_sample(
+                cls._kafka_logger.cluster_config.MONITORING.ERRORS, sample
             )
 
     @classmethod
@@ -447,6 +446,36 @@ def time_ms():
     return int(time.time() * 1e3)
 
 
+class RecentHashSet:
+    """ The hashes added recently, forgetting the oldest ones beyond limit or
+    after ttl seconds
+    """
+
+    def __init__(self, limit, ttl):
+        self.limit = limit
+        self.ttl = ttl
+        self.hashes = OrderedDict()  # hash -> time added
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, h):
+        added = self.hashes.get(h)
+        return added is not None and time.time() - added < self.ttl
+
+    def add(self, h):
+        self.hashes.pop(h, None)
+        self.hashes[h] = time.time()
+        expiry = time.time() - self.ttl
+        while len(self.hashes) > self.limit or (
+            self.hashes and next(iter(self.hashes.values())) <= expiry
+        ):
+            self.hashes.popitem(last=False)
+
+    def discard(self, h):
+        self.hashes.pop(h, None)
+
+
 SHARD_KEY_MAX = (256 ** 4) - 1
 
 TOKEN_BASE = 36